@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic "lsblk -J" trees, mountinfo text and history files for the
+benchmarks; no root or real devices needed.
+"""
+# pylint: disable=invalid-name
+
+import json
+import hashlib
+
+BASE_MOUNTS = [ # (majmin, upon, fstype, source, options)
+    ('254:0', '/', 'ext4', '/dev/vda', 'rw,relatime'),
+    ('0:22', '/proc', 'proc', 'proc', 'rw,nosuid,nodev,noexec,relatime'),
+    ('0:23', '/sys', 'sysfs', 'sysfs', 'rw,nosuid,nodev,noexec,relatime'),
+    ('0:6', '/dev', 'devtmpfs', 'devtmpfs', 'rw,nosuid'),
+    ('0:25', '/run', 'tmpfs', 'tmpfs', 'rw,nosuid,nodev'),
+    ('0:26', '/tmp', 'tmpfs', 'tmpfs', 'rw,nosuid,nodev'),
+]
+
+def fake_uuid(*parts):
+    """ A stable, UUID-looking string """
+    hx = hashlib.sha256('/'.join(str(p) for p in parts).encode()).hexdigest()
+    return f'{hx[:8]}-{hx[8:12]}-{hx[12:16]}-{hx[16:20]}-{hx[20:32]}'
+
+def escape(path):
+    """ Escape a path the way the kernel does in mountinfo """
+    return (path.replace('\\', '\\134').replace(' ', '\\040')
+            .replace('\t', '\\011').replace('\n', '\\012'))
+
+def _dev(name, majmin, dev_type, size='16G', fstype=None, uuid=None, ro=False,
+         mounts=None, children=None, back_file=None):
+    rv = {'name': name, 'maj:min': majmin, 'type': dev_type, 'ro': ro,
+          'fstype': fstype, 'label': None, 'partlabel': None, 'fsuse%': None,
+          'size': size, 'uuid': uuid, 'mountpoints': mounts or [None]}
+    if back_file:
+        rv['back-file'] = back_file
+    if children:
+        rv['children'] = children
+    return rv
+
+def make_fixture(count, parts_per_disk=4):
+    """ Make a system with `count` LUKS containers. Per ten containers:
+        - 2 locked partitions
+        - 2 opened and mounted read-write (one at a path with a space)
+        - 2 opened and mounted read-only
+        - 2 file containers on loop devices (mounted)
+        - 1 opened but not mounted (an anomaly)
+        - 1 opened and mounted at a banned mount point (/home)
+        Disks also hold a plain ext4 partition each (noise).
+        Returns (blockdevices, mountinfo_text, vitals) where vitals is
+        the history JSON for the containers.
+    """
+    disks, loops, mounts, vitals = [], [], list(BASE_MOUNTS), {}
+    parts, disk_idx, minor = [], 0, 0
+
+    def flush_disk():
+        nonlocal parts, disk_idx
+        if parts:
+            name = f'nvme{disk_idx}n1'
+            plain = _dev(f'{name}p{len(parts)+1}', f'259:{9000+disk_idx}', 'part',
+                         fstype='ext4', uuid=fake_uuid('plain', disk_idx))
+            disks.append(_dev(name, f'259:{8000+disk_idx}', 'disk', size='1.8T',
+                              children=parts + [plain]))
+            disk_idx += 1
+            parts = []
+
+    for idx in range(count):
+        kind = idx % 10
+        uuid = fake_uuid('luks', idx)
+        mapper = f'luks-{uuid}'
+        minor += 1
+        crypt_majmin = f'252:{minor}'
+        upon, ro, child = None, False, None
+        if kind in (2, 3):
+            upon = f'/media/user/vault {idx}' if kind == 3 else f'/media/user/vault{idx}'
+        elif kind in (4, 5):
+            upon, ro = f'/mnt/ro{idx}', True
+        elif kind == 9:
+            upon = '/home'
+        if kind in (2, 3, 4, 5, 8, 9):
+            child = _dev(mapper, crypt_majmin, 'crypt', fstype='ext4',
+                         uuid=fake_uuid('fs', idx), ro=ro, mounts=[upon] if upon else None)
+        if upon:
+            mounts.append((crypt_majmin, upon, 'ext4', f'/dev/mapper/{mapper}',
+                           'ro,relatime' if ro else 'rw,relatime'))
+
+        if kind in (6, 7): # file container
+            back_file = f'/home/user/.Vaults/file{idx}.luks'
+            upon = f'/home/user/Vaults/file{idx}'
+            child = _dev(mapper, crypt_majmin, 'crypt', fstype='ext4',
+                         uuid=fake_uuid('fs', idx), mounts=[upon])
+            mounts.append((crypt_majmin, upon, 'ext4', f'/dev/mapper/{mapper}', 'rw,relatime'))
+            loops.append(_dev(f'loop{len(loops)}', f'7:{len(loops)}', 'loop', size='512M',
+                              fstype='crypto_LUKS', uuid=uuid, back_file=back_file,
+                              children=[child]))
+            vitals[uuid] = {'uuid': uuid, 'password': '', 'upon': upon,
+                            'back_file': back_file, 'when': 0}
+            continue
+
+        part_name = f'nvme{disk_idx}n1p{len(parts)+1}'
+        parts.append(_dev(part_name, f'259:{minor}', 'part', fstype='crypto_LUKS',
+                          uuid=uuid, children=[child] if child else None))
+        vitals[uuid] = {'uuid': uuid, 'password': '', 'upon': upon or '',
+                        'back_file': '', 'when': 0}
+        if len(parts) >= parts_per_disk:
+            flush_disk()
+    flush_disk()
+
+    lines = []
+    for mount_id, (majmin, upon, fstype, source, options) in enumerate(mounts, 20):
+        lines.append(f'{mount_id} 1 {majmin} / {escape(upon)} {options}'
+                     f' shared:{mount_id} - {fstype} {source} {options}')
+    return disks + loops, '\n'.join(lines) + '\n', vitals
+
+def make_history_json(vitals, absent_files=0):
+    """ The clear-text history file for the vitals plus `absent_files`
+        file containers whose backing files do not exist (so they are
+        validated and purged on restore).
+    """
+    entries = dict(vitals)
+    for idx in range(absent_files):
+        uuid = fake_uuid('absent', idx)
+        entries[uuid] = {'uuid': uuid, 'password': '', 'upon': '',
+                         'back_file': f'/nonexistent/absent{idx}.luks', 'when': 0}
+    return json.dumps(entries, indent=4)
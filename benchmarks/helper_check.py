@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Exercise the privileged helper's protocol (including pipelines) with a stand-in helper (the
+same helper started without sudo, so no root is needed) and compare its
+round trip with forking "sudo -n" per command (when sudo allows it).
+Run as root (where /dev/loop-control exists), it also checks the native
+loop attach/detach, including concurrent attaches getting distinct devices,
+and the overmounts presenting a filesystem as the user's (idmapped only
+when nothing in it is the user's yet, so bindfs is used otherwise).
+Exits non-zero on a failed check.
+
+Run from the project root:
+    python -m benchmarks.helper_check [--reps 50]
+"""
+# pylint: disable=invalid-name
+
+import os
+import sys
+import errno
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from luks_tray import Native
+from luks_tray.Helper import HelperClient, HelperServer
+from luks_tray.Pipeline import make_step, CancelToken
+from luks_tray.SysfsScanner import SysfsScanner
+
+def checks(client, tmpdir):
+    """ Returns a list of failures (strings) """
+    fails = []
+    def check(what, ok):
+        print(f'  {"OK  " if ok else "FAIL"} {what}')
+        if not ok:
+            fails.append(what)
+
+    target = os.path.join(tmpdir, 'made')
+    check('mkdir via helper', client.run(['mkdir', target]) == (0, '', '')
+          and os.path.isdir(target))
+    result = client.run(['mkdir', target])
+    check('failure carries rc and stderr', result is not None and result[0] != 0
+          and 'exists' in result[2].lower())
+    check('rmdir via helper', client.run(['rmdir', target])[0] == 0
+          and not os.path.exists(target))
+    check('non-whitelisted command refused', client.run(['sh', '-c', 'true']) is None
+          and 'error' in client.request('run', args=['sh']))
+    check('unknown op refused', 'error' in client.request('format-disk'))
+    dirs = [os.path.join(tmpdir, f'd{idx}') for idx in range(16)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda path: client.run(['mkdir', path]), dirs))
+    check('concurrent requests (thread-local connections)',
+          all(result and result[0] == 0 for result in results)
+          and all(os.path.isdir(path) for path in dirs))
+    first, second = os.path.join(tmpdir, 'first'), os.path.join(tmpdir, 'second')
+    steps = [make_step(['mkdir', first], undo=['rmdir', first]),
+             make_step(['mkdir', second], undo=['rmdir', second]),
+             make_step(['mkdir', first])] # fails: exists
+    result = client.batch(steps)
+    check('batch failure rolls back in reverse order', result is not None and result['err']
+          and [args for args, _ in result['undone']] == [f'rmdir {second}', f'rmdir {first}']
+          and not os.path.exists(first) and not os.path.exists(second))
+    result = client.batch(steps[:2])
+    check('batch success with per-step timing', result is not None and not result['err']
+          and len(result['steps']) == 2 and os.path.isdir(second))
+    third = os.path.join(tmpdir, 'third')
+    reports = []
+    result = client.batch([make_step(['mkdir', third]), make_step(['rmdir', third])],
+                          progress=lambda *report: reports.append(report))
+    check('batch progress streamed per step', result is not None and not result['err']
+          and reports == [(0, 2, 'mkdir'), (1, 2, 'rmdir')])
+    fallback = os.path.join(tmpdir, 'fallback')
+    result = client.batch([make_step(['idmap', '1:1', os.path.join(tmpdir, 'nowhere')],
+                                     fallback=make_step(['mkdir', fallback]))])
+    check('failed step runs its fallback', result is not None and not result['err']
+          and os.path.isdir(fallback) and len(result['steps']) == 2)
+    token = CancelToken()
+    token.cancel()
+    result = client.batch([make_step(['mkdir', third])], cancel=token)
+    check('cancelled batch does not run', result['err'].startswith('CANCELLED')
+          and not os.path.exists(third))
+    check('cancel of no batch in flight', client.request('cancel', target=-1) == {'ok': False,
+          'id': client.ids})
+    stats = client.request('stats').get('stats', {})
+    check('per-operation timing reported', stats.get('mkdir', {}).get('count', 0) >= 18)
+    return fails
+
+def native_checks(client, tmpdir, count=8):
+    """ Loop devices via the helper's native backend; returns failures """
+    fails = []
+    def check(what, ok):
+        print(f'  {"OK  " if ok else "FAIL"} {what}')
+        if not ok:
+            fails.append(what)
+
+    files = [os.path.join(tmpdir, f'loop{idx}.img') for idx in range(count)]
+    for path in files:
+        with open(path, 'wb') as f:
+            f.truncate(4 * 1024 * 1024)
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        results = list(pool.map(lambda path: client.run(['losetup', '-f', '--show', path]),
+                                files))
+    devices = [result[1].strip() for result in results if result and result[0] == 0]
+    check(f'{count} concurrent native attaches get distinct devices',
+          len(devices) == count and len(set(devices)) == count)
+    backing = []
+    for device in devices:
+        with open(f'/sys/block/{os.path.basename(device)}/loop/backing_file',
+                  encoding='utf-8') as f:
+            backing.append(f.read().strip())
+    check('each device is backed by its file', sorted(backing) == sorted(files))
+    results = [client.run(['losetup', '-d', device]) for device in devices]
+    check('native detach', all(result and result[0] == 0 for result in results))
+    result = client.run(['losetup', '-f', '--show', '--direct-io=on', '--sector-size', '4096',
+                         files[0]])
+    status = SysfsScanner().loop_status(os.path.basename(result[1].strip())) if result else None
+    check('native attach with direct I/O and 4096-byte blocks', status is not None
+          and status.dio and status.block_size == 4096
+          and client.run(['losetup', '-d', result[1].strip()])[0] == 0)
+    stats = client.request('stats').get('stats', {})
+    check('native ops timed', stats.get('native losetup', {}).get('count', 0) >= 2 * count)
+    if shutil.which('mkfs.ext4'):
+        idmap_checks(client, tmpdir, check)
+    return fails
+
+def make_image(client, tmpdir, name, root_owner, user=None):
+    """ An ext4 image (root owned by root_owner, e.g. '0:0'), with a private
+        folder and file of user (e.g., 1000) if given; returns (image, mount point) """
+    image, mount_point = os.path.join(tmpdir, f'{name}.img'), os.path.join(tmpdir, name)
+    with open(image, 'wb') as f:
+        f.truncate(32 * 1024 * 1024)
+    subprocess.run(['mkfs.ext4', '-q', '-F', '-E', f'root_owner={root_owner}', image],
+                   check=True)
+    os.mkdir(mount_point)
+    if user is not None:
+        device = client.run(['losetup', '-f', '--show', image])[1].strip()
+        client.run(['mount', device, mount_point])
+        folder = os.path.join(mount_point, 'private')
+        os.mkdir(folder, 0o700)
+        with open(os.path.join(folder, 'secret'), 'w', encoding='utf-8') as f:
+            f.write('mine\n')
+        for path in (folder, os.path.join(folder, 'secret')):
+            os.chown(path, user, user)
+            os.chmod(path, 0o700 if path == folder else 0o600)
+        client.run(['umount', mount_point])
+        client.run(['losetup', '-d', device])
+    return image, mount_point
+
+def idmap_checks(client, tmpdir, check):
+    """ Presenting a filesystem as the user's: idmapped if owned by another
+        uid; refused (so bindfs would be used) if the user's files are in
+        it already, read-only or not, with nothing changed on disk """
+    image, mount_point = make_image(client, tmpdir, 'idmap', '4242:4242')
+    device = client.run(['losetup', '-f', '--show', image])[1].strip()
+    client.run(['mount', device, mount_point])
+    try:
+        Native.idmap_mount(mount_point, 1000, 1000, stop=lambda: True)
+        stopped = False
+    except OSError as e:
+        stopped = e.errno == errno.ECANCELED
+    check('stopped idmap mounts nothing', stopped and os.stat(mount_point).st_uid == 4242)
+    result = client.run(['idmap', '1000:1000', mount_point])
+    st = os.stat(mount_point)
+    check(f'idmapped overmount presents the user as owner ({result[1].strip()})',
+          result[0] == 0 and result[1].strip() == 'idmap'
+          and (st.st_uid, st.st_gid) == (1000, 1000))
+    for _ in range(2):
+        client.run(['umount', mount_point])
+    check('unmapped again beneath', os.stat(mount_point).st_uid != 1000
+          and client.run(['losetup', '-d', device])[0] == 0)
+
+    image, mount_point = make_image(client, tmpdir, 'mixed', '0:0', user=1000)
+    for readonly in (True, False):
+        device = client.run(['losetup', '-f', '--show'] + (['-r'] if readonly else [])
+                            + [image])[1].strip()
+        client.run(['mount'] + (['-o', 'ro'] if readonly else []) + [device, mount_point])
+        result = client.run(['idmap', '1000:1000', mount_point])
+        secret = os.stat(os.path.join(mount_point, 'private', 'secret'))
+        check(f'{"read-only" if readonly else "writable"} with the user\'s files under a'
+              ' root-owned root: refused (for bindfs), nothing hidden or chowned',
+              result[0] != 0 and os.stat(mount_point).st_uid == 0 and secret.st_uid == 1000)
+        client.run(['umount', mount_point])
+        check('  no overmount left', not os.path.ismount(mount_point)
+              and client.run(['losetup', '-d', device])[0] == 0)
+
+def timeout_checks(tmpdir):
+    """ The helper's timeouts and mid-command cancel (in-process, with
+        "sleep" whitelisted just for this); returns failures """
+    fails = []
+    def check(what, ok):
+        print(f'  {"OK  " if ok else "FAIL"} {what}')
+        if not ok:
+            fails.append(what)
+
+    server = HelperServer(os.path.join(tmpdir, 'inproc.sock'), os.getuid(), native=False)
+    server.programs['sleep'] = shutil.which('sleep')
+    rv = server.run(['sleep', '5'], None, timeout_ms=300)
+    check(f'command past its timeout is stopped (rc={rv["rc"]}, {rv["ms"]:.0f}ms)',
+          rv['rc'] == 124 and rv['ms'] < 2000 and 'timed out' in rv['stderr'])
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(server.run, ['sleep', '5'], None, None, 77)
+        time.sleep(0.3)
+        ok = server.cancel(77)['ok']
+        rv = future.result()
+    check(f'cancel terminates the running command (rc={rv["rc"]}, {rv["ms"]:.0f}ms)',
+          ok and rv['rc'] == 130 and rv['ms'] < 2000)
+    server.server_close()
+    return fails
+
+def time_ms(func, reps):
+    """ Median ms of func() """
+    samples = []
+    for _ in range(reps):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def main():
+    """ Command line entry """
+    parser = argparse.ArgumentParser(description=__doc__,
+                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reps', type=int, default=50,
+            help='repetitions for the timings [dflt=50]')
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        client = HelperClient()
+        path = os.path.join(tmpdir, 'helper.sock')
+        err = client.start(path, use_sudo=False)
+        if err:
+            print(err)
+            return 1
+        print('stand-in helper checks:')
+        fails = checks(client, tmpdir)
+        fails += timeout_checks(tmpdir)
+        if client.native:
+            print('native backend checks:')
+            fails += native_checks(client, tmpdir)
+        else:
+            print('(not root or no /dev/loop-control; skipping the native checks)')
+
+        target = os.path.join(tmpdir, 'timed')
+        def via_helper():
+            client.run(['mkdir', target])
+            client.run(['rmdir', target])
+        print(f'\nmkdir+rmdir via helper:   {time_ms(via_helper, opts.reps):8.3f}ms')
+        sudo_ok = shutil.which('sudo') and subprocess.run(['sudo', '-n', 'true'],
+                                capture_output=True, check=False).returncode == 0
+        if sudo_ok:
+            def via_sudo():
+                subprocess.run(['sudo', '-n', 'mkdir', target], check=False)
+                subprocess.run(['sudo', '-n', 'rmdir', target], check=False)
+            print(f'mkdir+rmdir via sudo -n:  {time_ms(via_sudo, opts.reps):8.3f}ms')
+        else:
+            print('(sudo -n not permitted; skipping the sudo comparison)')
+
+        client.stop()
+        ok = not os.path.exists(path)
+        print(f'\n  {"OK  " if ok else "FAIL"} helper exits and removes its socket on stdin EOF')
+        if not ok:
+            fails.append('shutdown')
+    return 1 if fails else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare the I/O throughput of a crypt file's filesystem as the user sees
+it: mounted plainly, overmounted with an idmapped bind (Native.idmap_mount(),
+what the tray does now) and overmounted with bindfs (what it did before;
+skipped if bindfs is not installed). Each does a sequential write (with
+fsync) and read, and creates/stats/unlinks many small files.
+
+The filesystem is ext4 on a loop device over a scratch image (dm-crypt
+would cost the same under each), with its root owned by another uid so
+that the idmapped bind really maps. Needs root (and /dev/loop-control).
+
+Run from the project root:
+    sudo python -m benchmarks.io_bench [--file-mb 256] [--files 2000]
+"""
+# pylint: disable=invalid-name
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from luks_tray import Native
+
+BLOCK = 1024 * 1024
+
+def drop_caches():
+    """ Drop the page cache so reads come from the device (if allowed) """
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w', encoding='utf-8') as f:
+            f.write('3\n')
+    except OSError:
+        pass
+
+def workload(folder, file_mb, files):
+    """ Returns (write MB/s, read MB/s, small-file ops/s) in folder """
+    path, block = os.path.join(folder, 'big.bin'), os.urandom(BLOCK)
+    start = time.perf_counter()
+    with open(path, 'wb') as f:
+        for _ in range(file_mb):
+            f.write(block)
+        f.flush()
+        os.fsync(f.fileno())
+    write_mbs = file_mb / (time.perf_counter() - start)
+    drop_caches()
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        while f.read(BLOCK):
+            pass
+    read_mbs = file_mb / (time.perf_counter() - start)
+    os.unlink(path)
+
+    names = [os.path.join(folder, f'small{idx}') for idx in range(files)]
+    start = time.perf_counter()
+    for name in names:
+        with open(name, 'wb') as f:
+            f.write(b'x' * 100)
+    for name in names:
+        os.stat(name)
+    for name in names:
+        os.unlink(name)
+    ops = 3 * files / (time.perf_counter() - start)
+    return write_mbs, read_mbs, ops
+
+def main():
+    """ Command line entry """
+    parser = argparse.ArgumentParser(description=__doc__,
+                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file-mb', type=int, default=256,
+            help='size of the sequentially written/read file [dflt=256]')
+    parser.add_argument('--files', type=int, default=2000,
+            help='number of small files created/stat-ed/unlinked [dflt=2000]')
+    parser.add_argument('--uid', type=int, default=int(os.environ.get('SUDO_UID', 1000)),
+            help='the user to present the files as [dflt=$SUDO_UID or 1000]')
+    opts = parser.parse_args()
+
+    if not Native.configure() or not shutil.which('mkfs.ext4'):
+        print('(needs root, /dev/loop-control, and mkfs.ext4; skipping)')
+        return 0
+    if not Native.idmap_supported():
+        print('(kernel without idmapped mounts; only bindfs would work here)')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image, mount_point = os.path.join(tmpdir, 'bench.img'), os.path.join(tmpdir, 'mnt')
+        with open(image, 'wb') as f:
+            f.truncate((opts.file_mb + 64 + opts.files // 256) * BLOCK)
+        owner = opts.uid + 1 # so the idmapped bind shows owner as uid
+        subprocess.run(['mkfs.ext4', '-q', '-F', '-E', f'root_owner={owner}:{owner}', image],
+                       check=True)
+        os.mkdir(mount_point)
+        device = Native.loop_attach(image)
+        Native.mount(device, mount_point, 'ext4')
+        variants = [('plain mount', None), ('idmapped bind', ['idmap'])]
+        if shutil.which('bindfs'):
+            variants.append(('bindfs (FUSE)', ['bindfs', '-u', str(opts.uid),
+                             '-g', str(opts.uid), mount_point, mount_point]))
+        else:
+            print('(bindfs not installed; skipping the "before" comparison)')
+        results = {}
+        try:
+            for label, how in variants:
+                if how == ['idmap']:
+                    Native.idmap_mount(mount_point, opts.uid, opts.uid)
+                elif how:
+                    subprocess.run(how, check=True)
+                try:
+                    results[label] = workload(mount_point, opts.file_mb, opts.files)
+                finally:
+                    if how:
+                        Native.umount(mount_point)
+        finally:
+            Native.umount(mount_point)
+            Native.loop_detach(device)
+
+    print(f'\n{"":16} {"write MB/s":>11} {"read MB/s":>11} {"small ops/s":>12}')
+    for label, (write_mbs, read_mbs, ops) in results.items():
+        print(f'{label:16} {write_mbs:11.1f} {read_mbs:11.1f} {ops:12.0f}')
+    if 'bindfs (FUSE)' in results:
+        before, after = results['bindfs (FUSE)'], results['idmapped bind']
+        print('\nidmapped vs bindfs: ' + ', '.join(f'{what} x{new / old:.2f}' for what, new, old
+              in zip(('write', 'read', 'small ops'), after, before)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Long-run check that menu refreshes do not leak Qt objects: simulates
+many refresh ticks (with containers coming, going, and changing state)
+and verifies the QObject count stays flat. Exits non-zero on growth.
+
+Run from the project root:
+    python -m benchmarks.leak_check [--ticks 5000] [--containers 50]
+"""
+# pylint: disable=invalid-name,import-outside-toplevel
+
+import os
+import sys
+import gc
+import random
+import argparse
+import tempfile
+
+from benchmarks.run_benchmarks import make_tray_shell, make_ini_tool, bench_app
+from benchmarks.fixtures import make_fixture, make_history_json
+from luks_tray.History import HistoryClass
+
+def object_counts(tray):
+    """ (QObjects owned by the app, QObjects owned by the menu) """
+    from PyQt6.QtCore import QObject
+    return (len(tray.app.findChildren(QObject)),
+            len(tray.menu.findChildren(QObject)))
+
+def flush_deletes():
+    """ Run the deleteLater()s (there is no event loop here) """
+    from PyQt6.QtCore import QCoreApplication, QEvent
+    QCoreApplication.sendPostedEvents(None, QEvent.Type.DeferredDelete.value)
+    gc.collect()
+
+def run(ticks, count, seed=1):
+    """ Returns (baseline counts, final counts, peak counts) where the
+        baseline and final are taken with all containers present.
+    """
+    devices, mount_text, vitals = make_fixture(count)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'history.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(make_history_json(vitals))
+        history = HistoryClass(path)
+        history.restore()
+        bench_app()
+        tray = make_tray_shell(make_ini_tool(tmpdir), history, mount_text)
+        tray.lsblk.get_blockdevices = lambda: devices
+        tray.update_menu()
+        everything = dict(tray.containers)
+
+        rand = random.Random(seed)
+        tray.update_menu_items()
+        flush_deletes()
+        baseline = peak = object_counts(tray)
+        for tick in range(ticks):
+            if tick % 10 == 9: # back to the full set now and then
+                tray.containers = dict(everything)
+            else: # some containers vanish, others change state
+                tray.containers = {uuid: container for uuid, container in everything.items()
+                                   if rand.random() > 0.2}
+                for container in tray.containers.values():
+                    if rand.random() < 0.05:
+                        container.upon = '' if container.upon else f'/media/tick{tick}'
+            tray.update_menu_items()
+            flush_deletes()
+            peak = max(peak, object_counts(tray))
+        tray.containers = everything
+        tray.update_menu_items()
+        flush_deletes()
+        return baseline, object_counts(tray), peak
+
+def main():
+    """ Command line entry """
+    parser = argparse.ArgumentParser(description=__doc__,
+                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ticks', type=int, default=5000,
+            help='simulated refreshes [dflt=5000]')
+    parser.add_argument('--containers', type=int, default=50,
+            help='containers in the fixture [dflt=50]')
+    opts = parser.parse_args()
+
+    baseline, final, peak = run(opts.ticks, opts.containers)
+    print(f'QObjects (app, menu): baseline={baseline} final={final} peak={peak}'
+          f' over {opts.ticks} ticks')
+    if final > baseline:
+        print('FAIL: object count grew')
+        return 1
+    print('OK: object count is flat')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
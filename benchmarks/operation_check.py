@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Check the operation runner (Operations.py): a slow pipeline runs on the
+pool while the GUI event loop keeps ticking, progress arrives on the GUI
+thread per step, a busy key refuses a second operation, and a cancel
+rolls back the steps done, and "Unlock All" pools are sized by the
+cores and memory the unlocks' Argon2 keyslots need. Also checks the QProcess command runner
+(Commands.py): timeouts, cancel (from another thread), streamed output
+and failed starts. Steps are stand-ins (sleeps), so no root is needed.
+Exits non-zero on a failed check.
+
+Run from the project root:
+    python -m benchmarks.operation_check [--step-ms 300]
+"""
+# pylint: disable=invalid-name,import-outside-toplevel
+
+import os
+import sys
+import time
+import argparse
+import threading
+from types import SimpleNamespace
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt6.QtCore import QTimer, QEventLoop
+from benchmarks.run_benchmarks import bench_app
+from luks_tray.Operations import OperationRunner, unlock_pool_size
+from luks_tray.Pipeline import make_step, execute, CancelToken
+from luks_tray.Commands import Command, run_command
+
+def fake_run(step_ms, log):
+    """ A run() for execute() whose commands just sleep """
+    def run(args, _):
+        log.append(' '.join(args))
+        time.sleep(step_ms / 1000)
+        return 0, args[-1] if args[0] == 'capture' else '', ''
+    return run
+
+def run_op(runner, key, steps, step_ms, log, cancel_after_ms=None):
+    """ Run a pipeline as an operation with the event loop spinning;
+        returns (result, ticks while it ran, progress reports, threads) """
+    loop = QEventLoop()
+    ticks, reports, threads, result = [0], [], set(), []
+    timer = QTimer()
+    timer.timeout.connect(lambda: ticks.__setitem__(0, ticks[0] + 1))
+    timer.start(20)
+
+    def work(op):
+        return execute(steps, fake_run(step_ms, log), op.progress, op.cancel.is_set)['err']
+    def on_progress(index, count, name):
+        reports.append((index, count, name))
+        threads.add(threading.get_ident())
+    def on_done(err):
+        result.append(err)
+        threads.add(threading.get_ident())
+        loop.quit()
+
+    if not runner.start(key, 'check', work, on_progress, on_done):
+        return None
+    if cancel_after_ms is not None:
+        QTimer.singleShot(cancel_after_ms, lambda: runner.cancel(key))
+    loop.exec()
+    timer.stop()
+    return result[0], ticks[0], reports, threads
+
+def pool_size_checks(check):
+    """ Checks of the "Unlock All" pool sizing """
+    def header(kdf, memory=0, cpus=0):
+        return SimpleNamespace(pbkdf=SimpleNamespace(kdf=kdf, memory=memory, cpus=cpus))
+    argon = header('argon2id', memory=1024 * 1024, cpus=4)
+    gib = 1024 * 1024
+    check('argon2 unlocks limited by cores (8 cores, 4 cpus each => 2)',
+          unlock_pool_size([argon] * 6, cores=8, memory_kib=64 * gib) == 2)
+    check('argon2 unlocks limited by memory (3 GiB available => 2)',
+          unlock_pool_size([argon] * 6, cores=64, memory_kib=3 * gib) == 2)
+    check('pbkdf2 unlocks limited by count and cores',
+          unlock_pool_size([header('pbkdf2')] * 3, cores=8, memory_kib=gib) == 3
+          and unlock_pool_size([header('pbkdf2')] * 12, cores=8, memory_kib=gib) == 8)
+    check('unreadable headers assume the Argon2 defaults; at least one',
+          unlock_pool_size([None] * 4, cores=8, memory_kib=64 * gib) == 2
+          and unlock_pool_size([argon] * 4, cores=2, memory_kib=gib // 2) == 1)
+
+def command_checks(check):
+    """ Checks of the QProcess command runner """
+    result = run_command(['cat'], input_str='hello')
+    check('command gets its input and returns its output',
+          (result.returncode, result.stdout) == (0, 'hello'))
+    result = run_command(['sleep', '5'], timeout_ms=300)
+    check(f'command past its timeout is stopped (rc={result.returncode}, {result.ms:.0f}ms)',
+          result.timed_out and result.returncode == 124 and result.ms < 2000)
+    result = run_command(['no-such-command-here'])
+    check('failed start is reported (rc=127)', result.returncode == 127)
+
+    token, results = CancelToken(), []
+    def worker():
+        results.append(run_command(['sleep', '5'], cancel=token))
+    thread = threading.Thread(target=worker)
+    thread.start()
+    time.sleep(0.3)
+    token.cancel()
+    thread.join()
+    check(f'cancel from another thread stops it ({results[0].ms:.0f}ms)',
+          results[0].cancelled and results[0].returncode == 130 and results[0].ms < 2000)
+
+    loop, chunks, ticks = QEventLoop(), [], [0]
+    timer = QTimer()
+    timer.timeout.connect(lambda: ticks.__setitem__(0, ticks[0] + 1))
+    timer.start(20)
+    command = Command(['sh', '-c', 'echo one; sleep 0.3; echo two >&2'])
+    command.output.connect(lambda stream, text: chunks.append((stream, text.strip())))
+    command.finished.connect(lambda _: loop.quit())
+    command.start()
+    loop.exec()
+    timer.stop()
+    check(f'async command streams its output ({ticks[0]} GUI ticks meanwhile)',
+          chunks == [('stdout', 'one'), ('stderr', 'two')] and ticks[0] >= 5
+          and command.future.done() and command.future.result().returncode == 0)
+
+def main():
+    """ Command line entry """
+    parser = argparse.ArgumentParser(description=__doc__,
+                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--step-ms', type=int, default=300,
+            help='duration of each stand-in step [dflt=300]')
+    opts = parser.parse_args()
+    step_ms = opts.step_ms
+
+    bench_app()
+    busy = [0]
+    scheduler = SimpleNamespace(begin_operation=lambda: busy.__setitem__(0, busy[0] + 1),
+                                end_operation=lambda: busy.__setitem__(0, busy[0] - 1))
+    runner = OperationRunner(scheduler)
+    fails = []
+    def check(what, ok):
+        print(f'  {"OK  " if ok else "FAIL"} {what}')
+        if not ok:
+            fails.append(what)
+
+    steps = [make_step(['capture', '/dev/loop9'], undo=['undo', 'loop'], capture='loop'),
+             make_step(['unlock', '{loop}'], undo=['undo', 'unlock']),
+             make_step(['mount', 'x']),]
+    log = []
+    gui_thread = threading.get_ident()
+    start = time.perf_counter()
+    err, ticks, reports, threads = run_op(runner, 'uuid-1', steps, step_ms, log)
+    ms = (time.perf_counter() - start) * 1000
+    check(f'pipeline ran off the GUI thread ({ms:.0f}ms; {ticks} GUI ticks meanwhile)',
+          err is None and ticks >= 3 * step_ms // 20 // 2)
+    check('progress per step, delivered on the GUI thread',
+          [index for index, _, _ in reports] == [0, 1, 2]
+          and reports[1][2] == 'unlock' and threads == {gui_thread})
+    check('scheduler told of the operation (and its end)', busy[0] == 0
+          and not runner.is_busy('uuid-1'))
+
+    runner.start('uuid-2', 'check', lambda _: time.sleep(step_ms / 1000))
+    check('a busy key refuses a second operation',
+          runner.is_busy('uuid-2') and run_op(runner, 'uuid-2', steps, step_ms, log) is None)
+    runner.wait()
+    bench_app().processEvents()
+
+    log.clear()
+    err, _, _, _ = run_op(runner, 'uuid-3', steps, step_ms, log,
+                          cancel_after_ms=step_ms * 3 // 2)
+    check(f'cancel stops before the next step and rolls back ({err!r})',
+          err and err.startswith('CANCELLED') and 'mount x' not in log
+          and log[-2:] == ['undo unlock', 'undo loop'])
+    pool_size_checks(check)
+    command_checks(check)
+    return 1 if fails else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
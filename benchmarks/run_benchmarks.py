@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the refresh hot path at increasing scale using the
+synthetic fixtures (no root or real devices needed).
+
+Run from the project root:
+    python -m benchmarks.run_benchmarks [--scales 10,100,1000] [--out results.json]
+                                        [--compare old-results.json]
+"""
+# pylint: disable=invalid-name,broad-exception-caught,import-outside-toplevel
+# pylint: disable=protected-access
+
+import os
+import sys
+import copy
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+from types import SimpleNamespace
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+os.environ.setdefault('XDG_CURRENT_DESKTOP', '')
+os.environ.setdefault('DESKTOP_SESSION', '')
+
+from benchmarks.fixtures import make_fixture, make_history_json
+from luks_tray.IniTool import IniTool
+from luks_tray.History import HistoryClass
+from luks_tray.MountInfo import MountTable, parse_mountinfo
+
+# beside this script (and ignored by git), not wherever it is run from
+DEFAULT_OUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench-results.json')
+
+def measure(func, reps, setup=None):
+    """ Run func() reps times (with an untimed setup() before each, whose
+        result is passed to func if not None). Returns stats in ms.
+    """
+    samples = []
+    for _ in range(reps):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        if arg is None:
+            func()
+        else:
+            func(arg)
+        samples.append((time.perf_counter() - start) * 1000)
+    return {'reps': reps, 'min': min(samples), 'median': statistics.median(samples),
+            'mean': statistics.fmean(samples), 'max': max(samples)}
+
+class FakeMountTable(MountTable):
+    """ A MountTable over fixture text instead of /proc/self/mountinfo """
+    def __init__(self, text): # pylint: disable=super-init-not-called
+        self.text = text
+        self.stale = True
+        self.mounts, self.by_device, self.by_point = [], {}, {}
+        self.reparses = 0
+
+    def check(self):
+        return self.stale
+
+    def refresh(self, force=False):
+        if not self.check() and not force:
+            return False
+        self.stale = False
+        self.mounts = parse_mountinfo(self.text)
+        self.by_device, self.by_point = {}, {}
+        for mnt in self.mounts:
+            self.by_device.setdefault(mnt.source, []).append(mnt)
+            self.by_point[mnt.upon] = mnt
+        return True
+
+def make_ini_tool(tmpdir):
+    """ An IniTool whose config.ini is a default one in tmpdir (so the
+        user's own config neither matters nor needs to exist) """
+    ini_tool = IniTool(paths_only=True)
+    ini_tool.folder = tmpdir
+    ini_tool.ini_path = os.path.join(tmpdir, 'config.ini')
+    ini_tool.ensure_ini_file()
+    return ini_tool
+
+def make_tray_shell(ini_tool, history, mount_text):
+    """ A LuksTray with just the state the refresh path needs (no tray
+        icon polling, dependency checks, timers, or signal handling).
+    """
+    from PyQt6.QtWidgets import QMenu, QSystemTrayIcon
+    from PyQt6.QtGui import QIcon, QFont
+    from luks_tray import main as lt
+    from luks_tray.Operations import OperationRunner
+    tray = lt.LuksTray.__new__(lt.LuksTray)
+    lt.LuksTray.singleton = tray
+    tray.app = bench_app()
+    tray.ini_tool, tray.history = ini_tool, history
+    tray.mono_font = QFont('Consolas', 10)
+    tray.icons = {key: QIcon() for key in lt.LuksTray.svg_info.nicknames}
+    tray.prev_icon_key = ''
+    tray.tray_icon = QSystemTrayIcon(tray.icons['none'])
+    tray.containers, tray.menu, tray.actions = {}, QMenu(), []
+    tray.history_only, tray.history_generation, tray.prev_menu_key = {}, None, None
+    tray.action_pool, tray.action_handlers, tray.actions_retexted = {}, {}, False
+    tray.menu_fingerprint, tray.menu_model = None, None
+    tray.menu_handlers = tray.make_menu_handlers()
+    tray.mount_table = FakeMountTable(mount_text)
+    tray.mount_infos, tray.upons = {}, set()
+    tray.lsblk = lt.DeviceInfo(opts=SimpleNamespace(debug=False), tray=tray)
+    tray.uevent_notifier = True
+    tray.scheduler = SimpleNamespace(configure=lambda *_, **__: None)
+    tray.operations = OperationRunner(tray.scheduler)
+    tray.configure_helper = lambda: None
+    return tray
+
+_app = None
+def bench_app():
+    """ The (one) QApplication """
+    global _app # pylint: disable=global-statement
+    if _app is None:
+        from PyQt6.QtWidgets import QApplication
+        _app = QApplication.instance() or QApplication([])
+    return _app
+
+def run_scale(count, reps, tmpdir, with_qt=True):
+    """ All the benchmarks at one scale """
+    devices, mount_text, vitals = make_fixture(count)
+    ini_tool = make_ini_tool(tmpdir)
+    results = {}
+
+    results['parse_mountinfo'] = measure(lambda: parse_mountinfo(mount_text), reps)
+
+    def device_info():
+        from luks_tray.main import DeviceInfo
+        table = FakeMountTable(mount_text)
+        table.refresh()
+        tray = SimpleNamespace(ini_tool=ini_tool, mount_table=table,
+                               mount_infos={d: m[-1] for d, m in table.by_device.items()})
+        info = DeviceInfo(opts=SimpleNamespace(debug=False), tray=tray)
+        return info
+
+    def parse(info):
+        info.parse_lsblk()
+
+    def cold_setup():
+        info = device_info()
+        tree = copy.deepcopy(devices)
+        info.get_blockdevices = lambda: tree
+        return info
+
+    steady = device_info()
+    steady.get_blockdevices = lambda: copy.deepcopy(devices)
+    steady.parse_lsblk()
+    def steady_setup():
+        tree = copy.deepcopy(devices)
+        steady.get_blockdevices = lambda: tree
+        return steady
+    results['parse_lsblk.cold'] = measure(parse, reps, cold_setup)
+    results['parse_lsblk.steady'] = measure(parse, reps, steady_setup)
+
+    containers = list(steady.entries.values())
+    def ensure_all(history):
+        for container in containers:
+            history.ensure_container(container)
+    def fresh_history():
+        path = os.path.join(tmpdir, f'ensure-{count}.json')
+        history = HistoryClass(path)
+        history.status = 'clear_text'
+        return history
+    results['history.ensure_container'] = measure(ensure_all, reps, fresh_history)
+
+    path = os.path.join(tmpdir, f'history-{count}.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(make_history_json(vitals, absent_files=max(1, count // 20)))
+    results['history.restore'] = measure(lambda h: h.restore(), reps,
+                                         lambda: HistoryClass(path))
+
+    if with_qt:
+        history = HistoryClass(path)
+        history.restore()
+        tray = make_tray_shell(ini_tool, history, mount_text)
+        tray.lsblk.get_blockdevices = lambda: copy.deepcopy(devices)
+        tray.update_menu()
+        def cold_menu():
+            tray.menu.clear()
+            for action in tray.action_pool.values():
+                action.deleteLater()
+            tray.action_pool, tray.action_handlers = {}, {}
+            tray.actions, tray.prev_icon_key = [], ''
+            tray.menu_fingerprint, tray.menu_model = None, None
+            return tray
+        results['update_menu_items.cold'] = measure(lambda t: t.update_menu_items(),
+                                                    reps, cold_menu)
+        results['update_menu_items.steady'] = measure(tray.update_menu_items, reps)
+        results['menu_view_model'] = measure(lambda: tray.menu_view_model(
+                tray.containers, tray.history.status, True), reps)
+        def steady_tray():
+            tree = copy.deepcopy(devices)
+            tray.lsblk.get_blockdevices = lambda: tree
+            return tray
+        results['update_menu.steady'] = measure(lambda t: t.update_menu(), reps, steady_tray)
+    return results
+
+def version():
+    """ The installed/checked-out luks-tray version """
+    try:
+        from importlib.metadata import version as get_version
+        return get_version('luks-tray')
+    except Exception:
+        return 'unknown'
+
+def compare(old, new):
+    """ Print the median ratios (new/old) of results in both """
+    print(f'\ncompared with {old.get("version")} ({old.get("when")}): new/old median')
+    for scale, benches in new['scales'].items():
+        for name, stats in benches.items():
+            prev = old.get('scales', {}).get(scale, {}).get(name, None)
+            if prev and prev['median'] > 0:
+                ratio = stats['median'] / prev['median']
+                flag = '  <-- slower' if ratio > 1.2 else ''
+                print(f'  {scale:>6} {name:<28} {ratio:6.2f}x{flag}')
+
+def main():
+    """ Command line entry """
+    parser = argparse.ArgumentParser(description=__doc__,
+                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='10,100,1000',
+            help='comma separated container counts [dflt=10,100,1000]')
+    parser.add_argument('--reps', type=int, default=0,
+            help='repetitions per benchmark [dflt: scaled to the size]')
+    parser.add_argument('--out', default=DEFAULT_OUT,
+            help='where to write the JSON results [dflt=benchmarks/bench-results.json]')
+    parser.add_argument('--compare', metavar='JSON',
+            help='earlier results to compare against')
+    parser.add_argument('--no-qt', action='store_true',
+            help='skip the menu benchmarks (which need PyQt6)')
+    opts = parser.parse_args()
+
+    output = {'version': version(), 'when': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'python': platform.python_version(), 'machine': platform.machine(),
+              'processor': platform.processor(), 'scales': {}}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for scale in [int(x) for x in opts.scales.split(',') if x.strip()]:
+            reps = opts.reps or max(5, min(200, 20000 // max(scale, 1)))
+            results = run_scale(scale, reps, tmpdir, with_qt=not opts.no_qt)
+            output['scales'][str(scale)] = results
+            for name, stats in results.items():
+                print(f'{scale:>6} {name:<28} median={stats["median"]:9.3f}ms'
+                      f' max={stats["max"]:9.3f}ms (x{stats["reps"]})')
+    with open(opts.out, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=4)
+    print(f'wrote {opts.out}')
+    if opts.compare:
+        with open(opts.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command runner built on QProcess with per-command timeouts, cancellation,
+streamed output and durations, so a hung umount (e.g., of a dead USB
+disk) or a stuck fuser cannot freeze the tray.
+
+  - Command(args, ...).start() runs a command asynchronously; its output
+    signal streams (stream, text) as it arrives, and its finished signal
+    and future deliver the CommandResult.
+  - run_command(args, ...) runs a Command and waits for it in a local
+    event loop; in a worker thread, it blocks only that thread (and on
+    the GUI thread, the GUI keeps running meanwhile).
+
+A command that times out or is cancelled is terminated, then killed
+after a grace period; one that will not die even then (e.g., stuck in
+the kernel) is abandoned. Its returncode is TIMED_OUT_RC (as timeout(1))
+or CANCELLED_RC.
+"""
+# pylint: disable=invalid-name,broad-exception-caught,too-many-instance-attributes
+# pylint: disable=too-many-arguments
+
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+from PyQt6.QtCore import QObject, QProcess, QTimer, QEventLoop, Qt, pyqtSignal, pyqtSlot
+from luks_tray.Pipeline import timeout_for
+from luks_tray.Stats import timings
+
+TIMED_OUT_RC = 124
+CANCELLED_RC = 130
+NOT_STARTED_RC = 127
+KILL_GRACE_MS = 2000 # from terminate() to kill(), and from kill() to giving up
+
+_abandoned = [] # processes that would not die; kept so ~QProcess does not block
+
+def make_result(args, returncode, stdout='', stderr='', ms=0.0, timed_out=False,
+                cancelled=False):
+    """ The outcome of a command """
+    return SimpleNamespace(args=list(args), returncode=returncode, stdout=stdout,
+                stderr=stderr, ms=ms, timed_out=timed_out, cancelled=cancelled)
+
+
+class Command(QObject):
+    """ One command run via QProcess (in the thread that creates it) """
+    output = pyqtSignal(str, str) # stream ('stdout' or 'stderr'), text
+    finished = pyqtSignal(object) # CommandResult
+    cancel_requested = pyqtSignal() # emit from any thread to cancel
+
+    def __init__(self, args, input_str=None, timeout_ms=None, parent=None):
+        super().__init__(parent)
+        self.args = list(args)
+        self.input_str = input_str
+        self.timeout_ms = timeout_for(args) if timeout_ms is None else timeout_ms
+        self.future = Future()
+        self.result = None
+        self.stopping = None # None, 'timed_out' or 'cancelled'
+        self.chunks = {'stdout': [], 'stderr': []}
+        self.started = 0.0
+        self.proc = QProcess(self)
+        self.proc.readyReadStandardOutput.connect(lambda: self.on_ready('stdout'))
+        self.proc.readyReadStandardError.connect(lambda: self.on_ready('stderr'))
+        self.proc.finished.connect(self.on_finished)
+        self.proc.errorOccurred.connect(self.on_error)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(lambda: self.stop('timed_out'))
+        self.grace = QTimer(self) # terminate() => kill() => give up
+        self.grace.setSingleShot(True)
+        self.grace.setInterval(KILL_GRACE_MS)
+        self.grace.timeout.connect(self.escalate)
+        self.killed = False
+        self.cancel_requested.connect(self.cancel, Qt.ConnectionType.QueuedConnection)
+
+    def start(self):
+        """ Start the command; returns self """
+        self.started = time.perf_counter()
+        self.proc.start(self.args[0], self.args[1:])
+        if self.input_str is not None:
+            self.proc.write(self.input_str.encode())
+        self.proc.closeWriteChannel()
+        if self.timeout_ms:
+            self.timer.start(self.timeout_ms)
+        return self
+
+    @pyqtSlot()
+    def cancel(self):
+        """ Stop the command (if still running) """
+        self.stop('cancelled')
+
+    def stop(self, why):
+        """ Terminate, then kill, then give up on the command """
+        if self.result or self.stopping:
+            return
+        self.stopping = why
+        self.proc.terminate()
+        self.grace.start()
+
+    def escalate(self):
+        """ Still running after terminate(): kill it; still running after
+            that (e.g., stuck in the kernel): give up on it """
+        if self.result:
+            return
+        if not self.killed:
+            self.killed = True
+            self.proc.kill()
+            self.grace.start()
+            return
+        self.proc.setParent(None)
+        _abandoned.append(self.proc)
+        self.complete(-1)
+
+    def on_ready(self, stream):
+        """ Output arrived """
+        if stream == 'stdout':
+            data = bytes(self.proc.readAllStandardOutput())
+        else:
+            data = bytes(self.proc.readAllStandardError())
+        text = data.decode('utf-8', 'replace')
+        if text:
+            self.chunks[stream].append(text)
+            self.output.emit(stream, text)
+
+    def on_finished(self, exit_code, exit_status):
+        """ The process exited """
+        self.on_ready('stdout')
+        self.on_ready('stderr')
+        crashed = exit_status != QProcess.ExitStatus.NormalExit
+        self.complete(-1 if crashed else exit_code)
+
+    def on_error(self, error):
+        """ The process could not start (other errors end in finished) """
+        if error == QProcess.ProcessError.FailedToStart:
+            self.chunks['stderr'].append(f'{self.args[0]}: {self.proc.errorString()}')
+            self.complete(NOT_STARTED_RC)
+
+    def complete(self, returncode):
+        """ Deliver the result (once) """
+        if self.result:
+            return
+        self.timer.stop()
+        self.grace.stop()
+        ms = (time.perf_counter() - self.started) * 1000
+        stderr = ''.join(self.chunks['stderr'])
+        if self.stopping == 'timed_out':
+            returncode = TIMED_OUT_RC
+            stderr += f'\n[timed out after {self.timeout_ms / 1000:g}s]'
+        elif self.stopping == 'cancelled':
+            returncode = CANCELLED_RC
+            stderr += '\n[cancelled]'
+        self.result = make_result(self.args, returncode, ''.join(self.chunks['stdout']),
+                    stderr, ms, self.stopping == 'timed_out', self.stopping == 'cancelled')
+        timings.add(f'cmd {self.args[0]}', ms)
+        self.future.set_result(self.result)
+        self.finished.emit(self.result)
+
+
+def run_command(args, input_str=None, timeout_ms=None, cancel=None, on_output=None):
+    """ Run a command and wait for it (in a local event loop); cancel is
+        a Pipeline.CancelToken (cancel.cancel() may come from any thread)
+        and on_output(stream, text) gets the output as it arrives.
+        Returns the CommandResult.
+    """
+    if cancel and cancel.is_set():
+        return make_result(args, CANCELLED_RC, stderr='[cancelled]', cancelled=True)
+    command = Command(args, input_str, timeout_ms)
+    loop = QEventLoop()
+    command.finished.connect(lambda _: loop.quit())
+    if on_output:
+        command.output.connect(on_output)
+    if cancel:
+        def request_cancel():
+            if not command.result:
+                command.cancel_requested.emit()
+        cancel.on_cancel(request_cancel)
+    command.start()
+    if not command.result: # else it failed to start already
+        loop.exec()
+    return command.result
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Performance-tuned settings for new crypt files (per the [create] section
+of config.ini and the Create New Crypt File dialog):
+  - a 4096-byte LUKS2 sector size (an eighth of the crypto calls per byte
+    of the 512 default; and the loop device does direct I/O in 4096-byte
+    blocks, see _setup_loop_device())
+  - an Argon2id keyslot whose time cost cryptsetup calibrates to the
+    target unlock time on this machine, with its memory capped (so that
+    "Unlock All Known" can unlock several at once)
+  - the fastest cipher per "cryptsetup benchmark" (cached per CPU and
+    kernel): AES-XTS with AES-NI, else likely Adiantum
+  - ext4 with no reserved blocks, no discard pass over the new (sparse)
+    file, and, for big files, no zeroing of the inode tables and journal
+"""
+# pylint: disable=invalid-name,broad-exception-caught
+
+import os
+import re
+import json
+import platform
+from types import SimpleNamespace
+from luks_tray.Commands import run_command
+from luks_tray.Operations import available_memory_kib
+from luks_tray.Utils import prt
+
+CANDIDATES = { # cipher (as for "luksFormat -c") => key bits
+    'aes-xts-plain64': 512,
+    'xchacha12,aes-adiantum-plain64': 256,
+}
+DEFAULT_CIPHER = 'aes-xts-plain64' # if nothing could be benchmarked (cryptsetup's default)
+ADIANTUM = 'xchacha12,aes-adiantum-plain64'
+SECTOR_SIZES = (512, 1024, 2048, 4096)
+MIN_KDF_MEMORY_KIB = 64 * 1024
+MEMORY_SHARE_PCT = 25 # of MemAvailable that one Argon2 keyslot may take
+LAZY_INIT_MIB = 1024 # files this big skip zeroing inode tables and journal at mkfs
+BENCH_TIMEOUT_MS = 60000
+
+def settings(ini_tool):
+    """ The [create] settings of config.ini """
+    def get(key):
+        return ini_tool.get_current_val(key, 'create')
+    return SimpleNamespace(sector_size=get('sector_size'), unlock_ms=get('unlock_ms'),
+                           kdf_memory_mib=get('kdf_memory_mib'), cipher=get('cipher'))
+
+def validate(tuning):
+    """ Check the settings; returns None if fine, else the error """
+    if tuning.sector_size not in SECTOR_SIZES:
+        return f'ERR: sector size must be one of {", ".join(map(str, SECTOR_SIZES))}'
+    if not 100 <= tuning.unlock_ms <= 30000:
+        return f'ERR: unlock time ({tuning.unlock_ms}ms) must be 100..30000ms'
+    if tuning.cipher != 'auto' and not re.fullmatch(r'[a-z0-9]+(,[a-z0-9]+)?(-[a-z0-9:]+)+',
+                                                    tuning.cipher):
+        return f'ERR: cipher ({tuning.cipher}) must be "auto" or like "aes-xts-plain64"'
+    return None
+
+def has_aes_ni():
+    """ Has the CPU AES instructions (x86 "aes" flag or arm "aes" feature)? """
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key.strip() in ('flags', 'Features'):
+                    return 'aes' in value.split()
+    except OSError:
+        pass
+    return False
+
+def cpu_key():
+    """ What the benchmark results depend on: the CPU model and the kernel """
+    model = ''
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key.strip() in ('model name', 'Hardware', 'cpu model'):
+                    model = value.strip()
+                    break
+    except OSError:
+        pass
+    return f'{model}|{os.cpu_count()}|{platform.release()}'
+
+def parse_benchmark(text):
+    """ The speeds in the output of "cryptsetup benchmark -c CIPHER" as
+        {cipher (sans IV, e.g., 'aes-xts'): min(encrypt, decrypt) MiB/s};
+        a cipher shown with "N/A" (e.g., no kernel support) is left out """
+    scale = {'KiB': 1 / 1024, 'MiB': 1, 'GiB': 1024}
+    speeds = {}
+    for line in text.splitlines():
+        match = re.match(r'\s*(\S+)\s+\d+b\s+([\d.]+)\s+([KMG]iB)/s\s+([\d.]+)\s+([KMG]iB)/s',
+                         line)
+        if match:
+            name, enc, enc_unit, dec, dec_unit = match.groups()
+            speeds[name] = min(float(enc) * scale[enc_unit], float(dec) * scale[dec_unit])
+    return speeds
+
+def run_benchmarks(cancel=None):
+    """ Benchmark the candidate ciphers; returns {cipher: MiB/s} """
+    speeds = {}
+    for cipher, bits in CANDIDATES.items():
+        result = run_command(['cryptsetup', 'benchmark', '-c', cipher, '-s', str(bits)],
+                             timeout_ms=BENCH_TIMEOUT_MS, cancel=cancel)
+        found = parse_benchmark(result.stdout) if result.returncode == 0 else {}
+        speed = found.get(cipher.removesuffix('-plain64'), None)
+        prt(f'cryptsetup benchmark {cipher}: {f"{speed:.0f} MiB/s" if speed else "unavailable"}')
+        if speed:
+            speeds[cipher] = speed
+    return speeds
+
+def cached_benchmarks(path, cancel=None):
+    """ The cipher speeds (see run_benchmarks()) as cached in path for
+        this CPU and kernel; benchmarked (and cached) if not yet """
+    key = cpu_key()
+    try:
+        with open(path, encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get('key') == key and isinstance(cache.get('speeds'), dict):
+            return cache['speeds']
+    except (OSError, ValueError):
+        pass
+    speeds = run_benchmarks(cancel)
+    if speeds and not (cancel and cancel.is_set()):
+        try:
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'speeds': speeds}, f, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            prt(f'cannot cache cipher benchmarks in {path}: {e}')
+    return speeds
+
+def choose_cipher(speeds, aes_ni=None):
+    """ The cipher for a new crypt file given the benchmark speeds: the
+        fastest; but without AES-NI, Adiantum if it works at all (software
+        AES is both slow and prone to timing leaks) """
+    aes_ni = has_aes_ni() if aes_ni is None else aes_ni
+    if not aes_ni and ADIANTUM in speeds:
+        return ADIANTUM
+    if not speeds:
+        return DEFAULT_CIPHER
+    return max(CANDIDATES, key=lambda cipher: speeds.get(cipher, 0))
+
+def kdf_memory_kib(tuning, memory_kib=None):
+    """ The Argon2id memory: per the settings, but at most a share of the
+        available memory (and at least MIN_KDF_MEMORY_KIB) """
+    memory_kib = memory_kib if memory_kib is not None else available_memory_kib()
+    kib = tuning.kdf_memory_mib * 1024
+    if memory_kib:
+        kib = min(kib, memory_kib * MEMORY_SHARE_PCT // 100)
+    return max(MIN_KDF_MEMORY_KIB, kib)
+
+def format_args(tuning, cipher, memory_kib=None):
+    """ The "cryptsetup luksFormat" options (less the type, key file and file) """
+    args = ['--cipher', cipher]
+    if cipher in CANDIDATES:
+        args += ['--key-size', str(CANDIDATES[cipher])]
+    return args + ['--sector-size', str(tuning.sector_size),
+                   '--pbkdf', 'argon2id', '--iter-time', str(tuning.unlock_ms),
+                   '--pbkdf-memory', str(kdf_memory_kib(tuning, memory_kib))]
+
+def mkfs_args(uid, gid, size_mib, sector_size=4096):
+    """ The mkfs.ext4 arguments (less the device) for a new crypt file of
+        size_mib: owned by the user, no blocks reserved for root, and
+        blocks no smaller than the sectors """
+    extended = [f'root_owner={uid}:{gid}', 'nodiscard']
+    if size_mib >= LAZY_INIT_MIB:
+        extended += ['lazy_itable_init=1', 'lazy_journal_init=1']
+    args = ['mkfs.ext4', '-m', '0']
+    if sector_size > 1024 or size_mib >= 512:
+        args += ['-b', '4096'] # else a small filesystem gets 1024-byte blocks
+    return args + ['-E', ','.join(extended)]
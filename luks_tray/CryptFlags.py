@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+dm-crypt performance flags remembered per container (as a comma-separated
+string in its history vital) and passed to "cryptsetup open":
+  - no_read_workqueue/no_write_workqueue: do the crypto in the I/O path
+    rather than queueing it to kcryptd workers (a large latency win on
+    NVMe and other fast SSDs)
+  - allow_discards: pass TRIM through to the device (which discloses
+    which blocks are unused)
+With LUKS2, "cryptsetup open --persistent" also stores them in the
+header so that every later activation (e.g., at boot) uses them.
+"""
+# pylint: disable=invalid-name
+
+FLAGS = { # name => (cryptsetup open option, as "cryptsetup status" shows it, label)
+    'no_read_workqueue': ('--perf-no_read_workqueue', 'no_read_workqueue', 'No Read Workqueue'),
+    'no_write_workqueue': ('--perf-no_write_workqueue', 'no_write_workqueue',
+                           'No Write Workqueue'),
+    'allow_discards': ('--allow-discards', 'discards', 'Allow Discards'),
+}
+
+def split(flags):
+    """ The known flags of a comma-separated string (in FLAGS order) """
+    names = {name.strip() for name in (flags or '').split(',')}
+    return [name for name in FLAGS if name in names]
+
+def open_args(flags, persistent=False):
+    """ The "cryptsetup open" options for flags (and to store them in
+        the LUKS2 header if persistent) """
+    args = [FLAGS[name][0] for name in split(flags)]
+    return args + ['--persistent'] if persistent else args
+
+def parse_status(text):
+    """ The active flags from the output of "cryptsetup status MAPPER"
+        (its "flags:" line lists them, e.g., "discards no_read_workqueue") """
+    shown = []
+    for line in text.splitlines():
+        key, _, value = line.strip().partition(':')
+        if key == 'flags':
+            shown = value.split()
+    return [name for name, (_, status, _) in FLAGS.items() if status in shown]
+
+def from_values(values, default=''):
+    """ The flags checked in a dialog's values (keyed by flag name), or
+        default if the dialog had none of them """
+    if not any(name in values for name in FLAGS):
+        return default
+    return ','.join(name for name in FLAGS if values.get(name, False))
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A privileged helper started once (with "sudo -n") that runs whitelisted
+commands for the tray, so each mount step does not pay for a sudo fork
+(PAM, sudoers parsing, ...).
+
+Protocol: JSON lines over a Unix stream socket that only the tray's
+user can connect to. Each request is an object with an "op":
+  - {"op": "ping"} => {"ok": true, "pid": N}
+  - {"op": "run", "args": [...], "input": "...", "timeout_ms": N}
+        => {"rc": N, "stdout": "...", "stderr": "...", "ms": F}
+        (a command running past its timeout (default: per Pipeline.timeout_for())
+        is terminated, then killed; its rc is then 124)
+  - {"op": "batch", "steps": [...]} => the result of Pipeline.execute()
+        (runs the steps as a transaction; see Pipeline.py); before it,
+        a {"progress": [index, count, name]} line as each step starts
+  - {"op": "cancel", "target": ID} => {"ok": bool} (terminates the command
+        running for request ID (rc 130); a batch stops and is rolled back)
+  - {"op": "stats"} => {"stats": {key: {count, p50, p95, max}}}
+Errors come back as {"error": "..."}. The helper exits when its stdin
+reaches EOF (i.e., when the tray exits, however it exits).
+
+Running as root, losetup/mount/umount (and the idmapped overmounts of
+crypt files) are done in-process via Native.py (ioctls and syscalls)
+unless started with --no-native; commands it does not handle still run
+the installed programs.
+
+Run without sudo (e.g., "python -m luks_tray.Helper --socket /tmp/h.sock")
+it is a stand-in needing no root, which suffices for exercising the
+protocol with unprivileged commands (e.g., mkdir/rmdir in a temp dir).
+"""
+# pylint: disable=invalid-name,broad-exception-caught,consider-using-with
+
+import os
+import sys
+import json
+import functools
+import time
+import shutil
+import socket
+import select
+import struct
+import argparse
+import threading
+import subprocess
+import socketserver
+from luks_tray.Stats import StageTimings, timings
+from luks_tray.Pipeline import execute, timeout_for, CancelToken, CANCELLED
+from luks_tray import Native
+from luks_tray.Utils import prt
+
+TIMED_OUT_RC, CANCELLED_RC = 124, 130 # as in Commands.py
+KILL_GRACE_SECS = 2.0 # from terminate() to kill(), and from kill() to giving up
+REQUEST_TIMEOUT_SECS = 10.0 # for the tray to wait for an answer (but to run/batch)
+ANSWER_SLACK_SECS = 2 * KILL_GRACE_SECS + 5 # beyond a command's own timeout
+ALLOWED = ('mount', 'umount', 'losetup', 'cryptsetup', 'bindfs', 'mkdir',
+           'rmdir', 'truncate', 'mkfs.ext4', 'fuser')
+SUBCOMMANDS = ('cryptsetup',) # time these per subcommand (e.g., "cryptsetup open")
+
+def op_key(args):
+    """ The name under which a command is timed """
+    if args and args[0] in SUBCOMMANDS and len(args) > 1:
+        return f'{args[0]} {args[1]}'
+    return args[0] if args else '?'
+
+
+class HelperServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Serves the helper socket; a thread per connection """
+    daemon_threads = True
+
+    def __init__(self, path, uid, native=True):
+        self.uid = uid
+        self.programs = {name: shutil.which(name) for name in ALLOWED}
+        self.native = Native.configure(native)
+        self.cancels = {} # request id => CancelToken of batches in flight
+        self.procs = {} # request id => process running for it
+        self.cancels_lock = threading.Lock()
+        self.timings = StageTimings()
+        super().__init__(path, HelperHandler)
+
+    def dispatch(self, request, notify=None):
+        """ Do one request; returns the response dict (notify(dict)
+            sends an interim line, e.g., batch progress) """
+        op = request.get('op', None)
+        if op == 'ping':
+            return {'ok': True, 'pid': os.getpid()}
+        if op == 'stats':
+            return {'stats': self.timings.summary()}
+        if op == 'run':
+            return self.run(request.get('args', None), request.get('input', None),
+                            request.get('timeout_ms', None), request.get('id', None))
+        if op == 'batch':
+            return self.batch(request.get('steps', None), request.get('id', None), notify)
+        if op == 'cancel':
+            return self.cancel(request.get('target', None))
+        return {'error': f'unknown op {op!r}'}
+
+    def cancel(self, target):
+        """ Cancel the batch in flight with request id target """
+        with self.cancels_lock:
+            token = self.cancels.get(target, None)
+            proc = self.procs.get(target, None)
+        if token:
+            token.cancel()
+        if proc:
+            proc.cancelled = True
+            proc.terminate()
+        return {'ok': bool(token or proc)}
+
+    def batch(self, steps, batch_id=None, notify=None):
+        """ Run a pipeline of whitelisted commands (with rollback) """
+        def valid(step):
+            return (isinstance(step, dict) and isinstance(step.get('args', None), list)
+                    and (not step.get('fallback', None) or valid(step['fallback'])))
+        if not isinstance(steps, list) or not all(valid(step) for step in steps):
+            return {'error': 'steps must be a list of dicts with args'}
+        def run(args, input_str):
+            rv = self.run(args, input_str, run_id=batch_id)
+            if 'error' in rv:
+                return 126, '', rv['error']
+            return rv['rc'], rv['stdout'], rv['stderr']
+        progress = ((lambda index, count, name: notify({'progress': [index, count, name]}))
+                    if notify else None)
+        token = CancelToken()
+        with self.cancels_lock:
+            self.cancels[batch_id] = token
+        start = time.perf_counter()
+        try:
+            rv = execute(steps, run, progress, token.is_set)
+        finally:
+            with self.cancels_lock:
+                self.cancels.pop(batch_id, None)
+        self.timings.add('batch', (time.perf_counter() - start) * 1000)
+        return rv
+
+    def run(self, args, input_str, timeout_ms=None, run_id=None):
+        """ Run a whitelisted command (cancel() with run_id terminates it) """
+        if (not isinstance(args, list) or not args
+                or not all(isinstance(arg, str) for arg in args)):
+            return {'error': 'args must be a non-empty list of strings'}
+        start = time.perf_counter()
+        timeout_ms = timeout_ms if timeout_ms else timeout_for(args)
+        result = self.run_native(args, timeout_ms, run_id) if self.native else None
+        if result is not None:
+            rv = {'rc': result[0], 'stdout': result[1], 'stderr': result[2],
+                  'ms': (time.perf_counter() - start) * 1000}
+            self.timings.add(f'native {op_key(args)}', rv['ms'])
+            return rv
+        program = self.programs.get(args[0], None)
+        if not program:
+            return {'error': f'command {args[0]!r} not allowed or not installed'}
+        try:
+            proc = subprocess.Popen([program] + args[1:], stdin=subprocess.PIPE,
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, cwd='/')
+        except Exception as e:
+            proc = None
+            rv = {'rc': 127, 'stdout': '', 'stderr': f'{type(e).__name__}: {e}'}
+        if proc:
+            proc.cancelled = False
+            with self.cancels_lock:
+                self.procs[run_id] = proc
+            try:
+                rv = self.wait(proc, input_str, timeout_ms)
+            finally:
+                with self.cancels_lock:
+                    self.procs.pop(run_id, None)
+        rv['ms'] = (time.perf_counter() - start) * 1000
+        self.timings.add(op_key(args), rv['ms'])
+        return rv
+
+    def run_native(self, args, timeout_ms, run_id=None):
+        """ Native.run() the command, which gives up (rather than, say,
+            mount after the tray has rolled back) once past timeout_ms or
+            upon cancel() with run_id (or of the batch it is in) """
+        deadline = time.monotonic() + timeout_ms / 1000
+        with self.cancels_lock:
+            token = self.cancels.get(run_id, None)
+            own = token is None and run_id is not None
+            if own:
+                token = self.cancels[run_id] = CancelToken()
+        try:
+            return Native.run(args, stop=lambda: (token is not None and token.is_set())
+                              or time.monotonic() > deadline)
+        finally:
+            if own:
+                with self.cancels_lock:
+                    self.cancels.pop(run_id, None)
+
+    @staticmethod
+    def wait(proc, input_str, timeout_ms):
+        """ Wait for proc, terminating (then killing) it on timeout; one
+            that will not die is abandoned (its rc is then 124 anyway) """
+        timed_out = False
+        try:
+            stdout, stderr = proc.communicate(input_str, timeout=timeout_ms / 1000)
+        except subprocess.TimeoutExpired:
+            timed_out, stdout, stderr = True, '', ''
+            for stop in (proc.terminate, proc.kill):
+                stop()
+                try:
+                    stdout, stderr = proc.communicate(timeout=KILL_GRACE_SECS)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+        rc = proc.returncode
+        if timed_out:
+            rc, stderr = TIMED_OUT_RC, f'{stderr}\n[timed out after {timeout_ms / 1000:g}s]'
+        elif proc.cancelled:
+            rc, stderr = CANCELLED_RC, f'{stderr}\n[cancelled]'
+        return {'rc': rc, 'stdout': stdout or '', 'stderr': stderr or ''}
+
+
+class HelperHandler(socketserver.StreamRequestHandler):
+    """ One client connection: a request per line, a response per line """
+    def handle(self):
+        creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                        struct.calcsize('3i'))
+        _, uid, _ = struct.unpack('3i', creds)
+        if uid not in (0, self.server.uid):
+            return
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except Exception as e:
+                self.reply({'error': f'bad request: {e}'}, None)
+                continue
+            request_id = request.get('id', None) if isinstance(request, dict) else None
+            try:
+                response = self.server.dispatch(request, notify=functools.partial(
+                            self.reply, request_id=request_id))
+            except Exception as e:
+                response = {'error': f'bad request: {e}'}
+            self.reply(response, request_id)
+
+    def reply(self, response, request_id):
+        """ Send a response (or interim line) for the request with request_id """
+        response['id'] = request_id
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+        self.wfile.flush()
+
+
+def serve(path, uid, native=True):
+    """ Helper main: serve until stdin reaches EOF """
+    if os.path.exists(path):
+        os.unlink(path)
+    old_umask = os.umask(0o177)
+    try:
+        server = HelperServer(path, uid, native)
+    finally:
+        os.umask(old_umask)
+    if os.geteuid() == 0:
+        os.chown(path, uid, -1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    sys.stdout.write(f'READY {os.getpid()} native={int(server.native)}\n')
+    sys.stdout.flush()
+    try:
+        while sys.stdin.buffer.read(4096):
+            pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class HelperClient:
+    """ The tray's side: starts the helper and sends it requests. Each
+        thread gets its own connection, so requests from worker threads
+        need no locking.
+    """
+    def __init__(self):
+        self.proc = None
+        self.path = None
+        self.native = None # whether the running helper does native ops (if it can)
+        self.generation = 0 # bumped per start (so stale connections are redone)
+        self.local = threading.local()
+        self.ids = 0
+        self.lock = threading.Lock()
+
+    def start(self, path, use_sudo=True, timeout=5.0, native=True):
+        """ Start the helper listening at path; returns an error string
+            on failure (in which case callers fall back to forking sudo).
+            native=False makes it run the programs even for losetup/mount/umount.
+        """
+        self.stop()
+        uid = int(os.environ.get('SUDO_UID', os.getuid()))
+        args = [sys.executable, '-m', 'luks_tray.Helper', '--socket', path, '--uid', str(uid)]
+        if not native:
+            args.append('--no-native')
+        if use_sudo and os.geteuid() != 0:
+            args = ['sudo', '-n'] + args
+        package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        try:
+            proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE, cwd=package_parent)
+        except OSError as e:
+            return f'FAIL: cannot start helper: {e}'
+        ready, _, _ = select.select([proc.stdout], [], [], timeout)
+        line = proc.stdout.readline().decode() if ready else ''
+        if not line.startswith('READY'):
+            proc.kill()
+            _, stderr = proc.communicate()
+            return f'FAIL: helper did not start: {stderr.decode().strip()}'
+        self.proc, self.path, self.native = proc, path, 'native=1' in line
+        self.generation += 1
+        threading.Thread(target=self._drain_stderr, args=(proc,), name='helper-stderr',
+                         daemon=True).start()
+        prt(f'helper: started pid={line.split()[1]} socket={path} {" ".join(line.split()[2:])}')
+        return None
+
+    @staticmethod
+    def _drain_stderr(proc):
+        """ Log what the helper writes to stderr (e.g., the traceback of a
+            failed handler) so that a full pipe never blocks it """
+        for raw in iter(proc.stderr.readline, b''):
+            prt(f'helper stderr: {raw.decode(errors="replace").rstrip()}')
+        proc.stderr.close()
+
+    def is_running(self):
+        """ Is the helper up? """
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self):
+        """ Stop the helper (by closing its stdin) """
+        proc, self.proc = self.proc, None
+        if proc:
+            try:
+                proc.stdin.close()
+                proc.wait(timeout=2)
+            except Exception:
+                proc.kill()
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or conn[0] != self.generation:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            conn = self.local.conn = (self.generation, sock, sock.makefile('rwb'))
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        self.local.conn = None
+        if conn:
+            for closable in (conn[2], conn[1]):
+                try:
+                    closable.close()
+                except OSError:
+                    pass
+
+    def next_id(self):
+        """ A new request id """
+        with self.lock:
+            self.ids += 1
+            return self.ids
+
+    def request(self, op, request_id=None, on_progress=None, timeout=REQUEST_TIMEOUT_SECS,
+                **params):
+        """ Send a request; returns the response dict, or None if the
+            helper is not running or the connection failed. Interim
+            progress lines are passed to on_progress(*progress). With no
+            answer in timeout seconds, returns {"error": ..., "timed_out": True}.
+        """
+        if not self.is_running():
+            return None
+        request = dict(params, op=op, id=request_id if request_id else self.next_id())
+        try:
+            _, sock, stream = self._connection()
+            sock.settimeout(timeout)
+            stream.write(json.dumps(request).encode() + b'\n')
+            stream.flush()
+            while True:
+                line = stream.readline()
+                if not line:
+                    raise OSError('helper closed the connection')
+                response = json.loads(line)
+                if 'progress' not in response:
+                    return response
+                if on_progress:
+                    on_progress(*response['progress'])
+        except TimeoutError:
+            prt(f'helper: {op} got no answer in {timeout:g}s')
+            self._drop_connection()
+            return {'error': f'helper did not answer in {timeout:g}s', 'timed_out': True}
+        except (OSError, ValueError) as e:
+            prt(f'helper: {op} failed: {e}')
+            self._drop_connection()
+            return None
+
+    def run(self, args, input_str=None, timeout_ms=None, cancel=None):
+        """ Run a command via the helper; returns (rc, stdout, stderr), or
+            None if the helper is unavailable or refused it. The command
+            is stopped after timeout_ms (default: per timeout_for()) or
+            upon cancel (a CancelToken). """
+        timeout_ms = timeout_ms if timeout_ms else timeout_for(args)
+        run_id = self.next_id()
+        if cancel:
+            cancel.on_cancel(lambda: self.request('cancel', target=run_id))
+        start = time.perf_counter()
+        response = self.request('run', request_id=run_id, args=list(args), input=input_str,
+                    timeout_ms=timeout_ms, timeout=timeout_ms / 1000 + ANSWER_SLACK_SECS)
+        if response and response.get('timed_out', False):
+            return TIMED_OUT_RC, '', response['error']
+        if response is None or 'error' in response:
+            if response:
+                prt(f'helper: {op_key(args)}: {response["error"]}')
+            return None
+        timings.add(f'helper {op_key(args)}', (time.perf_counter() - start) * 1000)
+        return response['rc'], response['stdout'], response['stderr']
+
+    def batch(self, steps, progress=None, cancel=None):
+        """ Run a pipeline (see Pipeline.py) in the helper in one request;
+            returns the result of execute(), or None if the helper is
+            unavailable or refused it. progress(index, count, name) is
+            called per step; cancel is a CancelToken (cancel.cancel() from
+            another thread sends the helper a "cancel" request). """
+        if cancel and cancel.is_set():
+            return {'err': f'{CANCELLED}: before start', 'captures': {}, 'steps': [], 'undone': []}
+        batch_id = self.next_id()
+        if cancel:
+            cancel.on_cancel(lambda: self.request('cancel', target=batch_id))
+        timeout = sum(timeout_for(step['args']) + (timeout_for(step['undo'])
+                if step.get('undo', None) else 0) for step in steps) / 1000 + ANSWER_SLACK_SECS
+        start = time.perf_counter()
+        response = self.request('batch', request_id=batch_id, on_progress=progress,
+                                timeout=timeout, steps=steps)
+        if response and response.get('timed_out', False):
+            return {'err': f'FAIL: {response["error"]}', 'captures': {}, 'steps': [], 'undone': []}
+        if response is None or 'error' in response:
+            if response:
+                prt(f'helper: batch: {response["error"]}')
+            return None
+        timings.add('helper batch', (time.perf_counter() - start) * 1000)
+        return response
+
+    def report(self, timeout=REQUEST_TIMEOUT_SECS):
+        """ The helper's per-operation timings as a printable table ('' if
+            the helper is not running or does not answer in timeout seconds) """
+        response = self.request('stats', timeout=timeout)
+        if not response or not response.get('stats', None):
+            return ''
+        lines = ['helper timings (ms, as run by the helper):',
+                 f'  {"op":<28} {"count":>8} {"p50":>9} {"p95":>9} {"max":>9}']
+        for key, row in sorted(response['stats'].items()):
+            lines.append(f'  {key:<28} {row["count"]:>8} {row["p50"]:>9.3f}'
+                         f' {row["p95"]:>9.3f} {row["max"]:>9.3f}')
+        return '\n'.join(lines)
+
+helper = HelperClient()
+
+def main():
+    """ Helper entry: python -m luks_tray.Helper --socket PATH --uid UID """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', required=True, help='Unix socket path')
+    parser.add_argument('--uid', type=int, default=os.getuid(),
+            help='the (only) non-root user allowed to connect')
+    parser.add_argument('--no-native', action='store_true',
+            help='run losetup/mount/umount rather than doing them in-process')
+    opts = parser.parse_args()
+    serve(opts.socket, opts.uid, native=not opts.no_native)
+
+if __name__ == '__main__':
+    main()
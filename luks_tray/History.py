@@ -8,12 +8,200 @@
 import os
 import time
 import json
-import subprocess
-from types import SimpleNamespace
 import hashlib
 import base64
+import threading
+from types import SimpleNamespace
 from cryptography.fernet import Fernet
 from luks_tray.Utils import prt
+from luks_tray.Records import VitalRecord
+from luks_tray.LuksHeader import header_cache
+from luks_tray.Stats import timings
+
+KDF_LIMITS = { # sanity bounds on the KDF parameters (including those read from files)
+    'log_n': (10, 20), 'r': (1, 32), 'p': (1, 16), 'iterations': (1000, 100000000),
+}
+
+def kdf_params(kdf='scrypt', scrypt_log_n=15, pbkdf2_iterations=600000):
+    """ The KDF parameters as stored in the file (less the salt) """
+    if kdf == 'pbkdf2':
+        return {'kdf': 'pbkdf2', 'hash': 'sha256', 'iterations': pbkdf2_iterations}
+    return {'kdf': 'scrypt', 'log_n': scrypt_log_n, 'r': 8, 'p': 1}
+
+def derive_key(password, salt, params):
+    """ The Fernet key for the password and salt per the KDF params; with
+        params None, it is the unsalted SHA256 of the v1 file format.
+        Raises ValueError on unknown or out-of-bounds params.
+    """
+    def bounded(name):
+        low, high = KDF_LIMITS[name]
+        value = params.get(name, None)
+        if not isinstance(value, int) or not low <= value <= high:
+            raise ValueError(f'bad KDF parameter {name}={value!r}')
+        return value
+
+    secret = password.encode()
+    if params is None:
+        key = hashlib.sha256(secret).digest()
+    elif params.get('kdf') == 'scrypt':
+        n, r, p = 1 << bounded('log_n'), bounded('r'), bounded('p')
+        key = hashlib.scrypt(secret, salt=salt, n=n, r=r, p=p,
+                             maxmem=128 * r * (n + p + 2) + (1 << 20), dklen=32)
+    elif params.get('kdf') == 'pbkdf2' and params.get('hash') in ('sha256', 'sha512'):
+        key = hashlib.pbkdf2_hmac(params['hash'], secret, salt, bounded('iterations'), 32)
+    else:
+        raise ValueError(f'unsupported KDF {params.get("kdf")!r}')
+    return base64.urlsafe_b64encode(key)
+
+def calibrate_kdf(target_ms=500):
+    """ Time the KDFs on this CPU and print the [history] settings that
+        make unlocking take about target_ms.
+    """
+    def timed(params):
+        start = time.perf_counter()
+        derive_key('calibrate', b'0123456789abcdef', params)
+        return (time.perf_counter() - start) * 1000
+
+    best_log_n = KDF_LIMITS['log_n'][0]
+    for log_n in range(KDF_LIMITS['log_n'][0], KDF_LIMITS['log_n'][1] + 1):
+        ms = timed(kdf_params('scrypt', scrypt_log_n=log_n))
+        print(f'  scrypt log_n={log_n:<2} (N={1 << log_n:>7}, {(1 << log_n) >> 10:>4} MiB): {ms:8.1f}ms')
+        if ms > target_ms * 1.5:
+            break
+        best_log_n = log_n
+        if ms >= target_ms:
+            break
+
+    probe = 100000
+    ms = timed(kdf_params('pbkdf2', pbkdf2_iterations=probe))
+    iterations = max(KDF_LIMITS['iterations'][0], int(probe * target_ms / ms) // 10000 * 10000)
+    print(f'  pbkdf2-sha256 iterations={probe}: {ms:8.1f}ms')
+    print(f'\nFor ~{target_ms}ms unlocks, put in config.ini (scrypt is preferred):')
+    print(f'[history]\nkdf = scrypt\nscrypt_log_n = {best_log_n}\npbkdf2_iterations = {iterations}')
+
+class HistoryWriter:
+    """
+    Write-behind persistence of the history file. Saves are queued and
+    coalesced for `delay` seconds; a worker thread then serializes (and
+    encrypts) the latest snapshot and replaces the file atomically (temp
+    file + fsync + rename). A snapshot whose serialized form (and master
+    password) equals the last one written is not written at all.
+    """
+    def __init__(self, path, encrypt, delay=0.5, on_written=None):
+        self.path = path
+        self.encrypt = encrypt # encrypt(data_bytes, password) => file bytes
+        self.on_written = on_written # on_written(password, err) after each queued write
+        self.delay = delay
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.pending = None # the latest unwritten snapshot
+        self.busy = False # the worker is writing
+        self.seq = 0 # of the latest snapshot queued
+        self.written_seq = 0 # of the latest snapshot written (or skipped)
+        self.written_mtime = None # of the file we last wrote
+        self.last_written = None # (password, data, payload) last written
+        self.error = None # of the last write
+        self.writes, self.skips = 0, 0
+        self.thread = None
+
+    def is_busy(self):
+        """ Is a write pending or in progress? """
+        with self.cond:
+            return self.pending is not None or self.busy
+
+    def queue(self, entries, password):
+        """ Queue a snapshot (the JSON-ready vitals) for writing """
+        with self.cond:
+            self.seq += 1
+            if self.pending is None:
+                self.pending = SimpleNamespace(seq=self.seq, entries=entries,
+                            password=password, since=time.monotonic())
+            else: # coalesce, but keep the deadline of the first
+                self.pending.seq, self.pending.entries = self.seq, entries
+                self.pending.password = password
+            if not self.thread:
+                self.thread = threading.Thread(target=self.run, name='history-writer',
+                                               daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def flush(self):
+        """ Write any pending snapshot now (on the caller's thread) and wait
+            for any write in progress. Returns the error of that write.
+        """
+        with self.cond:
+            job, self.pending = self.pending, None
+        if job:
+            return self.write(job)
+        with self.write_lock: # wait out the worker
+            return self.error
+
+    def run(self):
+        """ The worker thread """
+        while True:
+            with self.cond:
+                while self.pending is None:
+                    self.cond.wait()
+                while self.pending is not None:
+                    left = self.pending.since + self.delay - time.monotonic()
+                    if left <= 0:
+                        break
+                    self.cond.wait(left)
+                job, self.pending = self.pending, None
+                if job is None: # flushed meanwhile
+                    continue
+                self.busy = True
+            try:
+                err = self.write(job)
+            finally:
+                with self.cond:
+                    self.busy = False
+                    self.cond.notify_all()
+            if self.on_written:
+                self.on_written(job.password, err)
+
+    def write(self, job):
+        """ Serialize, encrypt, and atomically write one snapshot; returns
+            an error string on failure """
+        with self.write_lock:
+            if job.seq <= self.written_seq:
+                return self.error # a newer one was already written (or tried)
+            start = time.perf_counter()
+            if job.password:
+                data = json.dumps(job.entries).encode('utf-8')
+            else:
+                data = json.dumps(job.entries, indent=4).encode('utf-8')
+            if (self.last_written and (job.password, data) == self.last_written[:2]
+                    and os.path.exists(self.path)):
+                self.written_seq, self.skips = job.seq, self.skips + 1
+                return None
+            tmp_path = f'{self.path}.tmp'
+            try:
+                payload = self.encrypt(data, job.password) if job.password else data
+                with open(tmp_path, 'wb') as file:
+                    file.write(payload)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(tmp_path, self.path)
+                dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+                self.written_mtime = os.path.getmtime(self.path)
+                self.last_written = (job.password, data, payload)
+                self.error = None
+                self.writes += 1
+            except Exception as e:
+                prt(f'Error saving history: {e}')
+                self.error = f'failed saving history: {e}'
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+            self.written_seq = job.seq
+            timings.add('history.write', (time.perf_counter() - start) * 1000)
+            return self.error
 
 class HistoryClass:
     """
@@ -21,7 +209,8 @@ class HistoryClass:
     The history can be stored in a clear-text JSON format or an encrypted file
     using a master password.
     """
-    ENCRYPTED_HEADER = b'{{{ENCRYPTED}}}'
+    ENCRYPTED_HEADER = b'{{{ENCRYPTED}}}' # v1: Fernet token w unsalted SHA256 key
+    ENCRYPTED_HEADER_V2 = b'{{{ENCRYPTED-v2}}}\n' # then KDF params JSON line + Fernet token
 
     def __init__(self, path, master_password=''):
         self.status = None # 'clear_text', 'unlocked', 'locked'
@@ -32,6 +221,16 @@ class HistoryClass:
         self.last_mtime = None
         self.file_existed = False
         self.upons = set() # all known mounts
+        self.generation = 0 # bumped whenever vitals are replaced or added
+        self.writer = HistoryWriter(path, self._encrypt, on_written=self._written_behind)
+        self.post = None # post(func, *args) calls func on the owner's (GUI) thread
+        self.session_key = os.urandom(32) # for password fingerprints
+        self.failed_attempt = None # (mtime, size, password fingerprint) of the last failed unlock
+        self.kdf = kdf_params() # for new saves; see configure_kdf()
+        self.keys = {} # (password fingerprint, salt, KDF params) => derived key
+        self.keys_lock = threading.Lock()
+        self.salt = None # (password fingerprint, KDF params, salt) of the file
+        self.decrypted = None # (password fingerprint, file bytes, plaintext)
         # self._load_initial_state()
 
 
@@ -45,18 +244,12 @@ class HistoryClass:
     @staticmethod
     def make_ns(uuid):
         """
-        Creates a new SimpleNamespace object to represent a LUKS volume's vital information.
+        Creates a new VitalRecord to represent a LUKS volume's vital information.
 
         Args:
             uuid (str): The unique identifier for the LUKS volume.
         """
-        return SimpleNamespace(
-                uuid=uuid, # can be full path
-                password='',
-                upon='', # "primary" mount only
-                back_file='', # backing file if any
-                when=0,  # last update
-            )
+        return VitalRecord(uuid=uuid)
 
     def _has_file_changed(self):
         """
@@ -65,13 +258,18 @@ class HistoryClass:
         Returns:
             bool: True if the file has changed or if it's the first check. False otherwise.
         """
+        if self.writer.is_busy():
+            return False # the file is about to be replaced by what we have
         file_exists_now = os.path.exists(self.path)
         if not file_exists_now:
             return True  # Needs init
         if self.master_password and self.status == 'locked':
-            return True # need to try password unlock
+            # retry the unlock only if the file or password changed
+            return self._unlock_attempt() != self.failed_attempt
         if file_exists_now:
             current_mtime = os.path.getmtime(self.path)
+            if current_mtime == self.writer.written_mtime:
+                self.last_mtime = current_mtime # our own write
             if self.last_mtime is None or self.last_mtime != current_mtime:
                 self.last_mtime = current_mtime
                 self.file_existed = True
@@ -91,7 +289,7 @@ class HistoryClass:
             uuid (str): The UUID of the volume.
 
         Returns:
-            SimpleNamespace: The object containing vital info, or a new empty one if not found.
+            VitalRecord: The object containing vital info, or a new empty one if not found.
         """
         vital = self.vitals.get(uuid, None)
         if not vital: # should not happen
@@ -103,9 +301,10 @@ class HistoryClass:
         Updates the vital information for a LUKS volume and marks the history as dirty.
 
         Args:
-            vital (SimpleNamespace): The vital object to be saved.
+            vital (VitalRecord): The vital object to be saved.
         """
         self.vitals[vital.uuid] = vital
+        self.generation += 1
         vital.when = time.time()
         return self.save(force=True)
 
@@ -115,7 +314,7 @@ class HistoryClass:
         Updates the container's details if a change is detected.
 
         Args:
-            container (SimpleNamespace): The container object to check and add.
+            container (ContainerRecord): The container object to check and add.
         """
         # do not save auto-mounts by file managers or gnome-disks
         upon = container.upon
@@ -135,86 +334,174 @@ class HistoryClass:
             self.dirty = True
         elif self.vitals[uuid].back_file != container.back_file:
             self.vitals[uuid].back_file = container.back_file
+        fstype = container.filesystems[0].fstype if container.filesystems else ''
+        if fstype and self.vitals[uuid].fstype != fstype:
+            self.vitals[uuid].fstype = fstype # so mount options can be checked while locked
+            self.dirty = True
 
     def _namespaces_to_json_data(self):
-        """Converts internal vital namespaces to a JSON-serializable dictionary."""
+        """Converts internal vital records to a JSON-serializable dictionary."""
         entries = {}
         for uuid, vital in self.vitals.items():
-            legit = vars(vital)
             if not self.master_password:
-                legit['password'] = '' # zap password w/o master password
-            entries[uuid] = vars(vital)
+                vital.password = '' # zap password w/o master password
+            entries[uuid] = vital.to_json()
         return entries
 
-    def _password_to_fernet_key(self) -> bytes:
-        """Derive a Fernet-compatible key directly from a password using SHA256."""
-        # Hash the password to create a 32-byte key
-        key = hashlib.sha256(self.master_password.encode()).digest()
-        # Base64 encode the key to make it suitable for Fernet
-        fernet_key = base64.urlsafe_b64encode(key)
-        return fernet_key
+    def _fingerprint(self, password):
+        """ A keyed (per-session) hash identifying the password """
+        return hashlib.blake2b(password.encode(), key=self.session_key,
+                               digest_size=16).digest()
 
-    def save(self, force=False):
+    def _unlock_attempt(self):
+        """ What an unlock attempt depends on: (mtime, size, password fingerprint) """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, self._fingerprint(self.master_password))
+
+    def configure_kdf(self, ini_tool):
+        """ Take the KDF settings from the [history] section of config.ini;
+            if they changed, the file is re-encrypted on the next save. """
+        def get(key):
+            return ini_tool.get_current_val(key, 'history')
+        kdf = kdf_params(get('kdf'), scrypt_log_n=get('scrypt_log_n'),
+                         pbkdf2_iterations=get('pbkdf2_iterations'))
+        for name, (low, high) in KDF_LIMITS.items():
+            if not low <= kdf.get(name, low) <= high:
+                prt(f'skip [history] KDF settings: {name}={kdf[name]} not in [{low}..{high}]')
+                kdf = kdf_params()
+                break
+        if get('kdf') not in ('scrypt', 'pbkdf2'):
+            prt(f'skip [history] kdf={get("kdf")!r} [expecting scrypt or pbkdf2]')
+        if kdf != self.kdf:
+            self.kdf = kdf
+            self.dirty = self.dirty or bool(self.master_password)
+
+    def _key(self, password, salt, params):
+        """ The derived key (computed once per password, salt and params) """
+        cache_key = (self._fingerprint(password), salt,
+                     json.dumps(params, sort_keys=True))
+        with self.keys_lock:
+            key = self.keys.get(cache_key, None)
+        if key is None:
+            start = time.perf_counter()
+            key = derive_key(password, salt, params)
+            timings.add('history.kdf', (time.perf_counter() - start) * 1000)
+            with self.keys_lock:
+                if len(self.keys) > 8: # e.g., after many wrong passwords
+                    self.keys.clear()
+                self.keys[cache_key] = key
+        return key
+
+    def _password_to_fernet_key(self, password=None) -> bytes:
+        """Derive a Fernet-compatible key directly from a password using SHA256
+        (the v1 format, which is only read, to migrate it)."""
+        password = self.master_password if password is None else password
+        return self._key(password, b'', None)
+
+    def _decrypt(self, data):
+        """ The plaintext of the encrypted file content (v1 or v2). Content
+            we last decrypted or wrote is not decrypted again. A v1 file is
+            marked for rewriting as v2.
+        """
+        password = self.master_password
+        fingerprint = self._fingerprint(password)
+        cached = self.decrypted
+        if cached and cached[0] == fingerprint and cached[1] == data:
+            return cached[2]
+        written = self.writer.last_written
+        if written and written[0] == password and written[2] == data:
+            plaintext = written[1].decode('utf-8')
+        elif data.startswith(self.ENCRYPTED_HEADER_V2):
+            params_line, token = data[len(self.ENCRYPTED_HEADER_V2):].split(b'\n', 1)
+            params = json.loads(params_line)
+            salt = base64.b64decode(params.pop('salt'))
+            cipher = Fernet(self._key(password, salt, params))
+            plaintext = cipher.decrypt(token).decode('utf-8')
+            self.salt = (fingerprint, params, salt)
+        else:
+            cipher = Fernet(self._password_to_fernet_key())
+            plaintext = cipher.decrypt(data[len(self.ENCRYPTED_HEADER):]).decode('utf-8')
+            prt('NOTE: migrating the history file to the salted (v2) format')
+            self.dirty = True
+        self.decrypted = (fingerprint, data, plaintext)
+        return plaintext
+
+    def _encrypt(self, data, password):
+        """ The encrypted (v2) file content for the serialized vitals; the
+            salt (and so the derived key) is reused while the password and
+            KDF params are unchanged. """
+        fingerprint, params = self._fingerprint(password), self.kdf
+        if self.salt and self.salt[:2] == (fingerprint, params):
+            salt = self.salt[2]
+        else:
+            salt = os.urandom(16)
+            self.salt = (fingerprint, params, salt)
+        cipher = Fernet(self._key(password, salt, params))
+        params_line = json.dumps(params | {'salt': base64.b64encode(salt).decode()})
+        return (self.ENCRYPTED_HEADER_V2 + params_line.encode() + b'\n'
+                + cipher.encrypt(data))
+
+    def save(self, force=False, sync=False):
         """
         Saves the history file. Encrypts with the master password if set,
-        otherwise saves as plain text.
+        otherwise saves as plain text. The write is queued to the writer
+        (and coalesced with others) unless sync, in which case it is done
+        before returning. Returns an error string if a sync write failed
+        (a failed queued write is logged and retried by the next save).
         """
         if not self.dirty and not force:
             return None
-        try:
-            entries = self._namespaces_to_json_data()
-            if self.master_password:
-                # Save Encrypted with Header
-                cipher = Fernet(self._password_to_fernet_key())
-                json_data = json.dumps(entries).encode('utf-8')
-                encrypted_data = cipher.encrypt(json_data)
-
-                # Write header and encrypted data
-                with open(self.path, 'wb') as file:
-                    file.write(self.ENCRYPTED_HEADER)
-                    file.write(encrypted_data)
-            else:
-                # Save Clear-Text
-                with open(self.path, 'w', encoding='utf-8') as file:
-                    json.dump(entries, file, indent=4)
-        except Exception as e:
-            prt(f'Error saving history: {e}')
-            return f'failed saving history: {e}'
-
-        # Update state and mtime upon successful save
-        self.dirty = False
-        self.last_mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
-        self.file_existed = os.path.exists(self.path)
-        self.status = 'unlocked' if self.master_password else 'clear_text'
+        self.dirty = False # until a write fails (see _written())
+        self.writer.queue(self._namespaces_to_json_data(), self.master_password)
+        if sync:
+            err = self.flush()
+            self._written(self.master_password, err)
+            return err
         return None
 
+    def _written_behind(self, password, err):
+        """ (writer thread) pass the outcome of a queued write to our thread """
+        if self.post:
+            self.post(self._written, password, err)
+        else:
+            self._written(password, err)
+
+    def _written(self, password, err):
+        """ After a write: upon failure, mark the history dirty to try
+            again; else update its state (unless the master password has
+            changed since, so a newer save is to come) """
+        if err:
+            self.dirty = True
+        elif password == self.master_password:
+            self.file_existed = True
+            self.status = 'unlocked' if password else 'clear_text'
+
+    def flush(self):
+        """ Write any queued save now (e.g., before exiting); returns an
+            error string on failure """
+        return self.writer.flush()
+
     def _json_data_to_namespaces(self, entries):
         """
-        Converts a JSON-serializable dictionary back into internal vital namespaces.
+        Converts a JSON-serializable dictionary back into internal vital records.
         Also validates `back_file` entries and purges invalid ones.
         """
-        def get_luks_uuid(path):
-            try:
-                # Run blkid on the file and capture the output
-                result = subprocess.run(['blkid', '-o', 'value', '-s', 'UUID', path],
-                        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                        text=True, check=True)
-                return result.stdout.strip()  # Return the UUID as a string
-            except subprocess.CalledProcessError:
-                return ''
-
         self.vitals = {}
+        self.generation += 1
         purges = []
         if not isinstance(entries, dict):
             self.status = 'locked'
             return False
+        headers = header_cache.get_many(entry.get('back_file', '')
+                    for entry in entries.values()
+                    if isinstance(entry, dict) and entry.get('back_file', ''))
         for uuid, entry in entries.items():
-            legit = vars(self.make_ns(uuid))
-            for key in legit.keys():
-                if key in entry:
-                    legit[key] = entry[key]
-            ns = SimpleNamespace(**legit)
-            if ns.back_file and get_luks_uuid(ns.back_file) != uuid:
+            ns = VitalRecord.from_json(entry, uuid=uuid)
+            header = headers.get(ns.back_file, None)
+            if ns.back_file and (header is None or header.uuid != uuid):
                 purges.append(uuid)
             self.vitals[uuid] = ns
             if ns.upon:
@@ -242,7 +529,7 @@ class HistoryClass:
             """Re-initializes history to an empty clear_text state."""
             prt(f"Warning: {reason} Recreating an empty history.")
             self._json_data_to_namespaces({})
-            self.save(force=True)  # This will save as clear_text if master_password is not set
+            self.save(force=True, sync=True)  # This will save as clear_text if master_password is not set
             self.status = 'clear_text'
             return False
 
@@ -259,8 +546,7 @@ class HistoryClass:
             return re_init_history(f"Failed to read file: {e}")
 
         # --- Check for Encrypted Header ---
-        if data.startswith(self.ENCRYPTED_HEADER):
-            encrypted_data = data[len(self.ENCRYPTED_HEADER):]
+        if data.startswith((self.ENCRYPTED_HEADER, self.ENCRYPTED_HEADER_V2)):
 
             if not self.master_password:
                 # State 4: Encrypted but no master_password provided (locked)
@@ -269,19 +555,21 @@ class HistoryClass:
                 return False
 
             # Try to decrypt
+            attempt = self._unlock_attempt()
             try:
-                cipher = Fernet(self._password_to_fernet_key())
-                decrypted_str = cipher.decrypt(encrypted_data).decode('utf-8')
+                decrypted_str = self._decrypt(data)
                 decrypted_data = json.loads(decrypted_str)
                 self._json_data_to_namespaces(decrypted_data)
 
                 # State 3: Successfully Decrypted (unlocked)
                 self.status = 'unlocked'
+                self.failed_attempt = None
                 return True
             except Exception:
                 # Decryption failed (wrong password or corrupt encrypted data)
                 prt("Warning: History file appears encrypted, but decryption failed.")
                 self.status = 'locked'
+                self.failed_attempt = attempt
                 return False
 
         # --- Attempt Clear-Text JSON Load ---
@@ -37,15 +37,45 @@ class IniTool:
                 'show_passwords_by_default': True,
                 'show_anomaly_alerts': True,
                 'auto_mount_folder': '~/Vaults',
-            }
+                'device_scanner': 'sysfs', # or 'lsblk' or 'compare'
+                'use_helper': True, # run privileged commands via one root helper
+                'native_ops': True, # loop setup and (u)mount via ioctls/syscalls as root
+                'loop_direct_io': True, # crypt files' loop devices bypass the page cache
+            },
+            'refresh': {
+                'fast_ms': 250, # while operations are in flight or after a hotplug
+                'fast_window_ms': 5000, # how long to stay fast after a hotplug
+                'idle_min_ms': 3000, # first interval once things are quiet
+                'idle_max_ms': 300000, # interval after backing off all the way
+                'backoff_pct': 200, # growth of the interval per quiet refresh
+            },
+            'mount': { # defaults for containers without mount options of their own
+                'options': 'noatime', # as for "mount -o" (e.g., noatime,lazytime,commit=60)
+            },
+            'create': { # new crypt files (see CryptCreate.py)
+                'sector_size': 4096, # LUKS2 sector size (512, 1024, 2048, or 4096)
+                'unlock_ms': 1000, # Argon2id time cost calibrated to unlock in about this long
+                'kdf_memory_mib': 1024, # Argon2id memory (at most 1/4 of the available memory)
+                'cipher': 'auto', # fastest per "cryptsetup benchmark", or e.g., aes-xts-plain64
+            },
+            'history': { # key derivation for the master-password-encrypted history
+                'kdf': 'scrypt', # or 'pbkdf2'
+                'scrypt_log_n': 15, # scrypt cost N = 2**log_n (r=8, p=1)
+                'pbkdf2_iterations': 600000, # PBKDF2-HMAC-SHA256 iterations
+            },
         }
         self.folder = os.path.join(get_user_home(), ".config/luks-tray")
         self.ini_path =  os.path.join(self.folder, "config.ini")
         self.log_path =  os.path.join(self.folder, "debug.log")
         self.history_path =  os.path.join(self.folder, "history.json")
+        self.pid_path =  os.path.join(self.folder, "luks-tray.pid")
+        self.stats_path =  os.path.join(self.folder, "stats.txt")
+        self.helper_path =  os.path.join(self.folder, "helper.sock")
+        self.cipher_bench_path =  os.path.join(self.folder, "cipher-bench.json")
         self.config = configparser.ConfigParser()
         self.last_mod_time = None
-        self.section_params = {'ui': {}, }
+        self.section_params = {'ui': {}, 'refresh': {}, 'mount': {}, 'create': {},
+                               'history': {}, }
         self.params_by_selector = {}
         if not paths_only:
             self.ensure_ini_file()
@@ -54,7 +84,7 @@ class IniTool:
     @staticmethod
     def get_selectors():
         """ Returns the in right "order" """
-        return 'ui'.split()
+        return 'ui refresh mount create history'.split()
 
     def the_default(self, key, selector='ui'):
         """ return the default value given the selector and key """
@@ -105,14 +135,13 @@ class IniTool:
         self.config.read(self.ini_path)
         self.last_mod_time = current_mod_time
 
-        goldens = self.defaults['ui']
-        running = goldens
         all_params = {}
 
         # Access the configuration values in order
         # prt('parsing config.ini...')
         for selector in self.get_selectors():
-            all_params[selector] = params = copy.deepcopy(running)
+            goldens = self.defaults[selector]
+            all_params[selector] = params = copy.deepcopy(goldens)
             if selector not in self.config:
                 all_params[selector] = SimpleNamespace(**params)
                 continue
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-process reader of LUKS1 and LUKS2 headers (so we need not fork
+blkid or cryptsetup to learn a container's UUID, keyslots, PBKDF
+parameters, cipher and sector size).
+
+LUKS1: a 592-byte binary header with 8 fixed keyslots.
+LUKS2: a 4 KiB binary header followed by a JSON metadata area
+(hdr_size bytes in all); see the LUKS2 on-disk format spec.
+"""
+# pylint: disable=invalid-name,broad-exception-caught,too-many-arguments
+
+import os
+import stat
+import json
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+MAGICS = (b'LUKS\xba\xbe', b'SKUL\xba\xbe') # primary, secondary (LUKS2)
+LUKS1_KEY_ENABLED = 0x00AC71F3
+LUKS2_BIN_SIZE = 4096
+LUKS2_MAX_HDR_SIZE = 4 * 1024 * 1024 # the largest the spec allows
+
+def _cstr(raw):
+    """ Decode a NUL-padded byte field """
+    return raw.split(b'\0', 1)[0].decode('utf-8', 'replace').strip()
+
+def is_luks(data):
+    """ Does data start with a LUKS header? """
+    return data[:6] in MAGICS
+
+def make_info(version, uuid, label='', cipher='', sector_size=512,
+              keyslots=None, pbkdf=None, payload_offset=0):
+    """ The parsed header; keyslots is a list of namespaces with the
+        slot number and its PBKDF parameters (kdf, hash, iterations,
+        time, memory (KiB), cpus); pbkdf is that of the first keyslot.
+    """
+    keyslots = keyslots or []
+    return SimpleNamespace(version=version, uuid=uuid, label=label, cipher=cipher,
+                sector_size=sector_size, keyslots=keyslots, payload_offset=payload_offset,
+                pbkdf=pbkdf if pbkdf else (keyslots[0] if keyslots else None))
+
+def make_pbkdf(slot, kdf, hash_spec='', iterations=0, time=0, memory=0, cpus=0):
+    """ One keyslot's PBKDF parameters """
+    return SimpleNamespace(slot=slot, kdf=kdf, hash=hash_spec, iterations=iterations,
+                           time=time, memory=memory, cpus=cpus)
+
+def parse_luks1(data):
+    """ Parse a LUKS1 header (the first 592 bytes suffice) """
+    if len(data) < 208 + 8 * 48:
+        return None
+    cipher, mode, hash_spec = _cstr(data[8:40]), _cstr(data[40:72]), _cstr(data[72:104])
+    payload_offset = struct.unpack_from('>I', data, 104)[0]
+    keyslots = []
+    for slot in range(8):
+        active, iterations = struct.unpack_from('>II', data, 208 + slot * 48)
+        if active == LUKS1_KEY_ENABLED:
+            keyslots.append(make_pbkdf(slot, 'pbkdf2', hash_spec, iterations=iterations))
+    return make_info(1, _cstr(data[168:208]), cipher=f'{cipher}-{mode}',
+                     keyslots=keyslots, payload_offset=payload_offset * 512)
+
+def parse_luks2(data):
+    """ Parse a LUKS2 header. With just the 4 KiB binary header, only the
+        UUID and label are known; with hdr_size bytes, the JSON area
+        provides the rest. Returns None if the JSON area is corrupt.
+    """
+    hdr_size = struct.unpack_from('>Q', data, 8)[0]
+    info = make_info(2, _cstr(data[168:208]), label=_cstr(data[24:72]))
+    if len(data) < hdr_size or not LUKS2_BIN_SIZE < hdr_size <= LUKS2_MAX_HDR_SIZE:
+        return info
+    try:
+        meta = json.loads(_cstr(data[LUKS2_BIN_SIZE:hdr_size]))
+    except ValueError:
+        return None
+    for slot, keyslot in sorted(meta.get('keyslots', {}).items(), key=lambda x: int(x[0])):
+        kdf = keyslot.get('kdf', {})
+        info.keyslots.append(make_pbkdf(int(slot), kdf.get('type', ''), kdf.get('hash', ''),
+                iterations=kdf.get('iterations', 0), time=kdf.get('time', 0),
+                memory=kdf.get('memory', 0), cpus=kdf.get('cpus', 0)))
+    info.pbkdf = info.keyslots[0] if info.keyslots else None
+    for _, segment in sorted(meta.get('segments', {}).items(), key=lambda x: int(x[0])):
+        if segment.get('type') == 'crypt':
+            info.cipher = segment.get('encryption', '')
+            info.sector_size = segment.get('sector_size', 512)
+            info.payload_offset = int(segment.get('offset', 0))
+            break
+    return info
+
+def parse_header(data):
+    """ Parse a LUKS header from bytes read at offset 0 (None if not LUKS) """
+    if not is_luks(data):
+        return None
+    version = struct.unpack_from('>H', data, 6)[0]
+    if version == 1:
+        return parse_luks1(data)
+    if version == 2:
+        return parse_luks2(data)
+    return None
+
+def read_header(path):
+    """ Read and parse the LUKS header of a file or device (None if it is
+        not LUKS or cannot be read) """
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    except OSError:
+        return None
+    try:
+        data = os.pread(fd, LUKS2_BIN_SIZE, 0)
+        if is_luks(data) and struct.unpack_from('>H', data, 6)[0] == 2:
+            hdr_size = struct.unpack_from('>Q', data, 8)[0]
+            if LUKS2_BIN_SIZE < hdr_size <= LUKS2_MAX_HDR_SIZE:
+                data += os.pread(fd, hdr_size - LUKS2_BIN_SIZE, LUKS2_BIN_SIZE)
+        return parse_header(data)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+
+class HeaderCache:
+    """ Parsed headers of files keyed by (dev, inode, size, mtime) so an
+        unchanged container file is read just once. Block devices are
+        not cached (their mtime does not track their content).
+    """
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self.entries = {} # path => (key, info)
+        self.lock = threading.Lock()
+        self.reads = 0 # headers actually read (vs cache hits)
+
+    def get(self, path):
+        """ The parsed header of path (None if not LUKS or unreadable) """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return read_header(path) if stat.S_ISBLK(st.st_mode) else None
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            cached = self.entries.get(path, None)
+        if cached and cached[0] == key:
+            return cached[1]
+        info = read_header(path)
+        with self.lock:
+            self.entries[path] = (key, info)
+            self.reads += 1
+        return info
+
+    def get_many(self, paths):
+        """ The parsed headers of paths (read in parallel); returns
+            {path: info-or-None} """
+        paths = list(dict.fromkeys(paths))
+        if len(paths) <= 1:
+            return {path: self.get(path) for path in paths}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(paths))) as pool:
+            return dict(zip(paths, pool.map(self.get, paths)))
+
+    def forget(self, path):
+        """ Drop path from the cache (e.g., after reformatting it) """
+        with self.lock:
+            self.entries.pop(path, None)
+
+header_cache = HeaderCache()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parsing of /proc/self/mountinfo
+"""
+# pylint: disable=invalid-name,broad-exception-caught
+
+import re
+import select
+from types import SimpleNamespace
+
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+_octal_re = re.compile(r'\\([0-7]{3})')
+
+def unescape(field):
+    """ Undo the kernel's octal escapes (e.g., '\\040' for a space) """
+    if '\\' not in field:
+        return field
+    return _octal_re.sub(lambda mat: chr(int(mat.group(1), 8)), field)
+
+def parse_mountinfo(text):
+    """ Parse mountinfo text into a list of namespaces (in mount order).
+        Each line looks like:
+          36 35 98:0 /mnt1 /mnt/parent rw,noatime master:1 - ext3 /dev/root rw,errors=continue
+    """
+    mounts = []
+    for line in text.splitlines():
+        fields = line.split(' ')
+        try:
+            sep = fields.index('-', 6)
+        except ValueError:
+            continue # malformed
+        if len(fields) < sep + 3:
+            continue
+        options = fields[5].split(',')
+        super_options = fields[sep+3].split(',') if len(fields) > sep + 3 else []
+        mounts.append(SimpleNamespace(
+            mount_id=int(fields[0]),
+            majmin=fields[2],
+            root=unescape(fields[3]),
+            upon=unescape(fields[4]),
+            options=options,
+            fstype=fields[sep+1],
+            source=unescape(fields[sep+2]),
+            readonly='ro' in options or 'ro' in super_options,
+            ))
+    return mounts
+
+def read_mountinfo(path=MOUNTINFO_PATH):
+    """ Read and parse the mount table """
+    with open(path, 'r', encoding='utf-8', errors='surrogateescape') as f:
+        return parse_mountinfo(f.read())
+
+
+class MountTable:
+    """ Cached, indexed view of the mount table. The kernel flags the
+        mountinfo fd with POLLPRI|POLLERR whenever the table changes, so
+        the file is reparsed only then.  The owner may also register
+        fileno() with its event loop (as an "exception" notifier) and call
+        note_change() when it fires; a poll by the event loop consumes the
+        kernel's flag, so either way the change lands in self.stale.
+    """
+    def __init__(self, path=MOUNTINFO_PATH):
+        self.path = path
+        self.file = open(path, 'rb') # pylint: disable=consider-using-with
+        self.poller = select.poll()
+        self.poller.register(self.file.fileno(), select.POLLPRI | select.POLLERR)
+        self.stale = True
+        self.mounts = [] # in mount order
+        self.by_device = {} # source device => [mounts]
+        self.by_point = {} # mount point => mount (the topmost if stacked)
+        self.reparses = 0
+
+    def fileno(self):
+        """ The fd to watch for POLLPRI """
+        return self.file.fileno()
+
+    def note_change(self):
+        """ Called when the event loop saw the fd signal a change """
+        self.stale = True
+
+    def check(self):
+        """ Non-blocking check for a change; returns True if stale """
+        if self.poller.poll(0):
+            self.stale = True
+        return self.stale
+
+    def refresh(self, force=False):
+        """ Reparse if the table changed. Returns True if reparsed. """
+        if not self.check() and not force:
+            return False
+        self.stale = False
+        self.file.seek(0)
+        text = self.file.read().decode('utf-8', 'surrogateescape')
+        self.mounts = parse_mountinfo(text)
+        self.by_device, self.by_point = {}, {}
+        for mnt in self.mounts:
+            self.by_device.setdefault(mnt.source, []).append(mnt)
+            self.by_point[mnt.upon] = mnt
+        self.reparses += 1
+        return True
+
+    def device_of(self, upon):
+        """ The source device mounted at upon (or None) """
+        mnt = self.by_point.get(upon, None)
+        return mnt.source if mnt else None
+
+    def is_readonly(self, upon):
+        """ Is the mount at upon read-only? """
+        mnt = self.by_point.get(upon, None)
+        return bool(mnt and mnt.readonly)
+
+    def close(self):
+        """ Release the fd """
+        self.poller.unregister(self.file.fileno())
+        self.file.close()
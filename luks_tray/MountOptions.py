@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mount option profiles: a container's mount options (e.g., "noatime,
+lazytime,discard=async,commit=60") as remembered in its history vital,
+else the [mount] options of config.ini. They are checked against the
+filesystem type (the one detected, or remembered from the last mount)
+before mounting, so that a typo fails in the dialog rather than as a
+"wrong fs type, bad option" from mount.
+
+Each per-filesystem table maps an option name to what it takes:
+  - None: nothing (a bare flag, e.g., "noatime")
+  - int: a number (e.g., "commit=60")
+  - str: any value (e.g., "subvol=@home")
+  - a tuple: one of those values; a None in it allows the bare flag too
+    (e.g., "discard" or "discard=async"), and a str in it any value.
+"""
+# pylint: disable=invalid-name
+
+GENERIC = dict.fromkeys(( # VFS options that any filesystem takes
+    'defaults', 'ro', 'rw', 'suid', 'nosuid', 'dev', 'nodev', 'exec', 'noexec',
+    'sync', 'async', 'dirsync', 'atime', 'noatime', 'diratime', 'nodiratime',
+    'relatime', 'norelatime', 'strictatime', 'nostrictatime', 'lazytime', 'nolazytime',
+    'mand', 'nomand', 'silent', 'loud'))
+
+FSTAB_ONLY = ('auto', 'noauto', 'nofail', 'user', 'users', 'nouser', 'owner', 'group',
+              '_netdev', 'comment')
+
+ON_OFF = (None, '0', '1')
+FAT_LIKE = {'uid': int, 'gid': int, 'umask': str, 'dmask': str, 'fmask': str,
+            'iocharset': str, 'discard': None, 'allow_utime': str, 'time_offset': str,
+            'errors': ('panic', 'continue', 'remount-ro')}
+
+BY_FSTYPE = {
+    'ext4': {
+        'discard': None, 'nodiscard': None, 'commit': int,
+        'data': ('journal', 'ordered', 'writeback'), 'barrier': ON_OFF, 'nobarrier': None,
+        'journal_checksum': None, 'nojournal_checksum': None, 'journal_async_commit': None,
+        'journal_ioprio': int, 'delalloc': None, 'nodelalloc': None,
+        'auto_da_alloc': ON_OFF, 'noauto_da_alloc': None,
+        'errors': ('continue', 'remount-ro', 'panic'), 'stripe': int,
+        'inode_readahead_blks': int, 'max_batch_time': int, 'min_batch_time': int,
+        'init_itable': (None, str), 'noinit_itable': None, 'user_xattr': None,
+        'nouser_xattr': None, 'acl': None, 'noacl': None, 'dax': (None, 'always', 'never', 'inode'),
+        'quota': None, 'noquota': None, 'usrquota': None, 'grpquota': None, 'prjquota': None,
+        'block_validity': None, 'noblock_validity': None, 'dioread_lock': None,
+        'dioread_nolock': None, 'i_version': None, 'noload': None, 'norecovery': None,
+        'resuid': int, 'resgid': int, 'sb': int, 'grpid': None, 'bsdgroups': None,
+        'nogrpid': None, 'sysvgroups': None,
+    },
+    'btrfs': {
+        'compress': (None, str), 'compress-force': (None, str),
+        'discard': (None, 'sync', 'async'), 'nodiscard': None, 'ssd': None, 'nossd': None,
+        'ssd_spread': None, 'nossd_spread': None, 'autodefrag': None, 'noautodefrag': None,
+        'commit': int, 'space_cache': (None, 'v1', 'v2'), 'nospace_cache': None,
+        'clear_cache': None, 'subvol': str, 'subvolid': int, 'datacow': None,
+        'nodatacow': None, 'datasum': None, 'nodatasum': None, 'degraded': None,
+        'device': str, 'flushoncommit': None, 'noflushoncommit': None, 'max_inline': str,
+        'thread_pool': int, 'user_subvol_rm_allowed': None, 'skip_balance': None,
+        'rescue': str, 'acl': None, 'noacl': None, 'barrier': None, 'nobarrier': None,
+        'treelog': None, 'notreelog': None, 'fatal_errors': ('bug', 'panic'),
+    },
+    'xfs': {
+        'discard': None, 'nodiscard': None, 'inode32': None, 'inode64': None,
+        'largeio': None, 'nolargeio': None, 'logbufs': int, 'logbsize': str,
+        'allocsize': str, 'noquota': None, 'uquota': None, 'usrquota': None, 'gquota': None,
+        'grpquota': None, 'pquota': None, 'prjquota': None, 'uqnoenforce': None,
+        'gqnoenforce': None, 'pqnoenforce': None, 'wsync': None, 'filestreams': None,
+        'norecovery': None, 'nouuid': None, 'swalloc': None, 'sunit': int, 'swidth': int,
+        'dax': (None, 'always', 'never', 'inode'), 'logdev': str, 'rtdev': str,
+        'ikeep': None, 'noikeep': None,
+    },
+    'f2fs': {
+        'discard': None, 'nodiscard': None, 'background_gc': ('on', 'off', 'sync'),
+        'gc_merge': None, 'nogc_merge': None, 'checkpoint_merge': None,
+        'nocheckpoint_merge': None, 'compress_algorithm': str, 'compress_extension': str,
+        'inline_xattr': None, 'noinline_xattr': None, 'inline_data': None,
+        'noinline_data': None, 'flush_merge': None, 'active_logs': int, 'atgc': None,
+        'age_extent_cache': None, 'mode': str, 'fsync_mode': ('posix', 'strict', 'nobarrier'),
+        'acl': None, 'noacl': None, 'user_xattr': None, 'nouser_xattr': None,
+        'barrier': None, 'nobarrier': None,
+    },
+    'vfat': dict(FAT_LIKE, check=('r', 'n', 's', 'relaxed', 'normal', 'strict'),
+                 codepage=int, utf8=ON_OFF, flush=None, quiet=None, showexec=None,
+                 shortname=('lower', 'win95', 'winnt', 'mixed'), tz=('UTC',),
+                 usefree=None, dos1xfloppy=None, sys_immutable=None, rodir=None),
+    'exfat': dict(FAT_LIKE, keep_last_dots=None, sys_tz=None),
+    'ntfs3': dict(FAT_LIKE, sparse=None, showmeta=None, prealloc=None, acl=None, noacl=None,
+                  force=None, hidden=None, hide_dot_files=None, windows_names=None,
+                  nocase=None, sys_immutable=None),
+}
+
+def split(options):
+    """ The options of a comma-separated string (sans blanks) """
+    return [opt.strip() for opt in (options or '').split(',') if opt.strip()]
+
+def check_one(option, table):
+    """ Check one option against table; returns an error or None """
+    name, has_value, value = option.partition('=')
+    if name not in table:
+        return f'unknown mount option "{name}"'
+    spec = table[name]
+    choices = spec if isinstance(spec, tuple) else (spec,)
+    if not has_value:
+        return None if None in choices else f'mount option "{name}" needs a value'
+    if not value:
+        return f'mount option "{name}=" needs a value'
+    if int in choices and value.isdigit():
+        return None
+    if str in choices or value in choices:
+        return None
+    if choices == (None,):
+        return f'mount option "{name}" takes no value'
+    wants = 'a number' if int in choices else ' or '.join(
+        repr(choice) for choice in choices if isinstance(choice, str))
+    return f'mount option "{name}" wants {wants}'
+
+def validate(options, fstype=''):
+    """ Check mount options for a filesystem of the given type (if known);
+        returns None if fine, else the error """
+    table = BY_FSTYPE.get(fstype, None)
+    for option in split(options):
+        name = option.partition('=')[0]
+        if any(char.isspace() for char in option):
+            return f'ERR: mount option "{option}" has blanks'
+        if name in FSTAB_ONLY or name.lower().startswith('x-'):
+            return f'ERR: mount option "{name}" is only for fstab'
+        if name in GENERIC:
+            if '=' in option:
+                return f'ERR: mount option "{name}" takes no value'
+            continue
+        if table is None:
+            continue # an unknown (or unsupported) type: leave it to mount
+        err = check_one(option, table)
+        if err:
+            return f'ERR: {err} for {fstype}'
+    return None
+
+def merge(options, readonly=False):
+    """ The -o argument for mounting with options (read-only if asked,
+        whatever the options say); '' for none """
+    rv = []
+    for option in split(options):
+        if option == 'defaults' or (readonly and option == 'rw') or option in rv:
+            continue
+        rv.append(option)
+    if readonly and 'ro' not in rv:
+        rv.insert(0, 'ro')
+    return ','.join(rv)
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Native Linux backend (via ctypes) for the privileged commands we would
+otherwise fork: loop setup via /dev/loop-control (LOOP_CTL_GET_FREE +
+LOOP_CONFIGURE, falling back to LOOP_SET_FD + LOOP_SET_STATUS64 on
+kernels before 5.8), loop detach, mount(2)/umount2(2), and idmapped bind mounts (open_tree +
+mount_setattr(MOUNT_ATTR_IDMAP) + move_mount, 5.12+) that present a
+crypt file's filesystem as owned by the user at native speed (instead
+of the FUSE remapping of bindfs).
+
+run(args) takes the same command lines as the command-line backend
+("losetup -f --show FILE", "mount -o ro SRC TGT", ...) and returns
+(returncode, stdout, stderr) like it, or None for anything it does not
+handle (so the caller runs the command instead). These need root, so
+they are used by the root helper (or a tray running as root) once
+configure() enables them.
+"""
+# pylint: disable=invalid-name,broad-exception-caught,too-few-public-methods
+
+import os
+import stat
+import errno
+import fcntl
+import itertools
+import collections
+import ctypes
+import ctypes.util
+from luks_tray.SysfsScanner import probe_header, probe_btrfs
+
+LOOP_SET_FD = 0x4C00
+LOOP_CLR_FD = 0x4C01
+LOOP_SET_STATUS64 = 0x4C04
+LOOP_SET_DIRECT_IO = 0x4C08
+LOOP_SET_BLOCK_SIZE = 0x4C09
+LOOP_CONFIGURE = 0x4C0A
+LOOP_CTL_GET_FREE = 0x4C82
+LO_FLAGS_READ_ONLY = 1
+LO_FLAGS_AUTOCLEAR = 4
+LO_FLAGS_DIRECT_IO = 16
+LO_NAME_SIZE = 64
+
+MS_FLAGS = { # mount(8) options that are mount(2) flags
+    'ro': 0x1, 'nosuid': 0x2, 'nodev': 0x4, 'noexec': 0x8, 'sync': 0x10,
+    'mand': 0x40, 'dirsync': 0x80, 'noatime': 0x400, 'nodiratime': 0x800, 'silent': 0x8000,
+    'relatime': 0x200000, 'strictatime': 0x1000000, 'lazytime': 0x2000000,
+}
+MS_CLEARS = { # mount(8) options that are just the absence of a flag
+    'rw': 'ro', 'suid': 'nosuid', 'dev': 'nodev', 'exec': 'noexec', 'async': 'sync',
+    'atime': 'noatime', 'diratime': 'nodiratime', 'norelatime': 'relatime',
+    'nostrictatime': 'strictatime', 'nolazytime': 'lazytime', 'nomand': 'mand',
+    'loud': 'silent',
+}
+MNT_DETACH = 2
+SYS_OPEN_TREE, SYS_MOVE_MOUNT, SYS_MOUNT_SETATTR = 428, 429, 442 # same on all arches
+AT_FDCWD, AT_EMPTY_PATH = -100, 0x1000
+OPEN_TREE_CLONE = 1
+MOVE_MOUNT_F_EMPTY_PATH = 0x4
+MOUNT_ATTR_IDMAP = 0x100000
+CLONE_NEWUSER = 0x10000000
+ID_LIMIT = 4294967295 # ids are 0..ID_LIMIT-1 (-1 is "no id")
+COMMANDS = ('losetup', 'mount', 'umount', 'idmap') # that run() may handle
+LOOP_BUSY_RETRIES = 8 # of LOOP_CTL_GET_FREE when another process wins the race
+NATIVE_NEVER = ('ntfs',) # fstypes always left to mount(8)
+MOUNT_HELPER_DIRS = ('/sbin', '/usr/sbin', '/sbin/fs.d', '/sbin/fs') # where mount(8) looks
+OWNS_ANY_LIMIT = 10000 # entries owns_any() looks at before giving up
+
+
+class LoopInfo64(ctypes.Structure):
+    """ struct loop_info64 (linux/loop.h) """
+    _fields_ = [('lo_device', ctypes.c_uint64), ('lo_inode', ctypes.c_uint64),
+                ('lo_rdevice', ctypes.c_uint64), ('lo_offset', ctypes.c_uint64),
+                ('lo_sizelimit', ctypes.c_uint64), ('lo_number', ctypes.c_uint32),
+                ('lo_encrypt_type', ctypes.c_uint32), ('lo_encrypt_key_size', ctypes.c_uint32),
+                ('lo_flags', ctypes.c_uint32), ('lo_file_name', ctypes.c_char * LO_NAME_SIZE),
+                ('lo_crypt_name', ctypes.c_char * LO_NAME_SIZE),
+                ('lo_encrypt_key', ctypes.c_ubyte * 32), ('lo_init', ctypes.c_uint64 * 2)]
+
+class LoopConfig(ctypes.Structure):
+    """ struct loop_config (linux/loop.h, 5.8+) """
+    _fields_ = [('fd', ctypes.c_uint32), ('block_size', ctypes.c_uint32),
+                ('info', LoopInfo64), ('reserved', ctypes.c_uint64 * 8)]
+
+class MountAttr(ctypes.Structure):
+    """ struct mount_attr (linux/mount.h, 5.12+) """
+    _fields_ = [('attr_set', ctypes.c_uint64), ('attr_clr', ctypes.c_uint64),
+                ('propagation', ctypes.c_uint64), ('userns_fd', ctypes.c_uint64)]
+
+_libc = None
+enabled = False # set by configure()
+
+def libc():
+    """ The C library (with errno capture) """
+    global _libc # pylint: disable=global-statement
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        _libc.mount.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p,
+                                ctypes.c_ulong, ctypes.c_char_p]
+        _libc.umount2.argtypes = [ctypes.c_char_p, ctypes.c_int]
+        _libc.unshare.argtypes = [ctypes.c_int]
+        _libc.syscall.restype = ctypes.c_long
+    return _libc
+
+def available():
+    """ Can the native backend work here (Linux with loop-control)? """
+    try:
+        return os.path.exists('/dev/loop-control') and bool(libc().mount)
+    except Exception:
+        return False
+
+def configure(wanted=True):
+    """ Enable run() if wanted and possible (as root); returns whether enabled """
+    global enabled # pylint: disable=global-statement
+    enabled = bool(wanted) and os.geteuid() == 0 and available()
+    return enabled
+
+def _check(rv, what):
+    if rv != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, f'{what}: {os.strerror(err)}')
+
+def mount(source, target, fstype, flags=0, data=''):
+    """ mount(2); raises OSError """
+    _check(libc().mount(source.encode(), target.encode(), fstype.encode(), flags,
+                        data.encode() if data else None), f'mount {source} {target}')
+
+def umount(target, flags=0):
+    """ umount2(2); raises OSError """
+    _check(libc().umount2(target.encode(), flags), f'umount {target}')
+
+def parse_mount_options(options):
+    """ Split mount(8) -o options into (mount(2) flags, data string) """
+    flags, data = 0, []
+    for option in [opt.strip() for opt in options.split(',') if opt.strip()]:
+        if option in MS_FLAGS:
+            flags |= MS_FLAGS[option]
+        elif option in MS_CLEARS:
+            flags &= ~MS_FLAGS[MS_CLEARS[option]]
+        elif option == 'defaults':
+            pass
+        else:
+            data.append(option)
+    return flags, ','.join(data)
+
+def detect_fstype(source):
+    """ The filesystem type of a device (from its superblock) or '' """
+    try:
+        fd = os.open(source, os.O_RDONLY | os.O_CLOEXEC)
+    except OSError:
+        return ''
+    try:
+        fstype = probe_header(os.pread(fd, 4096, 0))[0]
+        if not fstype:
+            fstype = probe_btrfs(os.pread(fd, 4096, 65536))[0]
+        return fstype if fstype not in ('crypto_LUKS', 'swap', 'LVM2_member') else ''
+    except OSError:
+        return ''
+    finally:
+        os.close(fd)
+
+def kernel_fstypes():
+    """ The (block device) filesystem types the kernel has now, per /proc/filesystems """
+    try:
+        with open('/proc/filesystems', 'r', encoding='utf-8') as f:
+            return {line.split()[0] for line in f if line.strip() and not line.startswith('nodev')}
+    except OSError:
+        return set()
+
+def mounts_natively(fstype):
+    """ Can fstype be mounted with mount(2) as mount(8) would? Not if the
+        kernel lacks it (now) or mount(8) would run a helper (e.g.,
+        mount.ntfs-3g, or mount.exfat-fuse without the kernel driver); nor
+        ntfs (which ntfs3 kernels refuse or, since 6.9, mount read-only). """
+    if fstype in NATIVE_NEVER or fstype not in kernel_fstypes():
+        return False
+    return not any(os.path.exists(os.path.join(folder, f'mount.{fstype}'))
+                   for folder in MOUNT_HELPER_DIRS)
+
+def idmap_supported():
+    """ Can the kernel do idmapped mounts (i.e., has it mount_setattr)?
+        (a bad call fails with EBADF/EINVAL where it has, ENOSYS where not) """
+    try:
+        rv = libc().syscall(ctypes.c_long(SYS_MOUNT_SETATTR), ctypes.c_int(-1), b'',
+                            ctypes.c_uint(0), None, ctypes.c_size_t(0))
+        return rv == 0 or ctypes.get_errno() != errno.ENOSYS
+    except Exception:
+        return False
+
+def shift_map(on_disk, shown):
+    """ An id map (as (inside, outside, count) ranges; for an idmapped
+        mount, inside is the id on disk and outside the id shown) showing
+        on_disk as shown and leaving all other ids as they are (but for
+        shown on disk, which is left unmapped: its files would show as the
+        overflow id, so see owns_any() first) """
+    if on_disk == shown:
+        return [(0, 0, ID_LIMIT)]
+    low, high = min(on_disk, shown), max(on_disk, shown)
+    ranges = [(0, 0, low), (low + 1, low + 1, high - low - 1),
+              (high + 1, high + 1, ID_LIMIT - high - 1), (on_disk, shown, 1)]
+    return [rng for rng in ranges if rng[2] > 0]
+
+def owns_any(top, uid=None, gid=None, limit=OWNS_ANY_LIMIT, stop=None):
+    """ Is anything in the filesystem mounted at top owned by uid or in
+        group gid (None: not checked)? Looks breadth first (not crossing
+        into other mounts) at no more than limit entries; None if it saw
+        none of them but not everything. If stop() becomes true,
+        raises OSError (ECANCELED).
+    """
+    if uid is None and gid is None:
+        return False
+    dev, seen = os.lstat(top).st_dev, 0
+    folders = collections.deque([top])
+    while folders:
+        if stop and stop():
+            raise OSError(errno.ECANCELED, f'{top}: stopped')
+        try:
+            with os.scandir(folders.popleft()) as listing:
+                entries = list(itertools.islice(listing, limit - seen + 1))
+        except OSError:
+            continue # gone meanwhile
+        for entry in entries:
+            seen += 1
+            if seen > limit:
+                return None
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if st.st_uid == uid or st.st_gid == gid:
+                return True
+            if stat.S_ISDIR(st.st_mode) and st.st_dev == dev:
+                folders.append(entry.path)
+    return False
+
+def make_userns(uid_map, gid_map):
+    """ A user namespace with the given id maps (for MOUNT_ATTR_IDMAP);
+        returns an fd for it (to close). Raises OSError. A child made
+        just to own the namespace is gone on return.
+    """
+    ready_r, ready_w = os.pipe()
+    done_r, done_w = os.pipe()
+    pid = os.fork()
+    if pid == 0: # the child: into a new user namespace, then wait to exit
+        try:
+            os.close(ready_r)
+            os.close(done_w)
+            ok = libc().unshare(CLONE_NEWUSER) == 0
+            os.write(ready_w, b'1' if ok else b'0')
+            os.read(done_r, 1)
+        finally:
+            os._exit(0) # pylint: disable=protected-access
+    os.close(ready_w)
+    os.close(done_r)
+    try:
+        if os.read(ready_r, 1) != b'1':
+            raise OSError(errno.EPERM, 'cannot make a user namespace')
+        for name, ranges in (('uid_map', uid_map), ('gid_map', gid_map)):
+            with open(f'/proc/{pid}/{name}', 'w', encoding='utf-8') as f:
+                f.write(''.join(f'{inside} {outside} {count}\n'
+                                for inside, outside, count in ranges))
+        return os.open(f'/proc/{pid}/ns/user', os.O_RDONLY | os.O_CLOEXEC)
+    finally:
+        os.close(ready_r)
+        os.close(done_w) # lets the child exit
+        os.waitpid(pid, 0)
+
+def _syscall_fd(rv, what):
+    if rv < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, f'{what}: {os.strerror(err)}')
+    return rv
+
+def bind_mount(source, target, userns_fd=None):
+    """ Bind source onto target (a detached clone moved into place), idmapped
+        per the user namespace userns_fd if given; raises OSError """
+    lib = libc()
+    tree_fd = _syscall_fd(lib.syscall(ctypes.c_long(SYS_OPEN_TREE), ctypes.c_int(AT_FDCWD),
+                source.encode(), ctypes.c_uint(OPEN_TREE_CLONE | os.O_CLOEXEC)),
+                f'open_tree {source}')
+    try:
+        if userns_fd is not None:
+            attr = MountAttr(attr_set=MOUNT_ATTR_IDMAP, userns_fd=userns_fd)
+            _syscall_fd(lib.syscall(ctypes.c_long(SYS_MOUNT_SETATTR), ctypes.c_int(tree_fd),
+                    b'', ctypes.c_uint(AT_EMPTY_PATH), ctypes.byref(attr),
+                    ctypes.c_size_t(ctypes.sizeof(attr))), f'mount_setattr {source}')
+        _syscall_fd(lib.syscall(ctypes.c_long(SYS_MOVE_MOUNT), ctypes.c_int(tree_fd), b'',
+                ctypes.c_int(AT_FDCWD), target.encode(),
+                ctypes.c_uint(MOVE_MOUNT_F_EMPTY_PATH)), f'move_mount {target}')
+    finally:
+        os.close(tree_fd)
+
+def idmap_mount(target, uid, gid, stop=None):
+    """ Overmount the filesystem mounted at target so that it is owned by
+        uid:gid: a plain bind if it is already; else an idmapped bind
+        showing its owner (e.g., root as mkfs left it, or the uid of its
+        owner on another machine) as uid:gid, with nothing on disk changed.
+        No mapping can show both its owner and uid:gid as the user, so if
+        anything in it may be uid's or gid's already (see owns_any()),
+        raises OSError (ENOTSUP) for bindfs to be used instead; if stop()
+        becomes true, OSError (ECANCELED) before anything is mounted.
+        Returns what was done ('bind' or 'idmap'); raises OSError.
+    """
+    st = os.stat(target)
+    owner_uid, owner_gid = st.st_uid, st.st_gid
+    if (owner_uid, owner_gid) == (uid, gid):
+        bind_mount(target, target)
+        return 'bind'
+    if owns_any(target, uid if owner_uid != uid else None,
+                gid if owner_gid != gid else None, stop=stop) is not False:
+        raise OSError(errno.ENOTSUP, f'{target}: a mapping could hide files'
+                      f' owned by {uid}:{gid}')
+    if stop and stop():
+        raise OSError(errno.ECANCELED, f'{target}: stopped')
+    userns_fd = make_userns(shift_map(owner_uid, uid), shift_map(owner_gid, gid))
+    try:
+        bind_mount(target, target, userns_fd)
+    finally:
+        os.close(userns_fd)
+    return 'idmap'
+
+def loop_attach(path, readonly=False, flags=0, block_size=0):
+    """ Attach path to a free loop device; returns its path (e.g.,
+        '/dev/loop3'). Raises OSError. flags are extra LO_FLAGS_* and
+        block_size its logical block size (0: the default, 512); should
+        the backing file refuse direct I/O or the block size, it is
+        attached without them.
+    """
+    flags |= LO_FLAGS_READ_ONLY if readonly else 0
+    file_fd = os.open(path, (os.O_RDONLY if readonly else os.O_RDWR) | os.O_CLOEXEC)
+    try:
+        ctl_fd = os.open('/dev/loop-control', os.O_RDWR | os.O_CLOEXEC)
+        try:
+            for _ in range(LOOP_BUSY_RETRIES):
+                number = fcntl.ioctl(ctl_fd, LOOP_CTL_GET_FREE)
+                device = f'/dev/loop{number}'
+                loop_fd = os.open(device, (os.O_RDONLY if readonly else os.O_RDWR)
+                                  | os.O_CLOEXEC)
+                try:
+                    _configure(loop_fd, file_fd, path, flags, block_size)
+                    return device
+                except OSError as e:
+                    if e.errno != errno.EBUSY:
+                        raise # else another process took it first; try again
+                finally:
+                    os.close(loop_fd)
+            raise OSError(errno.EBUSY, f'no free loop device after {LOOP_BUSY_RETRIES} tries')
+        finally:
+            os.close(ctl_fd)
+    finally:
+        os.close(file_fd)
+
+def _configure(loop_fd, file_fd, path, flags, block_size):
+    name = os.path.abspath(path).encode()[:LO_NAME_SIZE - 1]
+    config = LoopConfig(fd=file_fd, block_size=block_size,
+                        info=LoopInfo64(lo_flags=flags, lo_file_name=name))
+    extras = flags & LO_FLAGS_DIRECT_IO or block_size
+    try:
+        fcntl.ioctl(loop_fd, LOOP_CONFIGURE, config)
+        return
+    except OSError as e:
+        if e.errno not in (errno.EINVAL, errno.ENOTTY): # i.e., not a pre-5.8 kernel
+            raise
+        if e.errno == errno.EINVAL and extras: # maybe refused by the backing file
+            config = LoopConfig(fd=file_fd, block_size=0, info=LoopInfo64(
+                        lo_flags=flags & ~LO_FLAGS_DIRECT_IO, lo_file_name=name))
+            try:
+                fcntl.ioctl(loop_fd, LOOP_CONFIGURE, config)
+                return
+            except OSError as e2:
+                if e2.errno not in (errno.EINVAL, errno.ENOTTY):
+                    raise
+    info = LoopInfo64(lo_flags=flags & ~LO_FLAGS_DIRECT_IO, lo_file_name=name)
+    fcntl.ioctl(loop_fd, LOOP_SET_FD, file_fd)
+    try:
+        fcntl.ioctl(loop_fd, LOOP_SET_STATUS64, info)
+    except OSError:
+        fcntl.ioctl(loop_fd, LOOP_CLR_FD, 0)
+        raise
+    for request, value in ((LOOP_SET_BLOCK_SIZE, block_size),
+                           (LOOP_SET_DIRECT_IO, 1 if flags & LO_FLAGS_DIRECT_IO else 0)):
+        if value:
+            try:
+                fcntl.ioctl(loop_fd, request, value)
+            except OSError:
+                pass # best effort (as losetup does)
+
+def loop_detach(device):
+    """ Detach a loop device; raises OSError """
+    fd = os.open(device, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        fcntl.ioctl(fd, LOOP_CLR_FD, 0)
+    finally:
+        os.close(fd)
+
+def _losetup(opts):
+    """ "losetup -d DEV" or "losetup -f --show [-r] [--direct-io=on]
+        [--sector-size N] FILE" (any order) else None """
+    if opts[:1] == ['-d'] and len(opts) == 2:
+        loop_detach(opts[1])
+        return 0, '', ''
+    seen, files, flags, block_size = set(), [], 0, 0
+    opts = list(opts)
+    while opts:
+        opt = opts.pop(0)
+        if opt in ('-f', '--show', '-r'):
+            seen.add(opt)
+        elif opt == '--direct-io=on':
+            flags |= LO_FLAGS_DIRECT_IO
+        elif opt in ('-b', '--sector-size') and opts and opts[0].isdigit():
+            block_size = int(opts.pop(0))
+        elif opt.startswith('-'):
+            return None
+        else:
+            files.append(opt)
+    if not {'-f', '--show'} <= seen or len(files) != 1:
+        return None
+    device = loop_attach(files[0], readonly='-r' in seen, flags=flags, block_size=block_size)
+    return 0, device + '\n', ''
+
+def run(args, stop=None):
+    """ Do the command natively if it is one we handle; returns
+        (returncode, stdout, stderr) or None to run the command instead.
+        stop() (if given) says to give up (e.g., cancelled or timed out)
+        where a command can take long (idmap).
+    """
+    # pylint: disable=too-many-return-statements,too-many-branches
+    if not enabled or not args or args[0] not in COMMANDS:
+        return None
+    try:
+        if args[0] == 'losetup':
+            return _losetup(args[1:])
+        if args[0] == 'mount':
+            opts, options = args[1:], ''
+            if opts[:1] == ['-o'] and len(opts) >= 2:
+                options, opts = opts[1], opts[2:]
+            if len(opts) != 2 or opts[0].startswith('-'):
+                return None
+            fstype = detect_fstype(opts[0])
+            if not fstype or not mounts_natively(fstype):
+                return None # let mount(8) figure it out
+            flags, data = parse_mount_options(options)
+            try:
+                mount(opts[0], opts[1], fstype, flags, data)
+            except OSError as e:
+                if e.errno in (errno.ENODEV, errno.EINVAL):
+                    return None # e.g., an option mount(8) knows better; let it try
+                raise
+            return 0, '', ''
+        if args[0] == 'idmap': # ours: idmap UID:GID TARGET (see idmap_mount())
+            ids = args[1].split(':') if len(args) == 3 else []
+            if len(ids) != 2 or not all(part.isdigit() for part in ids):
+                return None
+            uid, gid = int(ids[0]), int(ids[1])
+            return 0, idmap_mount(args[2], uid, gid, stop=stop) + '\n', ''
+        if args[0] == 'umount':
+            if len(args) == 2 and not args[1].startswith('-'):
+                umount(args[1])
+                return 0, '', ''
+            if len(args) == 3 and args[1] == '-l':
+                umount(args[2], MNT_DETACH)
+                return 0, '', ''
+            return None
+    except OSError as e:
+        reason = os.strerror(e.errno) if e.errno else str(e)
+        return 32, '', f'{args[0]}: {args[-1]}: {reason}'
+    return None
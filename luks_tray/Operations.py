@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runs mount/unlock/unmount operations on a QThreadPool so that slow
+steps (e.g., a LUKS2 Argon2 unlock taking seconds) do not freeze the
+tray and its dialogs.
+
+An operation is work(op) run on a worker thread; it reports progress
+via op.progress(index, count, name) and should check op.cancel (a
+Pipeline.CancelToken) between steps. Its result (e.g., an error string
+or None) is delivered to on_done(result) on the GUI thread, as is each
+progress report to on_progress(index, count, name).
+
+Operations are keyed (by container UUID or crypt file path); a key
+with an operation in flight is "busy" so that refreshes and menu clicks
+leave that container alone until it is done.
+"""
+# pylint: disable=invalid-name,broad-exception-caught,too-few-public-methods
+
+import os
+import time
+import traceback
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, Qt, pyqtSignal, pyqtSlot
+from luks_tray.Pipeline import CancelToken
+from luks_tray.Stats import timings
+from luks_tray.Utils import prt
+
+# assumed for a LUKS header we cannot read (e.g., a device needing root):
+# cryptsetup's Argon2 defaults (1 GiB, 4 threads)
+DEFAULT_KDF_MEMORY_KIB, DEFAULT_KDF_THREADS = 1024 * 1024, 4
+MEMORY_USE_PCT = 75 # of MemAvailable that concurrent unlocks may take
+
+def available_memory_kib():
+    """ MemAvailable from /proc/meminfo (0 if unknown) """
+    try:
+        with open('/proc/meminfo', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+def unlock_pool_size(headers, cores=None, memory_kib=None):
+    """ How many unlocks to run at once given their parsed LUKS headers
+        (None if unknown): as many as the cores allow (an Argon2 unlock
+        uses its keyslot's "cpus" threads) and the available memory
+        allows (each uses its keyslot's "memory"), but at least one.
+    """
+    if not headers:
+        return 1
+    cores = cores if cores else (os.cpu_count() or 1)
+    memory_kib = memory_kib if memory_kib is not None else available_memory_kib()
+    kdf_memory, kdf_threads = 0, 1
+    for info in headers:
+        pbkdf = info.pbkdf if info else None
+        if pbkdf is None:
+            kdf_memory = max(kdf_memory, DEFAULT_KDF_MEMORY_KIB)
+            kdf_threads = max(kdf_threads, DEFAULT_KDF_THREADS)
+        elif pbkdf.kdf.startswith('argon2'):
+            kdf_memory = max(kdf_memory, pbkdf.memory)
+            kdf_threads = max(kdf_threads, pbkdf.cpus or 1)
+    size = min(len(headers), max(1, cores // kdf_threads))
+    if kdf_memory and memory_kib:
+        size = min(size, max(1, memory_kib * MEMORY_USE_PCT // 100 // kdf_memory))
+    return size
+
+
+class OperationSignals(QObject):
+    """ Signals from a worker (delivered on the GUI thread) """
+    progress = pyqtSignal(object, int, int, str) # key, index, count, name
+    finished = pyqtSignal(object, object) # key, result
+
+
+class Poster(QObject):
+    """ Calls functions on the GUI thread for other threads """
+    posted = pyqtSignal(object, object) # func, args
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.posted.connect(self.deliver, Qt.ConnectionType.QueuedConnection)
+
+    def post(self, func, *args):
+        """ (any thread) have func(*args) called on the GUI thread """
+        self.posted.emit(func, args)
+
+    @pyqtSlot(object, object)
+    def deliver(self, func, args):
+        """ (GUI thread) the call posted """
+        func(*args)
+
+
+class Operation(QRunnable):
+    """ One keyed operation run on the pool """
+    def __init__(self, key, label, work, signals):
+        super().__init__()
+        self.setAutoDelete(False) # the runner drops it when finished
+        self.key, self.label, self.work = key, label, work
+        self.signals = signals
+        self.cancel = CancelToken()
+        self.started = time.perf_counter() # reset when it leaves the queue
+
+    def progress(self, index, count, name):
+        """ Report that step index (of count) named name is starting """
+        self.signals.progress.emit(self.key, index, count, name)
+
+    def run(self):
+        """ Worker thread entry """
+        self.started = time.perf_counter()
+        try:
+            result = self.work(self)
+        except Exception as e:
+            prt(f'operation {self.label}: {type(e).__name__}: {e}\n{traceback.format_exc()}')
+            result = f'An error occurred: {e}'
+        self.signals.finished.emit(self.key, result)
+
+
+class OperationRunner(QObject):
+    """ Starts operations on a thread pool and tracks the busy keys """
+    def __init__(self, scheduler, max_threads=4, parent=None):
+        super().__init__(parent)
+        self.scheduler = scheduler
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.signals = OperationSignals(self)
+        queued = Qt.ConnectionType.QueuedConnection
+        self.signals.progress.connect(self.on_progress, queued)
+        self.signals.finished.connect(self.on_finished, queued)
+        self.operations = {} # key => (Operation, on_progress, on_done)
+        self.pools = [self.pool] # and those given to start()
+        self.on_change = None # called (on the GUI thread) when the busy keys change
+
+    def start(self, key, label, work, on_progress=None, on_done=None, pool=None):
+        """ Run work(op) on the pool (or the given QThreadPool, e.g., one
+            sized for a batch); returns the Operation, or None if key
+            already has an operation in flight """
+        if key in self.operations:
+            return None
+        op = Operation(key, label, work, self.signals)
+        self.operations[key] = (op, on_progress, on_done)
+        self.scheduler.begin_operation()
+        pool = pool if pool else self.pool
+        if pool not in self.pools:
+            self.pools.append(pool)
+        pool.start(op)
+        if self.on_change:
+            self.on_change()
+        return op
+
+    def is_busy(self, key):
+        """ Has key an operation in flight? """
+        return key in self.operations
+
+    def busy_keys(self):
+        """ The keys with operations in flight """
+        return frozenset(self.operations)
+
+    def cancel(self, key):
+        """ Ask key's operation (if any) to stop before its next step """
+        entry = self.operations.get(key, None)
+        if entry:
+            entry[0].cancel.cancel()
+        return entry is not None
+
+    def wait(self, msecs=-1):
+        """ Wait for the operations in flight (e.g., at exit) """
+        return all([pool.waitForDone(msecs) for pool in self.pools])
+
+    @pyqtSlot(object, int, int, str)
+    def on_progress(self, key, index, count, name):
+        """ (GUI thread) a step is starting """
+        entry = self.operations.get(key, None)
+        if entry and entry[1]:
+            entry[1](index, count, name)
+
+    @pyqtSlot(object, object)
+    def on_finished(self, key, result):
+        """ (GUI thread) an operation is done """
+        op, _, on_done = self.operations.pop(key, (None, None, None))
+        if op is None:
+            return
+        ms = (time.perf_counter() - op.started) * 1000
+        timings.add(f'op {op.label}', ms)
+        prt(f'operation {op.label}: {"ok" if not result else "FAILED"} in {ms:.0f}ms')
+        self.scheduler.end_operation()
+        if not self.operations:
+            self.pools = [self.pool]
+        if on_done:
+            on_done(result)
+        if self.on_change:
+            self.on_change()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Transactional command pipelines: a list of steps, each with an optional
+undo, run in order; if a step fails, the completed steps are undone in
+reverse order (so a failed mount does not leave a loop device attached
+or a mapper open). The same code runs in the tray (a command at a time)
+or in the root helper (the whole pipeline in one request).
+
+A step is a JSON-ready dict:
+  - name: for the timings/logs (default: the command, e.g. "cryptsetup open")
+  - args: the command
+  - input: stdin for the command (e.g., a password), optional
+  - undo: the command that reverses it, optional
+  - capture: a name for the (stripped) stdout, optional; later steps'
+    args may then refer to it as {name} (e.g., "{loop}" after
+    "losetup -f --show")
+  - fallback: a step to run instead if this one fails, optional (e.g.,
+    bindfs where the kernel cannot do idmapped mounts); if it succeeds,
+    the pipeline goes on (and its undo is the one used on rollback)
+
+A pipeline can report each step as it starts and be cancelled between
+steps (a cancelled pipeline is rolled back like a failed one).
+"""
+# pylint: disable=invalid-name,broad-exception-caught
+
+import time
+import threading
+
+CANCELLED = 'CANCELLED'
+TIMEOUTS_MS = { # by command (or "cryptsetup <subcommand>"); the longest a run may take
+    'cryptsetup open': 120000, # a costly Argon2 keyslot on a slow CPU
+    'cryptsetup luksFormat': 120000,
+    'cryptsetup benchmark': 60000, # per cipher
+    'mkfs.ext4': 600000,
+    'mount': 60000,
+    'idmap': 60000, # ours (see Native.idmap_mount()); its look for the user's files is bounded
+    'umount': 30000,
+    'fuser': 15000,
+    'losetup': 15000,
+}
+DEFAULT_TIMEOUT_MS = 30000
+
+def timeout_for(args):
+    """ The timeout (in ms) for running the command args """
+    if not args:
+        return DEFAULT_TIMEOUT_MS
+    name = f'{args[0]} {args[1]}' if len(args) > 1 and args[0] == 'cryptsetup' else args[0]
+    return TIMEOUTS_MS.get(name, TIMEOUTS_MS.get(args[0], DEFAULT_TIMEOUT_MS))
+
+def make_step(args, undo=None, input_str=None, capture=None, name=None, fallback=None):
+    """ Make a pipeline step """
+    step = {'args': list(args)}
+    if fallback:
+        step['fallback'] = fallback
+    if name:
+        step['name'] = name
+    if undo:
+        step['undo'] = list(undo)
+    if input_str is not None:
+        step['input'] = input_str
+    if capture:
+        step['capture'] = capture
+    return step
+
+def step_name(step):
+    """ The name of a step for timings and logs """
+    if step.get('name', None):
+        return step['name']
+    args = step.get('args', [])
+    if len(args) > 1 and args[0] in ('cryptsetup',):
+        return f'{args[0]} {args[1]}'
+    return args[0] if args else '?'
+
+def substitute(args, captures):
+    """ Replace {name} in args with the captured values (only for
+        captured names, so braces in paths are left alone) """
+    rv = []
+    for arg in args:
+        for name, value in captures.items():
+            arg = arg.replace('{' + name + '}', value)
+        rv.append(arg)
+    return rv
+
+class CancelToken:
+    """ Set (once) from one thread, checked by another; callbacks added
+        with on_cancel() run upon cancel() (or at once if already set) """
+    def __init__(self):
+        self.event = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        """ Request cancellation """
+        with self.lock:
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def is_set(self):
+        """ Was cancellation requested? """
+        return self.event.is_set()
+
+    def on_cancel(self, callback):
+        """ Have callback() called upon cancellation """
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+def execute(steps, run, progress=None, cancelled=None):
+    """ Run the steps with run(args, input_str) => (returncode, stdout, stderr).
+        progress(index, count, name) is called as each step starts and
+        cancelled() is checked before each step.
+        Returns a JSON-ready result dict:
+          - err: None on success, else the error of the failed step
+                 (plus any failures undoing the others)
+          - captures: {name: value} of the capture steps that ran
+          - steps: [[name, ms, returncode], ...] of the steps that ran
+          - undone: [[name, returncode], ...] of the rollback, if any
+    """
+    captures, done, ran, undone, err = {}, [], [], [], None
+    for index, step in enumerate(steps):
+        if cancelled and cancelled():
+            err = f'{CANCELLED}: before {step_name(step)}'
+            break
+        if progress:
+            progress(index, len(steps), step_name(step))
+        while True:
+            args = substitute(step['args'], captures)
+            start = time.perf_counter()
+            try:
+                returncode, stdout, stderr = run(args, step.get('input', None))
+            except Exception as e:
+                returncode, stdout, stderr = 127, '', f'{type(e).__name__}: {e}'
+            ran.append([step_name(step), (time.perf_counter() - start) * 1000, returncode])
+            if returncode == 0 or not step.get('fallback', None):
+                break
+            step = step['fallback']
+        if returncode != 0:
+            err = f'FAIL: {" ".join(args)}: {stdout} {stderr} [rc={returncode}]'
+            break
+        if step.get('capture', None):
+            captures[step['capture']] = stdout.strip()
+        done.append(step)
+
+    if err:
+        for step in reversed(done):
+            if not step.get('undo', None):
+                continue
+            args = substitute(step['undo'], captures)
+            try:
+                returncode, stdout, stderr = run(args, None)
+            except Exception as e:
+                returncode, stdout, stderr = 127, '', f'{type(e).__name__}: {e}'
+            undone.append([' '.join(args), returncode])
+            if returncode != 0:
+                err += f'\nALSO FAILED UNDOING: {" ".join(args)}: {stderr.strip()} [rc={returncode}]'
+    return {'err': err, 'captures': captures, 'steps': ran, 'undone': undone}
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact __slots__ records for containers, their filesystems, and the
+history's vitals. They are created for every device on every scan, so
+they avoid a per-instance __dict__, and they compare by their "state"
+fields so successive snapshots can be diffed record by record. Being
+mutable, they are not hashable (use state() as a key).
+"""
+# pylint: disable=invalid-name,too-many-instance-attributes
+
+class Record:
+    """ Base for the records. Subclasses define:
+        - __slots__: all fields
+        - __init__(**fields): sets every field to its default, then
+          calls self._set(fields)
+        - state_fields: the fields that define equality
+        - json_fields: the fields that to_json()/from_json() carry
+    """
+    __slots__ = ()
+    state_fields = ()
+    json_fields = ()
+
+    def _set(self, fields):
+        """ Set the given fields (AttributeError for unknown ones) """
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+    @staticmethod
+    def _frozen(value):
+        if isinstance(value, list):
+            return tuple(Record._frozen(item) for item in value)
+        if isinstance(value, Record):
+            return value.state()
+        return value
+
+    def state(self):
+        """ The hashable tuple of the state_fields """
+        return tuple(self._frozen(getattr(self, field)) for field in self.state_fields)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.state() == other.state()
+
+    __hash__ = None # equality follows mutable state
+
+    def as_dict(self):
+        """ All fields as a dict (e.g., for debug dumps) """
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def to_json(self):
+        """ The json_fields as a JSON-serializable dict """
+        rv = {}
+        for field in self.json_fields:
+            value = getattr(self, field)
+            if isinstance(value, list):
+                value = [item.to_json() if isinstance(item, Record) else item
+                         for item in value]
+            rv[field] = value
+        return rv
+
+    @classmethod
+    def from_json(cls, data, **overrides):
+        """ Make a record from to_json() output, ignoring unknown keys
+            and using defaults for missing ones.
+        """
+        record = cls()
+        for field in cls.json_fields:
+            if field in data:
+                setattr(record, field, data[field])
+        for field, value in overrides.items():
+            setattr(record, field, value)
+        return record
+
+    def __repr__(self):
+        fields = ', '.join(f'{field}={getattr(self, field)!r}'
+                           for field in self.__slots__ if field not in ('parent', 'vital'))
+        return f'{type(self).__name__}({fields})'
+
+
+class FilesystemRecord(Record):
+    """ A filesystem (or other child) within an opened container """
+    __slots__ = ('name', 'type', 'fstype', 'label', 'size_str', 'uuid',
+                 'mounts', 'readonly', 'back_file', 'parent')
+    state_fields = ('name', 'mounts')
+    json_fields = ('name', 'type', 'fstype', 'label', 'size_str', 'uuid',
+                   'mounts', 'readonly')
+
+    def __init__(self, **fields):
+        self.name = ''
+        self.type = ''
+        self.fstype = ''
+        self.label = ''
+        self.size_str = ''
+        self.uuid = ''
+        self.mounts = []
+        self.readonly = False
+        self.back_file = ''
+        self.parent = None
+        self._set(fields)
+
+
+class ContainerRecord(Record):
+    """ A LUKS container (device or file), or a disk holding some """
+    __slots__ = ('name', 'opened', 'upon', 'uuid', 'size_str', 'type', 'fstype',
+                 'label', 'mounts', 'parent', 'filesystems', 'back_file', 'vital',
+                 'readonly')
+    state_fields = ('name', 'opened', 'upon', 'readonly', 'mounts',
+                    'back_file', 'size_str', 'label', 'filesystems')
+    json_fields = ('name', 'opened', 'upon', 'uuid', 'size_str', 'type', 'fstype',
+                   'label', 'mounts', 'filesystems', 'back_file', 'readonly')
+
+    def __init__(self, **fields):
+        self.name = ''          # /proc/partitions
+        self.opened = None      # or True or False
+        self.upon = ''          # primary mount point
+        self.uuid = ''
+        self.size_str = ''      # /sys/block/{name}/... (e.g., 3.5T)
+        self.type = ''          # e.g., loop, crypt, disk, part
+        self.fstype = ''        # fstype OR /sys/class/block/{name}/device/model
+        self.label = ''         # blkid
+        self.mounts = []        # /proc/mounts
+        self.parent = None      # a partition
+        self.filesystems = []   # child file systems
+        self.back_file = ''     # backing file
+        self.vital = None       # history if any
+        self.readonly = False   # whether readonly
+        self._set(fields)
+
+    @classmethod
+    def from_json(cls, data, **overrides):
+        record = super().from_json(data, **overrides)
+        record.filesystems = [FilesystemRecord.from_json(fs, parent=record.name)
+                              for fs in record.filesystems]
+        return record
+
+
+class VitalRecord(Record):
+    """ What the history remembers about a container """
+    __slots__ = ('uuid', 'password', 'upon', 'back_file', 'when', 'mount_opts', 'fstype',
+                 'crypt_flags')
+    state_fields = ('uuid', 'password', 'upon', 'back_file', 'mount_opts', 'fstype',
+                    'crypt_flags')
+    json_fields = ('uuid', 'password', 'upon', 'back_file', 'when', 'mount_opts', 'fstype',
+                   'crypt_flags')
+
+    def __init__(self, **fields):
+        self.uuid = ''          # can be full path
+        self.password = ''
+        self.upon = ''          # "primary" mount only
+        self.back_file = ''     # backing file if any
+        self.when = 0           # last update
+        self.mount_opts = ''    # e.g., noatime,commit=60 ('': the [mount] options)
+        self.fstype = ''        # of its filesystem when last opened
+        self.crypt_flags = ''   # dm-crypt flags, e.g., no_read_workqueue,allow_discards
+        self._set(fields)
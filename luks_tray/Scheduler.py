@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive refresh timing: fast while something is happening, backing
+off exponentially while nothing is.
+"""
+# pylint: disable=invalid-name,too-many-instance-attributes
+# pylint: disable=no-name-in-module
+
+import time
+from PyQt6.QtCore import QTimer, Qt
+from luks_tray.Utils import prt
+
+class RefreshScheduler:
+    """ Owns the refresh timer. The refresh callback returns True if it
+        found a change. The interval is:
+          - fast_ms while operations are in flight (begin_operation() ..
+            end_operation()) or within fast_window_ms of hurry() (e.g.,
+            after a hotplug uevent);
+          - otherwise, idle_min_ms after a change, growing by backoff_pct
+            per quiet refresh up to idle_max_ms.
+        Long intervals use a very coarse timer so the kernel can coalesce
+        the wakeups with others.
+    """
+    coarse_threshold_ms = 2000 # VeryCoarseTimer has 1s granularity
+
+    def __init__(self, parent, refresh):
+        self.refresh = refresh
+        self.timer = QTimer(parent)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.tick)
+        self.fast_ms, self.fast_window_ms = 250, 5000
+        self.idle_min_ms, self.idle_max_ms, self.backoff_pct = 3000, 300000, 200
+        self.interval_ms = self.idle_min_ms # current idle interval
+        self.busy = 0 # operations in flight
+        self.fast_until = 0.0 # monotonic deadline of the fast window
+        self.prev_state = None
+
+    def configure(self, ini_tool, max_ms=None):
+        """ Take the [refresh] settings from config.ini; max_ms, if given,
+            caps idle_max_ms (e.g., when there are no uevents to rely on).
+        """
+        def get(key):
+            return ini_tool.get_current_val(key, 'refresh')
+        self.fast_ms = max(50, get('fast_ms'))
+        self.fast_window_ms = max(0, get('fast_window_ms'))
+        self.idle_min_ms = max(self.fast_ms, get('idle_min_ms'))
+        self.idle_max_ms = max(self.idle_min_ms, get('idle_max_ms'))
+        if max_ms:
+            self.idle_max_ms = max(self.idle_min_ms, min(self.idle_max_ms, max_ms))
+        self.backoff_pct = max(100, get('backoff_pct'))
+        self.interval_ms = min(max(self.interval_ms, self.idle_min_ms), self.idle_max_ms)
+
+    def start(self):
+        """ Start (or restart) the timer """
+        self.arm()
+
+    def stop(self):
+        """ Stop the timer """
+        self.timer.stop()
+
+    def is_fast(self):
+        """ Are we in fast mode? """
+        return self.busy > 0 or time.monotonic() < self.fast_until
+
+    def begin_operation(self):
+        """ A mount/unmount/etc. is starting """
+        self.busy += 1
+        self.arm()
+
+    def end_operation(self):
+        """ A mount/unmount/etc. has finished; stay fast for a bit to catch
+            the aftermath """
+        self.busy = max(0, self.busy - 1)
+        self.hurry()
+
+    def hurry(self):
+        """ Poll fast for the next fast_window_ms (e.g., after a hotplug) """
+        self.fast_until = time.monotonic() + self.fast_window_ms / 1000
+        self.interval_ms = self.idle_min_ms
+        self.arm()
+
+    def note_result(self, changed):
+        """ Adapt the idle interval to whether the last refresh found changes """
+        if changed:
+            self.interval_ms = self.idle_min_ms
+        else:
+            self.interval_ms = min(self.idle_max_ms,
+                                   self.interval_ms * self.backoff_pct // 100)
+
+    def tick(self):
+        """ Timer expired: refresh and re-arm """
+        self.note_result(bool(self.refresh()))
+        self.arm()
+
+    def arm(self):
+        """ (Re)start the timer per the current state """
+        if self.is_fast():
+            mode, ms, timer_type = 'fast', self.fast_ms, Qt.TimerType.PreciseTimer
+        else:
+            mode, ms = 'idle', self.interval_ms
+            timer_type = (Qt.TimerType.VeryCoarseTimer if ms >= self.coarse_threshold_ms
+                          else Qt.TimerType.CoarseTimer)
+        self.timer.setTimerType(timer_type)
+        self.timer.start(ms)
+        state = (mode, ms, self.busy)
+        if state != self.prev_state:
+            self.prev_state = state
+            prt(f'scheduler: {self.describe()}')
+
+    def describe(self):
+        """ One-line summary of the scheduler state (for the debug log) """
+        mode, ms, busy = self.prev_state if self.prev_state else ('stopped', 0, self.busy)
+        fast_left = max(0.0, self.fast_until - time.monotonic())
+        return (f'mode={mode} interval={ms}ms busy={busy} fast_left={fast_left:.1f}s'
+                f' idle=[{self.idle_min_ms}..{self.idle_max_ms}]ms x{self.backoff_pct}%')
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Hot-path timing: rolling per-stage samples with p50/p95/max summaries
+"""
+# pylint: disable=invalid-name
+
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+class StageTimings:
+    """ Keeps the last `window` durations (in ms) of each named stage """
+    def __init__(self, window=1000):
+        self.window = window
+        self.samples = {} # stage => deque of ms
+        self.counts = {} # stage => total count (beyond the window too)
+        self.started = time.time()
+        self.lock = threading.Lock() # stages may be timed off the GUI thread
+
+    def add(self, stage, ms):
+        """ Record one duration """
+        with self.lock:
+            samples = self.samples.get(stage, None)
+            if samples is None:
+                samples = self.samples[stage] = deque(maxlen=self.window)
+                self.counts[stage] = 0
+            samples.append(ms)
+            self.counts[stage] += 1
+
+    @contextmanager
+    def timed(self, stage):
+        """ Time the body of a with statement as `stage` """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, (time.perf_counter() - start) * 1000)
+
+    @staticmethod
+    def percentile(ordered, pct):
+        """ Nearest-rank percentile of a sorted list """
+        if not ordered:
+            return 0.0
+        idx = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+        return ordered[idx]
+
+    def summary(self):
+        """ Returns {stage: {count, window, p50, p95, max}} (ms) """
+        rv = {}
+        with self.lock:
+            snapshot = [(stage, sorted(samples)) for stage, samples in self.samples.items()]
+        for stage, ordered in snapshot:
+            rv[stage] = {'count': self.counts[stage], 'window': len(ordered),
+                         'p50': self.percentile(ordered, 50),
+                         'p95': self.percentile(ordered, 95),
+                         'max': ordered[-1] if ordered else 0.0}
+        return rv
+
+    def report(self):
+        """ The summary as a printable table """
+        hours = (time.time() - self.started) / 3600
+        lines = [f'timings over {hours:.2f}h (ms; percentiles over the last'
+                 f' {self.window} samples):',
+                 f'  {"stage":<28} {"count":>8} {"p50":>9} {"p95":>9} {"max":>9}']
+        for stage, row in sorted(self.summary().items()):
+            lines.append(f'  {stage:<28} {row["count"]:>8} {row["p50"]:>9.3f}'
+                         f' {row["p95"]:>9.3f} {row["max"]:>9.3f}')
+        return '\n'.join(lines)
+
+timings = StageTimings()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-process replacement for "lsblk -J" that reads /sys/class/block,
+the on-disk headers (for LUKS and common filesystems), and the mount
+table directly.  The output has the same shape as lsblk's
+"blockdevices" list so DeviceInfo.parse_lsblk() can consume either.
+"""
+# pylint: disable=invalid-name,broad-exception-caught
+# pylint: disable=too-many-return-statements,too-many-locals
+
+import os
+import json
+import struct
+import subprocess
+import time
+from types import SimpleNamespace
+from luks_tray.MountInfo import read_mountinfo
+from luks_tray.LuksHeader import is_luks, parse_header
+from luks_tray.Utils import prt
+
+LSBLK_COLUMNS = 'NAME,MAJ:MIN,TYPE,RO,FSTYPE,LABEL,PARTLABEL,FSUSE%,SIZE,UUID,MOUNTPOINTS'
+LSBLK_TIMEOUT_S = 5 # it runs on the GUI thread, and a dead device can hang it
+
+def run_lsblk(timeout=LSBLK_TIMEOUT_S):
+    """ Run lsblk and return its "blockdevices" list (None if it fails
+        or takes longer than timeout seconds) """
+    try:
+        result = subprocess.run(['lsblk', '-J', '-o', LSBLK_COLUMNS],
+                    stdout=subprocess.PIPE, text=True, check=False, timeout=timeout)
+        return json.loads(result.stdout)['blockdevices']
+    except (subprocess.TimeoutExpired, OSError, ValueError, KeyError) as exc:
+        prt(f'WARN: lsblk failed: {type(exc).__name__}: {exc}')
+        return None
+
+def human_size(nbytes):
+    """ Format a byte count the way lsblk does (e.g., '512B', '100M', '3.6T') """
+    suffixes = 'BKMGTPE'
+    exp = 0
+    while exp < 60 and nbytes >= (1 << (exp + 10)):
+        exp += 10
+    if not exp:
+        return f'{nbytes}B'
+    dec, frac = nbytes >> exp, nbytes & ((1 << exp) - 1)
+    if frac:
+        frac = (frac * 1000) >> exp # three digits
+        frac = (frac + 50) // 100 # rounded to one
+        if frac == 10:
+            dec, frac = dec + 1, 0
+    suffix = suffixes[exp // 10]
+    return f'{dec}.{frac}{suffix}' if frac else f'{dec}{suffix}'
+
+def _fmt_uuid(raw):
+    """ Format 16 raw bytes as a standard UUID string """
+    hx = raw.hex()
+    return f'{hx[:8]}-{hx[8:12]}-{hx[12:16]}-{hx[16:20]}-{hx[20:32]}'
+
+def _cstr(raw):
+    """ Decode a NUL-padded byte field """
+    return raw.split(b'\0', 1)[0].decode('utf-8', 'replace').strip()
+
+def probe_header(data):
+    """ Identify the contents from the first 4 KiB of a device.
+        Returns (fstype, uuid, label); fstype is '' if unrecognized.
+    """
+    if is_luks(data):
+        info = parse_header(data)
+        return 'crypto_LUKS', info.uuid if info else '', info.label if info else ''
+    if len(data) >= 2048 and data[1080:1082] == b'\x53\xef':
+        sb = data[1024:]
+        compat, incompat = struct.unpack_from('<II', sb, 92)
+        if incompat & 0x2c0: # extents|64bit|flex_bg
+            fstype = 'ext4'
+        elif compat & 0x4: # has_journal
+            fstype = 'ext3'
+        else:
+            fstype = 'ext2'
+        return fstype, _fmt_uuid(sb[104:120]), _cstr(sb[120:136])
+    if data[:4] == b'XFSB':
+        return 'xfs', _fmt_uuid(data[32:48]), _cstr(data[108:120])
+    if data[3:11] == b'EXFAT   ':
+        serial = struct.unpack_from('<I', data, 100)[0]
+        return 'exfat', f'{serial >> 16:04X}-{serial & 0xffff:04X}', ''
+    if data[3:11] == b'NTFS    ':
+        serial = struct.unpack_from('<Q', data, 72)[0]
+        return 'ntfs', f'{serial:016X}', ''
+    for magic_off, serial_off, label_off in ((82, 67, 71), (54, 39, 43)):
+        if data[magic_off:magic_off+3] == b'FAT':
+            serial = struct.unpack_from('<I', data, serial_off)[0]
+            label = _cstr(data[label_off:label_off+11])
+            label = '' if label == 'NO NAME' else label
+            return 'vfat', f'{serial >> 16:04X}-{serial & 0xffff:04X}', label
+    if data[4086:4096] == b'SWAPSPACE2':
+        return 'swap', _fmt_uuid(data[1036:1052]), _cstr(data[1052:1068])
+    if data[536:544] == b'LVM2 001':
+        return 'LVM2_member', '', ''
+    return '', '', ''
+
+def probe_btrfs(data):
+    """ Identify btrfs from the 4 KiB at offset 64 KiB """
+    if data[64:72] == b'_BHRfS_M':
+        return 'btrfs', _fmt_uuid(data[32:48]), _cstr(data[299:555])
+    return '', '', ''
+
+
+class SysfsScanner:
+    """ Builds the lsblk-style device tree from sysfs """
+    def __init__(self, sys_root='/sys', dev_root='/dev', udev_root='/run/udev/data',
+                 cache_probes=False):
+        self.sys_root = sys_root
+        self.dev_root = dev_root
+        self.udev_root = udev_root
+        self.cache_probes = cache_probes # only if uevents say what to forget()
+        self.probed = {} # maj:min => (size, (fstype, uuid, label)) if cache_probes
+
+    def forget(self, majmin=None):
+        """ Drop the cached probe of device majmin (of all if None), e.g.,
+            upon its add/change uevent (or lost uevents) """
+        if majmin is None:
+            self.probed.clear()
+        else:
+            self.probed.pop(majmin, None)
+
+    @staticmethod
+    def _read(path, default=''):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read().strip()
+        except Exception:
+            return default
+
+    def loop_status(self, kname):
+        """ The state of loop device kname (for the details): its backing
+            file, whether it does direct I/O, its logical block size, and
+            whether it detaches on last close; None if not attached """
+        base = os.path.join(self.sys_root, 'class/block', kname)
+        back_file = self._read(f'{base}/loop/backing_file', None)
+        if back_file is None:
+            return None
+        block_size = self._read(f'{base}/queue/logical_block_size', '512')
+        return SimpleNamespace(name=kname, back_file=back_file,
+                    dio=self._read(f'{base}/loop/dio', '0') == '1',
+                    block_size=int(block_size) if block_size.isdigit() else 512,
+                    autoclear=self._read(f'{base}/loop/autoclear', '0') == '1')
+
+    def _udev_props(self, majmin):
+        """ Fallback for when the device node is not readable (i.e., not
+            root nor in the disk group): read the udev database file
+            (which is what lsblk does in that case).
+        """
+        props = {}
+        try:
+            with open(os.path.join(self.udev_root, f'b{majmin}'), 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.startswith('E:'):
+                        key, _, value = line[2:].rstrip('\n').partition('=')
+                        props[key] = value
+        except Exception:
+            pass
+        return props
+
+    @staticmethod
+    def _unhex(value):
+        r""" Undo udev's \xNN encoding """
+        if '\\x' not in value:
+            return value
+        try:
+            return value.encode('latin-1').decode('unicode_escape').encode('latin-1').decode('utf-8')
+        except Exception:
+            return value
+
+    def probe(self, name, majmin, size):
+        """ Returns (fstype, uuid, label) for a device: per the udev
+            database if it knows the type (so no device I/O, which a dead
+            or spun-down drive can stall), else from the device's headers
+            (remembered, if cache_probes, until forget()) """
+        props = self._udev_props(majmin)
+        udev = (props.get('ID_FS_TYPE', ''), props.get('ID_FS_UUID', ''),
+                self._unhex(props.get('ID_FS_LABEL_ENC', '')))
+        if udev[0]:
+            return udev
+        cached = self.probed.get(majmin, None)
+        if cached and cached[0] == size:
+            return cached[1]
+        rv = self._probe_device(name, size)
+        rv = rv if rv is not None else udev
+        if self.cache_probes:
+            self.probed[majmin] = (size, rv)
+        return rv
+
+    def _probe_device(self, name, size):
+        """ (fstype, uuid, label) from the device's headers; None if unreadable """
+        try:
+            fd = os.open(os.path.join(self.dev_root, name), os.O_RDONLY | os.O_CLOEXEC)
+        except OSError:
+            return None
+        try:
+            rv = probe_header(os.pread(fd, 4096, 0))
+            if not rv[0] and size >= 65536 + 4096:
+                rv = probe_btrfs(os.pread(fd, 4096, 65536))
+            return rv
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+
+    def _dev_type(self, base, name):
+        """ Returns lsblk's TYPE for a device """
+        dm_uuid = self._read(f'{base}/dm/uuid', None)
+        if dm_uuid is not None:
+            prefix = dm_uuid.split('-', 1)[0].lower()
+            if prefix == 'crypt':
+                return 'crypt'
+            if prefix.startswith('part'):
+                return 'part'
+            if prefix in ('lvm', 'mpath'):
+                return prefix
+            return 'dm'
+        if os.path.exists(f'{base}/partition'):
+            return 'part'
+        if name.startswith('loop'):
+            return 'loop'
+        level = self._read(f'{base}/md/level', None)
+        if level:
+            return level
+        if name.startswith('sr'):
+            return 'rom'
+        return 'disk'
+
+    def _load(self, kname, mounts):
+        """ Build the lsblk-style dict for one device (sans children) """
+        base = os.path.join(self.sys_root, 'class/block', kname)
+        majmin = self._read(f'{base}/dev')
+        size = int(self._read(f'{base}/size', '0') or 0) * 512
+        if majmin.startswith('1:'):
+            return None # lsblk skips ram disks
+        if not size and (kname.startswith('loop') or self._read(f'{base}/removable') == '1'):
+            return None # ... and unattached loops and empty drives
+        name = self._read(f'{base}/dm/name', '') or kname
+        props = {}
+        for line in self._read(f'{base}/uevent').splitlines():
+            key, _, value = line.partition('=')
+            props[key] = value
+        fstype, uuid, label = self.probe(kname, majmin, size) if size else ('', '', '')
+        return {
+            'name': name,
+            'maj:min': majmin,
+            'type': self._dev_type(base, kname),
+            'ro': self._read(f'{base}/ro', '0') == '1',
+            'fstype': fstype or None,
+            'label': label or None,
+            'partlabel': props.get('PARTNAME', None),
+            'size': human_size(size),
+            'uuid': uuid or None,
+            'mountpoints': mounts.get(majmin, None) or mounts.get(kname, [None]),
+            'back-file': (self._read(f'{base}/loop/backing_file', None)
+                          if kname.startswith('loop') else None),
+        }
+
+    def scan(self, mount_list=None):
+        """ Returns the device tree as lsblk's "blockdevices" list.
+            - mount_list: parsed mountinfo (read afresh if None)
+        """
+        if mount_list is None:
+            mount_list = read_mountinfo()
+        mounts = {} # by maj:min and, for btrfs and the like, by source kname
+        for mnt in mount_list:
+            key = mnt.majmin
+            if key.startswith('0:') and mnt.source.startswith('/dev/'):
+                key = os.path.basename(os.path.realpath(mnt.source))
+            mounts.setdefault(key, []).append(mnt.upon)
+
+        class_dir = os.path.join(self.sys_root, 'class/block')
+        devs = {}
+        for kname in os.listdir(class_dir):
+            dev = self._load(kname, mounts)
+            if dev:
+                devs[kname] = dev
+
+        def children_of(kname):
+            base = os.path.join(class_dir, kname)
+            kids = []
+            try:
+                for sub in os.listdir(base):
+                    if sub.startswith(kname) and sub in devs:
+                        kids.append(sub) # partitions
+            except OSError:
+                pass
+            try:
+                kids += [h for h in os.listdir(f'{base}/holders') if h in devs]
+            except OSError:
+                pass
+            return sorted(set(kids))
+
+        def build(kname, depth=0):
+            dev = dict(devs[kname])
+            kids = children_of(kname) if depth < 16 else []
+            if kids:
+                dev['children'] = [build(kid, depth+1) for kid in kids]
+            return dev
+
+        roots = []
+        for kname in sorted(devs):
+            base = os.path.join(class_dir, kname)
+            if os.path.exists(f'{base}/partition'):
+                continue
+            try:
+                if any(s in devs for s in os.listdir(f'{base}/slaves')):
+                    continue
+            except OSError:
+                pass
+            roots.append(build(kname))
+        return roots
+
+
+def _flatten(devices, parent='', out=None):
+    """ Flatten a device tree into {(parent, name): normalized-fields} """
+    out = {} if out is None else out
+    for dev in devices:
+        mounts = sorted(m for m in (dev.get('mountpoints') or []) if m)
+        out[(parent, dev.get('name', ''))] = (
+            dev.get('type', ''), bool(dev.get('ro', 0)), dev.get('fstype') or '',
+            dev.get('uuid') or '', dev.get('size', ''), tuple(mounts))
+        _flatten(dev.get('children', []), dev.get('name', ''), out)
+    return out
+
+def compare_with_lsblk(devices, lsblk_devices=None):
+    """ Cross-check a scan against lsblk. Returns a list of difference strings. """
+    if lsblk_devices is None:
+        lsblk_devices = run_lsblk()
+    if lsblk_devices is None:
+        return ['lsblk failed or timed out']
+    ours, theirs = _flatten(devices), _flatten(lsblk_devices)
+    diffs = []
+    fields = ('type', 'ro', 'fstype', 'uuid', 'size', 'mounts')
+    for key in sorted(set(ours) | set(theirs)):
+        if key not in ours:
+            diffs.append(f'{key[1]} (under {key[0] or "-"}): only in lsblk')
+        elif key not in theirs:
+            diffs.append(f'{key[1]} (under {key[0] or "-"}): only in sysfs scan')
+        elif ours[key] != theirs[key]:
+            for idx, field in enumerate(fields):
+                if ours[key][idx] != theirs[key][idx]:
+                    diffs.append(f'{key[1]}: {field} sysfs={ours[key][idx]!r}'
+                                 f' lsblk={theirs[key][idx]!r}')
+    return diffs
+
+def bench(count=50):
+    """ Time the sysfs scanner against lsblk; prints and returns the
+        milliseconds per scan for each.
+    """
+    scanner = SysfsScanner()
+    results = {}
+    for label, func in (('lsblk', run_lsblk), ('sysfs', scanner.scan)):
+        func() # warm up
+        start = time.perf_counter()
+        for _ in range(count):
+            func()
+        results[label] = (time.perf_counter() - start) * 1000 / count
+    speedup = results['lsblk'] / results['sysfs'] if results['sysfs'] else 0
+    print(f'scan x{count}: lsblk={results["lsblk"]:.2f}ms'
+          f' sysfs={results["sysfs"]:.2f}ms speedup={speedup:.1f}x')
+    return results
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Kernel uevent listener so device discovery is driven by hotplug
+events rather than by polling lsblk.
+"""
+# pylint: disable=invalid-name,broad-exception-caught
+
+import socket
+import struct
+from luks_tray.Utils import prt
+
+NETLINK_KOBJECT_UEVENT = 15
+GROUP_KERNEL = 1 # raw events straight from the kernel
+GROUP_UDEV = 2 # events re-broadcast by udevd after its rules have run
+UDEV_PREFIX = b'libudev\0'
+UDEV_MAGIC = 0xfeedcafe
+
+class UeventMonitor:
+    """ Reads block-device uevents from the netlink socket.  The owner
+        registers fileno() with its event loop (e.g., a QSocketNotifier)
+        and calls read_events() whenever it is readable.
+    """
+    subsystems = ('block', )
+    actions = ('add', 'remove', 'change', 'move', 'online', 'offline')
+
+    def __init__(self):
+        self.sock = None
+        self.overflowed = False # dropped events; the caller should rescan
+
+    def open(self):
+        """ Open and bind the netlink socket. We join both the kernel
+            group (earliest notice) and the udev group (notice after the
+            udev database, which lsblk reads, is updated).
+            Returns True if listening.
+        """
+        try:
+            sock = socket.socket(socket.AF_NETLINK,
+                    socket.SOCK_DGRAM | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC,
+                    NETLINK_KOBJECT_UEVENT)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024*1024)
+            sock.bind((0, GROUP_KERNEL | GROUP_UDEV))
+        except Exception as e:
+            prt(f'WARN: cannot listen for uevents ({e}); polling only')
+            return False
+        self.sock = sock
+        return True
+
+    def close(self):
+        """ Close the netlink socket """
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def fileno(self):
+        """ The fd to watch for readability (or -1 if not open) """
+        return self.sock.fileno() if self.sock else -1
+
+    @staticmethod
+    def parse(data):
+        """ Parse one uevent datagram into a dict of its properties.
+            Handles both kernel format ("action@devpath\\0KEY=VAL\\0...")
+            and udev format (binary "libudev" header then KEY=VAL\\0...).
+            Returns None if the datagram is not recognized.
+        """
+        if data.startswith(UDEV_PREFIX):
+            if len(data) < 24:
+                return None
+            # the magic is in network order; the offsets are in host order
+            if struct.unpack_from('!I', data, 8)[0] != UDEV_MAGIC:
+                return None
+            props_off, props_len = struct.unpack_from('=II', data, 16)
+            body = data[props_off:props_off+props_len]
+        else:
+            head, _, body = data.partition(b'\0')
+            if b'@' not in head:
+                return None
+        event = {}
+        for field in body.split(b'\0'):
+            key, sep, value = field.partition(b'=')
+            if sep:
+                event[key.decode('utf-8', 'replace')] = value.decode('utf-8', 'replace')
+        return event
+
+    def is_relevant(self, event):
+        """ Is this a block device (disk, partition, dm, loop) event
+            that could change what we show?
+        """
+        return (event.get('SUBSYSTEM', '') in self.subsystems
+                and event.get('ACTION', '') in self.actions)
+
+    def read_events(self):
+        """ Drain the socket. Returns the list of relevant events; sets
+            self.overflowed if the kernel dropped events (in which case
+            the caller cannot know what changed and should rescan).
+        """
+        events = []
+        while self.sock:
+            try:
+                data = self.sock.recv(64*1024)
+            except BlockingIOError:
+                break
+            except OSError as e: # ENOBUFS on overflow
+                prt(f'WARN: uevent socket: {e}')
+                self.overflowed = True
+                break
+            event = self.parse(data)
+            if event and self.is_relevant(event):
+                events.append(event)
+        return events
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
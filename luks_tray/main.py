@@ -27,7 +27,7 @@ import os
 import sys
 import json
 import signal
-import subprocess
+import socket
 import shutil
 import shlex
 import traceback
@@ -45,13 +45,29 @@ import petname
 from PyQt6.QtWidgets import QApplication, QSystemTrayIcon, QMenu, QMessageBox
 from PyQt6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton
 from PyQt6.QtWidgets import QFileDialog, QCheckBox, QSizePolicy
-from PyQt6.QtWidgets import QProgressBar, QWidgetAction, QWidget
+from PyQt6.QtWidgets import QProgressBar, QWidget
 from PyQt6.QtGui import QIcon, QCursor, QAction, QFont, QFontDatabase, QFontInfo
-from PyQt6.QtCore import QTimer, Qt
+from PyQt6.QtCore import Qt, QSocketNotifier, QThreadPool
     # from PyQt6.QtWidgets import QLabel, QWidgetAction
     # from PyQt6.QtCore import Qt
 
-from luks_tray.History import HistoryClass
+from luks_tray.History import HistoryClass, calibrate_kdf
+from luks_tray.UeventMonitor import UeventMonitor
+from luks_tray.SysfsScanner import SysfsScanner, run_lsblk, compare_with_lsblk
+from luks_tray.SysfsScanner import bench as bench_scan
+from luks_tray.MountInfo import MountTable
+from luks_tray.Records import ContainerRecord, FilesystemRecord
+from luks_tray.Scheduler import RefreshScheduler
+from luks_tray.Stats import timings
+from luks_tray.Helper import helper
+from luks_tray import Native
+from luks_tray import MountOptions
+from luks_tray import CryptFlags
+from luks_tray import CryptCreate
+from luks_tray.Pipeline import make_step, execute, timeout_for
+from luks_tray.Commands import run_command
+from luks_tray.Operations import OperationRunner, Poster, unlock_pool_size
+from luks_tray.LuksHeader import header_cache
 from luks_tray.Utils import prt
 from luks_tray import Utils
 from luks_tray.IniTool import IniTool
@@ -69,6 +85,9 @@ def requires_manual_title():
 # Global flag to run the check only once
 IS_SWAY_LIKE_ENV = requires_manual_title()
 
+STATS_PENDING = '(helper timings pending)' # ends the stats file until they arrive
+STATS_TIMEOUT_SECS = 3.0 # for the helper's timings (within --stats' 5s wait)
+
 def generate_uuid_for_file_path(file_path):
     """ Use SHA-256 to hash the file path """
     file_hash = hashlib.sha256(file_path.encode('utf-8')).hexdigest()
@@ -79,66 +98,97 @@ def generate_uuid_for_file_path(file_path):
 
     return generated_uuid
 
-def sudo_cmd(args, errs=None, input_str=None):
-    """ run sudo -n {args}; the -n will avoid prompting for a
-        sudo password and fail if not allowed
+def sudo_run(args, input_str=None, timeout_ms=None, cancel=None):
+    """ run {args} as root via the helper if it is up, else via sudo -n
+        (the -n will avoid prompting for a sudo password and fail if not
+        allowed); returns (returncode, stdout, stderr). Already root,
+        losetup/mount/umount are done natively (see Native.py). The
+        command is stopped after timeout_ms (default: per timeout_for())
+        or upon cancel (a CancelToken).
     """
-    args = ['sudo', '-n'] + args
-    return run_cmd(args, errs, input_str)
-
-def run_cmd(args, errs=None, input_str=None):
-    """ TBD """
-    # pylint: disable=consider-using-with
-
-    proc = subprocess.Popen(args, stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    timeout_ms = timeout_ms if timeout_ms else timeout_for(args)
+    result = None
+    if helper.is_running():
+        result = helper.run(args, input_str, timeout_ms, cancel)
+    if result is None and Native.enabled:
+        start = time.perf_counter()
+        deadline = time.monotonic() + timeout_ms / 1000
+        result = Native.run(args, stop=lambda: (cancel is not None and cancel.is_set())
+                            or time.monotonic() > deadline)
+        if result is not None:
+            timings.add(f'native {args[0]}', (time.perf_counter() - start) * 1000)
+    if result is not None:
+        return result
+    sub = run_command(['sudo', '-n'] + args, input_str, timeout_ms, cancel)
+    return sub.returncode, sub.stdout, sub.stderr
+
+def sudo_pipeline(steps, progress=None, cancel=None):
+    """ run the steps (see Pipeline.py) as root as one transaction: in
+        one helper request if it is up, else a "sudo -n" per step. A
+        failure (or cancel, a CancelToken) undoes the steps done.
+        progress(index, count, name) is called per step.
+        Returns (err, captures).
+    """
+    result = helper.batch(steps, progress, cancel) if helper.is_running() else None
+    if result is None:
+        def run(args, input_str):
+            return sudo_run(args, input_str, cancel=cancel)
+        result = execute(steps, run, progress, cancel.is_set if cancel else None)
+    summary = ' '.join(f'{name}={ms:.0f}ms' for name, ms, _ in result['steps'])
+    prt(f'pipeline: {"FAILED" if result["err"] else "ok"}: {summary}')
+    for name, ms, _ in result['steps']:
+        timings.add(f'step {name}', ms)
+    for args, returncode in result['undone']:
+        prt(f'pipeline: undo {args} [rc={returncode}]')
+    return result['err'], result['captures']
+
+def sudo_cmd(args, errs=None, input_str=None, timeout_ms=None):
+    """ run {args} as root (see sudo_run()); returns None on success,
+        else the error string (also appended to errs if given)
+    """
+    returncode, stdout, stderr = sudo_run(args, input_str, timeout_ms)
+    if returncode == 0:
+        return None
+    err = f'FAIL: {' '.join(['sudo', '-n'] + args)}: {stdout} {stderr} [rc={returncode}]'
+    if err and errs:
+        errs.append(err)
+    return err
 
-    # Communicate() writes to stdin and waits for the process to finish
-    stdout, stderr = proc.communicate(input=input_str)
-    # print(f'+++ {stdout=}\n+++ {stderr=}')
-    if proc.returncode == 0:
+def run_cmd(args, errs=None, input_str=None, timeout_ms=None, cancel=None):
+    """ run {args} (see Commands.run_command()); returns None on success,
+        else the error string (also appended to errs if given)
+    """
+    sub = run_command(args, input_str, timeout_ms, cancel)
+    if sub.returncode == 0:
         return None
-    err = f'FAIL: {' '.join(args)}: {stdout} {stderr} [rc={proc.returncode}]'
+    err = f'FAIL: {' '.join(args)}: {sub.stdout} {sub.stderr} [rc={sub.returncode}]'
     if err and errs:
         errs.append(err)
     return err
 
 
 
-def run_unmount(mount_point: str, busy_warns: set) -> str | None:
+def run_unmount(mount_point: str, busy_warns: dict) -> str | None:
     """Attempts to unmount the given mount point.
-    If it fails due to 'busy', show a popup with the list of processes using it.
+    If it fails due to 'busy', busy_warns[mount_point] gets the list of
+    processes using it (for show_busy_warnings() on the GUI thread).
     Returns error string or None on success.
     """
-    try:
-        sub = subprocess.run(['sudo', "umount", mount_point],
-                    capture_output=True, text=True, check=False)
-    except Exception as e:
-        return f"FAIL: umount {mount_point}: Exception: {e}"
-
-    if sub.returncode == 0:
+    returncode, stdout, stderr = sudo_run(['umount', mount_point])
+    if returncode == 0:
         return None  # success
 
-    err = f"FAIL: umount {mount_point}: {sub.stdout.strip()} {sub.stderr.strip()} [rc={sub.returncode}]"
+    err = f"FAIL: umount {mount_point}: {stdout.strip()} {stderr.strip()} [rc={returncode}]"
 
-    if 'busy' not in sub.stderr.lower() or mount_point in busy_warns:
+    if 'busy' not in stderr.lower() or mount_point in busy_warns:
         return err  # Not a 'busy' error — no popup needed
 
     # Try to get processes using the mount point
-    try:
-        fuser = subprocess.run(
-                ['sudo', "fuser", "-vm", mount_point],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=True
-            )
-        fuser_out = fuser.stderr.strip()  # This is the real data
-
-    except Exception as e:
-        fuser_out = f"(Could not get process info: {e})"
-
-    busy_warns.add(mount_point)
+    returncode, _, stderr = sudo_run(["fuser", "-vm", mount_point])
+    if returncode == 0:
+        fuser_out = stderr.strip()  # This is the real data
+    else:
+        fuser_out = f"(Could not get process info: {stderr.strip()} [rc={returncode}])"
 
     # Extract just PID and COMMAND, skip 'kernel' and header lines
     process_lines = []
@@ -148,17 +198,20 @@ def run_unmount(mount_point: str, busy_warns: set) -> str | None:
         process_lines.append(line.strip())
 
     info = "\n - ".join(process_lines) if process_lines else "(No user-space processes found using the mount)"
-
-    # Show user-friendly popup
-    msg = QMessageBox()
-    msg.setIcon(QMessageBox.Icon.Warning)
-    msg.set_title("Unmount Failed — Device Busy [luks-tray]")
-    msg.setText(f"'{mount_point}' busy by these processes:\n - {info}")
-    msg.setStandardButtons(QMessageBox.StandardButton.Ok)
-    msg.exec()
+    busy_warns[mount_point] = info
 
     return err
 
+def show_busy_warnings(busy_warns: dict):
+    """ Show a popup per busy mount point (see run_unmount()) """
+    for mount_point, info in busy_warns.items():
+        msg = QMessageBox()
+        msg.setIcon(QMessageBox.Icon.Warning)
+        msg.setWindowTitle("Unmount Failed — Device Busy [luks-tray]")
+        msg.setText(f"'{mount_point}' busy by these processes:\n - {info}")
+        msg.setStandardButtons(QMessageBox.StandardButton.Ok)
+        msg.exec()
+
 class DeviceInfo:
     """ Class to dig out the info we want from the system."""
     bans = ('/', '/home', '/var', '/usr', '/tmp', '/opt', '/srv',
@@ -172,26 +225,16 @@ class DeviceInfo:
         self.partitions = None
         self.entries = {}
         self.prev_entries_str = ''
+        self.prev_diffs_str = None
+        self.scanner = SysfsScanner()
+        self.last_devices = [] # from the last good scan (for when lsblk fails)
+        self.prev_states = {} # uuid => container.state() from the last scan
+        self.changes = [] # change events from the last scan
 
     @staticmethod
     def make_partition_namespace(name, size_str):
         """ TBD """
-        return SimpleNamespace(name=name,       # /proc/partitions
-            opened=None,    # or True or False
-            upon='',        # primary mount point
-            uuid='',
-            size_str=size_str,  # /sys/block/{name}/... (e.g., 3.5T)
-            type='',        # e.g., loop, crypt, disk, part
-            fstype='',      # fstype OR /sys/class/block/{name}/device/model
-            label='',       # blkid
-            mounts=[],      # /proc/mounts
-            parent=None,    # a partition
-            filesystems=[],        # child file systems
-            back_file='', # backing file
-            vital=None, # history if any
-            readonly=False, # whether readonly
-            )
-
+        return ContainerRecord(name=name, size_str=size_str)
 
     @staticmethod
     def get_device_vendor_model(device_name):
@@ -226,6 +269,37 @@ class DeviceInfo:
                 return True
         return False
 
+    def get_blockdevices(self):
+        """ Get the lsblk-style device tree per the 'device_scanner' option:
+            - 'sysfs': in-process scan of /sys (the default)
+            - 'lsblk': run lsblk (the old way)
+            - 'compare': scan /sys, but cross-check against lsblk and log differences
+        """
+        mode = self.tray.ini_tool.get_current_val('device_scanner')
+        if mode == 'lsblk':
+            return self.run_lsblk()
+        try:
+            devices = self.scanner.scan(self.tray.mount_table.mounts)
+        except Exception as exc:
+            prt(f'WARN: sysfs scan failed ({exc}); using lsblk')
+            return self.run_lsblk()
+        self.last_devices = devices
+        if mode == 'compare':
+            diffs = compare_with_lsblk(devices)
+            diffs_str = '\n  '.join(diffs)
+            if diffs_str != self.prev_diffs_str:
+                prt('sysfs scan vs lsblk: ' + (f'DIFFERS:\n  {diffs_str}' if diffs else 'SAME'))
+                self.prev_diffs_str = diffs_str
+        return devices
+
+    def run_lsblk(self):
+        """ The devices per lsblk (as of the last good scan if it fails) """
+        devices = run_lsblk()
+        if devices is None:
+            return self.last_devices
+        self.last_devices = devices
+        return devices
+
     def parse_lsblk(self):
         """ Parse ls_blk for all the goodies we need """
         def get_backing_file(loop_device):
@@ -237,8 +311,8 @@ class DeviceInfo:
             except FileNotFoundError:
                 return ''
 
-        def eat_one(device):
-            entry = self.make_partition_namespace('', '')
+        def eat_one(device, record_class=ContainerRecord):
+            entry = record_class()
             entry.name=device.get('name', '')
             entry.type = device.get('type', '')
             entry.readonly = bool(device.get('ro', 0))
@@ -257,18 +331,13 @@ class DeviceInfo:
                 del mounts[0]
             entry.mounts = mounts
             if entry.type == 'loop':
-                entry.back_file = get_backing_file(entry.name)
+                entry.back_file = device.get('back-file', None) or get_backing_file(entry.name)
             return entry
 
-               # Run the `lsblk` command and get its output in JSON format with additional columns
-        result = subprocess.run(['lsblk', '-J', '-o',
-                    'NAME,MAJ:MIN,TYPE,RO,FSTYPE,LABEL,PARTLABEL,FSUSE%,SIZE,UUID,MOUNTPOINTS', ],
-                    stdout=subprocess.PIPE, text=True, check=False)
-        parsed_data = json.loads(result.stdout)
         dev_cons, file_cons = {}, {}
 
         # Parse each block device and its properties
-        for device in parsed_data['blockdevices']:
+        for device in self.get_blockdevices():
             parent = eat_one(device)
             parent.fstype = self.get_device_vendor_model(parent.name)
             for child in device.get('children', []):
@@ -302,7 +371,7 @@ class DeviceInfo:
                 entry.opened = True
                 grandchildren = child.get('children', [])
                 for grandchild in grandchildren:
-                    subentry = eat_one(grandchild)
+                    subentry = eat_one(grandchild, FilesystemRecord)
                     subentry.parent = entry.name
                     entry.filesystems.append(subentry)
                     # entries[subentry.name] = subentry
@@ -318,13 +387,17 @@ class DeviceInfo:
                             if self.is_banned(entry.mounts):
                                 continue # skip whole disk entries
 
-        self.entries = dev_cons | file_cons
-        if self.DB:
+        entries = dev_cons | file_cons
+        self.changes = self.diff_entries(entries)
+        self.entries = entries
+        if self.DB and self.changes:
+            for change in self.changes:
+                prt(f'change: {change.kind} {change.uuid} {change.detail}')
             #s = StringIO()
             temps = []
             for entry in self.entries.values():
                 tmp_row = {}
-                row = vars(entry)
+                row = entry.as_dict()
                 for key, value in row.items():
                 #   if isinstance(value, SimpleNamespace):
                 #       tmp_row[key] = str(vars(value))
@@ -343,6 +416,46 @@ class DeviceInfo:
         return self.entries
 
 
+    def diff_entries(self, entries):
+        """ Compare a fresh scan against the previous one and return the list
+            of change events (namespaces with kind, uuid, container, detail):
+              appeared, disappeared, opened, closed, mounted, unmounted,
+              readonly, readwrite, and changed (for anything else).
+            Unchanged containers are replaced (in entries) by their objects from
+            the previous scan so whatever was attached to them (e.g., vital) is kept.
+        """
+        def event(kind, uuid, container, detail=''):
+            changes.append(SimpleNamespace(kind=kind, uuid=uuid,
+                                           container=container, detail=detail))
+        changes, states = [], {}
+        for uuid, entry in entries.items():
+            state = states[uuid] = entry.state()
+            old = self.prev_states.get(uuid, None)
+            if old is None:
+                event('appeared', uuid, entry, entry.upon)
+                continue
+            if old == state:
+                entries[uuid] = self.entries[uuid]
+                continue
+            was = dict(zip(ContainerRecord.state_fields, old))
+            if bool(was['opened']) != bool(entry.opened):
+                event('opened' if entry.opened else 'closed', uuid, entry)
+            if was['upon'] != entry.upon:
+                if entry.upon:
+                    event('mounted', uuid, entry, entry.upon)
+                else:
+                    event('unmounted', uuid, entry, was['upon'])
+            if was['readonly'] != entry.readonly:
+                event('readonly' if entry.readonly else 'readwrite', uuid, entry)
+            if any(was[key] != state[idx] for idx, key in enumerate(ContainerRecord.state_fields)
+                   if key not in ('opened', 'upon', 'readonly')):
+                event('changed', uuid, entry)
+        for uuid in self.prev_states:
+            if uuid not in states:
+                event('disappeared', uuid, self.entries.get(uuid, None))
+        self.prev_states = states
+        return changes
+
     def get_relative(self, name):
         """ TBD """
         return self.entries.get(name, None)
@@ -362,6 +475,7 @@ class LuksTray():
                             'alert',
                             'ok',
                         ] )
+    fallback_poll_ms = 3000 # longest poll interval when uevents are unavailable
 
     def __init__(self, ini_tool, opts):
         LuksTray.singleton = self
@@ -381,10 +495,6 @@ class LuksTray():
         # self.emoji_font = (QFont("Noto Color Emoji") if self.has_emoji_font
                            # else QFont("DejaVu Sans"))
 
-        _, missing, self.udisks_cmd = self.check_dependencies()
-
-        assert not missing, f"missing system commands: {missing}"
-
         # Create an invisible base widget to serve as the dialog parent
         self.dialog_parent = QWidget(None) # Parented by None, so it's top-level
         self.dialog_parent.setWindowFlags(Qt.WindowType.Tool) # Hint to WM it's a utility window
@@ -393,6 +503,8 @@ class LuksTray():
 
         self.history = HistoryClass(ini_tool.history_path)
         self.history.restore()
+        self.poster = Poster(self.app) # the history writer's outcomes come back here
+        self.history.post = self.poster.post
 
         self.icons, self.svgs = {}, {}
         self.prev_icon_key = ''
@@ -425,6 +537,7 @@ class LuksTray():
         # ??? Load JSON data
         # ??? self.load_data()
         self.lsblk = DeviceInfo(opts=opts, tray=self)
+        self.mount_table = MountTable()
         self.mount_infos = {}
         self.upons = set()
 
@@ -433,25 +546,81 @@ class LuksTray():
         self.tray_icon.setVisible(True)
 
         self.containers, self.menu = {}, QMenu()
-        self.actions = []
+        self.history_only = {} # uuid => container for known, absent file containers
+        self.history_generation = None # history.generation when last merged
+        self.prev_menu_key = None
+        self.actions = [] # action pool keys as shown in the menu
+        self.action_pool = {} # key => QAction (reused across refreshes)
+        self.action_handlers = {} # key => current handler (see menu_view_model())
+        self.actions_retexted = False
+        self.menu_fingerprint, self.menu_model = None, None # last view model
+        self.menu_handlers = self.make_menu_handlers()
+
+        # Device changes arrive as kernel uevents and mount changes as
+        # POLLPRI on mountinfo; either makes the scheduler poll fast for a
+        # bit (which also coalesces bursts). Otherwise, polling is only a
+        # safety net that backs off while nothing changes.
+        self.scheduler = RefreshScheduler(self.tray_icon, self.update_menu)
+        # mounts/unmounts run on a pool; their containers show as busy
+        self.operations = OperationRunner(self.scheduler, parent=self.app)
+        self.operations.on_change = self.update_menu_items
+        self.uevents = UeventMonitor()
+        self.uevent_notifier = None
+        if self.uevents.open():
+            self.uevent_notifier = QSocketNotifier(self.uevents.fileno(),
+                                QSocketNotifier.Type.Read, self.tray_icon)
+            self.uevent_notifier.activated.connect(self.on_uevent)
+            self.lsblk.scanner.cache_probes = True # on_uevent() says what changed
+        self.mount_notifier = QSocketNotifier(self.mount_table.fileno(),
+                                QSocketNotifier.Type.Exception, self.tray_icon)
+        self.mount_notifier.activated.connect(self.on_mount_change)
+
+        # SIGUSR1 (e.g., from "luks-tray --stats") dumps the timings and
+        # SIGTERM (e.g., at logout) exits (saving the history); the wakeup
+        # fd gets the Qt loop to notice the signal promptly
+        self.signal_rsock, self.signal_wsock = socket.socketpair()
+        self.signal_rsock.setblocking(False)
+        self.signal_wsock.setblocking(False)
+        signal.set_wakeup_fd(self.signal_wsock.fileno())
+        signal.signal(signal.SIGUSR1, lambda *_: None)
+        signal.signal(signal.SIGTERM, lambda *_: None)
+        self.signal_notifier = QSocketNotifier(self.signal_rsock.fileno(),
+                                QSocketNotifier.Type.Read, self.tray_icon)
+        self.signal_notifier.activated.connect(self.on_signal)
+        try:
+            with open(ini_tool.pid_path, 'w', encoding='utf-8') as f:
+                f.write(f'{os.getpid()}\n')
+        except OSError as e:
+            prt(f'WARN: cannot write {ini_tool.pid_path!r}: {e}')
+
+        # which commands are optional depends on whether the helper (or
+        # running as root) does losetup/mount/umount natively
+        if self.ini_tool.update_config():
+            self.apply_config()
+        _, missing, self.udisks_cmd = self.check_dependencies(native=self.native_active())
+        assert not missing, f"missing system commands: {missing}"
+
         self.update_menu()
         self.remove_unused_automounts()
-
-        self.timer = QTimer(self.tray_icon)
-        self.timer.timeout.connect(self.update_menu)
-        self.timer.start(3000)  # 3000 milliseconds = 3 seconds
+        self.scheduler.start()
 
     @staticmethod
-    def check_dependencies(verbose=False):
+    def check_dependencies(verbose=False, native=False):
         """ ensure the system utilities we need are available
-            and discover which udisks command we are using
+            and discover which udisks command we are using; with native
+            (i.e., losetup/mount/umount are done natively by the helper or
+            as root), those commands (and bindfs where idmapped mounts
+            work) are optional
         """
         utilities = [
             'lsblk', 'cryptsetup', 'rmdir',
             'mount', 'umount', 'bindfs', 'losetup',
-            'fuser', 'truncate', 'mkfs.ext4', 'bindfs',
+            'fuser', 'truncate', 'mkfs.ext4',
             # 'kill', 'losetup', ['udisksctl', 'udisks', 'udisks2'],
         ]
+        optional = Native.COMMANDS if native else () # done natively if absent
+        if native and Native.idmap_supported():
+            optional += ('bindfs',) # but where idmapped mounts fail
         found, missing, udisks_cmd = [], [], None
         for entry in utilities:
             utils = entry if isinstance(entry, list) else [entry]
@@ -463,7 +632,7 @@ class LuksTray():
                     if util.startswith('udisks'):
                         udisks_cmd = util
                     break
-            if not got_one:
+            if not got_one and entry not in optional:
                 missing.append(entry)
         if verbose or missing:
             for util in found:
@@ -495,32 +664,91 @@ class LuksTray():
         return QFont()  # system default
 
     def update_mounts(self):
-        """ TBD """
-        self.mount_infos = {}
-        self.upons = set()
-        with open('/proc/mounts', 'r', encoding='utf-8') as f:
-            for line in f:
-                parts = line.split()
-                if len(parts) >= 4:
-                    device = parts[0]
-                    mount_point = parts[1]
-                    options = parts[3]
-                    readonly = 'ro' in options.split(',')
-                    self.mount_infos[device] = SimpleNamespace(
-                                upon=mount_point, readonly=readonly)
-                    self.upons.add(mount_point)
+        """ Refresh mount_infos (device => topmost mount) and upons (all
+            mount points) from the mount table; cheap unless it changed.
+        """
+        if self.mount_table.refresh():
+            self.mount_infos = {device: mounts[-1] for device, mounts
+                                in self.mount_table.by_device.items()}
+            self.upons = set(self.mount_table.by_point.keys())
         return set(self.mount_infos.keys())
 
+    def on_mount_change(self, *_):
+        """ The kernel flagged a mount table change; schedule a rescan """
+        self.mount_table.note_change()
+        self.scheduler.hurry()
+
     def is_mounted(self, thing):
         """ TBD """
         return thing in self.mount_infos or thing in self.upons
 
-    def merge_containers_history(self):
-        """ TBD """
-        self.history.restore()
-        for container in self.containers.values():
-            self.history.ensure_container(container)
-        self.history.save()
+    def merge_containers_history(self, changes):
+        """ Fold the scan's change events into the history and attach
+            vitals to containers; only when the history itself was
+            (re)loaded is every container revisited.
+        """
+        with timings.timed('history.restore'):
+            self.history.restore()
+        if self.history.generation != self.history_generation:
+            self.history_generation = self.history.generation
+            self.history_only = {}
+            for container in self.lsblk.entries.values():
+                self.history.ensure_container(container)
+            for vital in self.history.vitals.values():
+                container = self.lsblk.entries.get(vital.uuid, None)
+                if container:
+                    container.vital = vital
+                elif vital.back_file:
+                    self.history_only[vital.uuid] = self.make_history_only(vital)
+        else:
+            for change in changes:
+                if change.kind == 'disappeared':
+                    vital = self.history.vitals.get(change.uuid, None)
+                    if vital and vital.back_file:
+                        self.history_only[change.uuid] = self.make_history_only(vital)
+                    continue
+                self.history.ensure_container(change.container)
+                change.container.vital = self.history.vitals.get(change.uuid, None)
+                self.history_only.pop(change.uuid, None)
+        with timings.timed('history.save'):
+            self.history.save()
+
+    @staticmethod
+    def make_history_only(vital):
+        """ Make the container for a known file container that is not
+            present (present device containers come from the scan) """
+        ns = DeviceInfo.make_partition_namespace('', '')
+        ns.type = 'crypt'
+        ns.back_file = vital.back_file
+        ns.opened = False
+        ns.uuid = vital.uuid
+        ns.vital = vital
+        return ns
+
+    def loop_details(self, container):
+        """ A line on the loop device of an opened crypt file (e.g.,
+            'Loop: /dev/loop3, direct I/O, 4096-byte blocks') or '' """
+        kname = getattr(container.parent, 'name', container.parent) or ''
+        status = self.lsblk.scanner.loop_status(kname) if kname.startswith('loop') else None
+        if not status:
+            return ''
+        return (f'Loop: /dev/{status.name}, {"direct I/O" if status.dio else "cached I/O"},'
+                f' {status.block_size}-byte blocks')
+
+    @staticmethod
+    def crypt_details(mapper):
+        """ A line on the dm-crypt flags active on an opened container's
+            mapping (e.g., 'dm-crypt: No Read Workqueue, Allow Discards')
+            or '' if unknown. It runs "cryptsetup status" (the flags are
+            not in sysfs): call it off the GUI thread """
+        if not mapper:
+            return ''
+        returncode, stdout, _ = sudo_run(['cryptsetup', 'status', mapper], timeout_ms=5000)
+        if returncode != 0:
+            return ''
+        flags = CryptFlags.parse_status(stdout)
+        return 'dm-crypt: ' + (', '.join(CryptFlags.FLAGS[name][2] for name in flags)
+                               if flags else 'no performance flags')
 
     def show_partition_details(self, name):
         """ TBD """
@@ -531,57 +759,160 @@ class LuksTray():
         details += 'UUID={container.UUID}\n'
         QMessageBox.information(None, "Partition Details", details)
 
+    def on_uevent(self, *_):
+        """ The uevent socket is readable; schedule a rescan if a block,
+            dm, or loop device was added, removed, or changed.
+        """
+        events = self.uevents.read_events()
+        if self.uevents.overflowed:
+            self.lsblk.scanner.forget()
+        for event in events:
+            if 'MAJOR' in event and 'MINOR' in event:
+                self.lsblk.scanner.forget(f'{event["MAJOR"]}:{event["MINOR"]}')
+        if events or self.uevents.overflowed:
+            self.uevents.overflowed = False
+            if self.lsblk.DB:
+                for event in events:
+                    prt(f'uevent: {event.get("ACTION")} {event.get("DEVNAME", event.get("DEVPATH"))}')
+            self.scheduler.hurry()
+
     def update_menu(self):
-        """ TBD """
-        self.ini_tool.update_config()
-        if self.history.status in ('unlocked', 'clear_text'):
-            self.update_mounts()
-            self.containers = self.lsblk.parse_lsblk()
-            self.merge_containers_history()
-            # add in the containers that are not mounted but in
-            # the history
-            for vital in self.history.vitals.values():
-                container = self.containers.get(vital.uuid, None)
-                if container:
-                    container.vital = vital
-                if not container and vital.back_file:
-                    # insert known file container (present device containers
-                    # should be in the containers list already)
-                    ns = DeviceInfo.make_partition_namespace('', '')
-                    ns.type = 'crypt'
-                    ns.back_file = vital.back_file
-                    ns.opened = False
-                    ns.uuid = vital.uuid
-                    ns.vital = vital
-                    self.containers[vital.uuid] = ns
-
-        self.update_menu_items()
+        """ Rescan and, if anything the menu depends on changed, rebuild it.
+            Returns True if something changed.
+        """
+        with timings.timed('refresh'):
+            with timings.timed('update_config'):
+                config_changed = self.ini_tool.update_config()
+            if config_changed:
+                self.apply_config()
+            changes = []
+            if self.history.status in ('unlocked', 'clear_text'):
+                with timings.timed('update_mounts'):
+                    self.update_mounts()
+                with timings.timed('parse_lsblk'):
+                    entries = self.lsblk.parse_lsblk()
+                changes = self.lsblk.changes
+                with timings.timed('merge_containers_history'):
+                    self.merge_containers_history(changes)
+                # add in the containers that are not mounted but in the history
+                self.containers = entries | self.history_only
+
+            menu_key = (self.history.status, self.history.generation)
+            if changes or config_changed or menu_key != self.prev_menu_key:
+                self.prev_menu_key = menu_key
+                with timings.timed('update_menu_items'):
+                    self.update_menu_items()
+                return True
+            return False
 
-    def update_menu_items(self):
-        """Update context menu with LUKS partitions."""
-        # menu = QMenu()
-        actions = []
-        # menu.setFont(self.emoji_font)
+    def apply_config(self):
+        """ Apply a (re)read config.ini """
+        self.scheduler.configure(self.ini_tool,
+                max_ms=None if self.uevent_notifier else self.fallback_poll_ms)
+        self.history.configure_kdf(self.ini_tool)
+        self.configure_helper()
+
+    @staticmethod
+    def native_active():
+        """ Are losetup/mount/umount done natively (by the helper, or
+            in-process when we are root)? """
+        return bool(helper.is_running() and helper.native) or Native.enabled
+
+    def configure_helper(self):
+        """ Start (or stop) the root helper per config.ini; privileged
+            commands fall back to a "sudo -n" each if it cannot start """
+        wanted = self.ini_tool.get_current_val('use_helper')
+        native = self.ini_tool.get_current_val('native_ops')
+        Native.configure(native) # for when we are root (without the helper)
+        if wanted and (not helper.is_running() or helper.native != native):
+            err = helper.start(self.ini_tool.helper_path, native=native)
+            if err:
+                prt(f'WARN: {err} (using sudo per command)')
+        elif not wanted and helper.is_running():
+            helper.stop()
 
+    def on_signal(self, *_):
+        """ A signal arrived (relayed via the wakeup fd); SIGUSR1 dumps
+            stats and SIGTERM exits """
+        try:
+            signums = self.signal_rsock.recv(64)
+        except (BlockingIOError, InterruptedError):
+            return
+        if signal.SIGTERM in signums:
+            prt('SIGTERM: exiting')
+            self.exit_app()
+        if signal.SIGUSR1 in signums:
+            self.dump_stats()
+
+    def dump_stats(self):
+        """ Write the timings to the debug log and the stats file (for
+            --stats); the helper's are fetched on the operation pool (it
+            may be slow to answer while busy) and appended when they arrive """
+        report = timings.report() + f'\nscheduler: {self.scheduler.describe()}'
+        prt(report)
+        if not helper.is_running():
+            self.write_stats(report)
+            return
+        self.write_stats(report + '\n' + STATS_PENDING)
+        fetched = []
+        def fetch(_):
+            fetched.append(helper.report(timeout=STATS_TIMEOUT_SECS))
+        def done(_):
+            if fetched and fetched[0]:
+                prt(fetched[0])
+            self.write_stats('\n'.join([report] + [part for part in fetched if part]))
+        self.operations.start('dump_stats', 'Fetch helper stats', fetch, on_done=done)
+
+    def write_stats(self, report):
+        """ Replace the stats file (for --stats) with report """
+        tmp_path = self.ini_tool.stats_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(report + '\n')
+            os.replace(tmp_path, self.ini_tool.stats_path)
+        except OSError as e:
+            prt(f'WARN: cannot write {self.ini_tool.stats_path!r}: {e}')
+
+    def make_menu_handlers(self):
+        """ The callbacks that menu_view_model() handlers name """
+        return {'file': self.handle_file_click, 'device': self.handle_device_click,
+                'create': self.handle_create_file_click, 'add': self.handle_add_file_click,
+                'master': self.prompt_master_password, 'exit': self.exit_app,
+                'busy': self.handle_busy_click, 'unlock_all': self.handle_unlock_all_click}
+
+    @staticmethod
+    def unlock_candidates(containers, busy=frozenset()):
+        """ The containers "Unlock All Known" would mount: locked, with a
+            saved password and mount point, and no operation in flight """
+        return [container for container in containers.values()
+                if not container.opened and container.vital and container.vital.password
+                and container.vital.upon and container.uuid not in busy
+                and not (container.back_file and container.back_file in busy)]
+
+    @staticmethod
+    def menu_view_model(containers, status, do_alerts, busy=frozenset()):
+        """ The menu as pure data (no Qt): returns (icon_key, entries)
+            where each entry is None (a separator) or a tuple of
+            (pool key, text, handler) and a handler is a tuple of
+            (name in menu_handlers, args...). Being immutable, the model
+            can be hashed and compared with the previous one. Containers
+            whose UUID or file is in busy have an operation in flight.
+        """
+        entries = []
         icon_key = 'none'
-        do_alerts = self.ini_tool.get_current_val('show_anomaly_alerts')
 
-        if self.history.status == 'locked':
-            action = QAction('Click to enter master password', self.app)
-            action.setFont(self.mono_font)
-            action.triggered.connect(self.prompt_master_password)
-            actions.append(action)
+        if status == 'locked':
+            entries.append(('master', 'Click to enter master password', ('master',)))
         else:
             separated = False
             idx = -1
-            for idx, container in enumerate(self.containers.values()):
+            for idx, container in enumerate(containers.values()):
                 mountpoint = container.upon
                 if not mountpoint and container.vital:
                     mountpoint = f'[{container.vital.upon}]'
 
                 if idx > 0 and not separated and container.type == 'crypt':
-                    # menu.addSeparator()
-                    actions.append(None)
+                    entries.append(None)
                     separated = True
 
                 name = container.name
@@ -591,7 +922,11 @@ class LuksTray():
                         name = '~' + name[6:]
 
 #               # Determine which emoji/symbol to show
-                if mountpoint.startswith('/'):
+                is_busy = container.uuid in busy or (container.back_file
+                                                     and container.back_file in busy)
+                if is_busy: # mid-operation states (e.g., opened, not yet mounted) are no anomaly
+                    emoji = '⧗'
+                elif mountpoint.startswith('/'):
                     emoji = '⧈' if container.readonly else '▣'
                     icon_key = 'ok' if icon_key != 'alert' else icon_key
                 elif container.opened:
@@ -600,119 +935,127 @@ class LuksTray():
                 else:
                     emoji = '▽'
 
-
                 # Construct menu line text
                 if emoji == '‼':
                     text = f'{name} CLICK-to-LOCK'
                 else:
                     text = f'{name} {mountpoint}'
 
-
-                # Add the emoji-enhanced item
-                # self.add_emoji_item(menu, emoji, text, callback)
-                # prt(f'{emoji} {text}')
-                action = QAction(f'{emoji} {text}', self.app)
-                action.setFont(self.mono_font)  # applies to non-HTML paths
-                                # Connect the left-click action
-                if container.back_file:
-                    action.triggered.connect(lambda checked,
-                                 x=container.uuid: self.handle_file_click(x))
-                else:
-                    action.triggered.connect(lambda checked,
-                                 x=container.uuid: self.handle_device_click(x))
-                # menu.addAction(action)
-                actions.append(action)
-
+                handler = ('file' if container.back_file else 'device', container.uuid)
+                if is_busy:
+                    handler = ('busy', container.uuid)
+                entries.append((('container', container.uuid), f'{emoji} {text}', handler))
 
             # Other fixed menu entries
             if idx > 0 and not separated:
-                # menu.addSeparator()
-                actions.append(None)
-
-            action = QAction('Create New Crypt File', self.app)
-            action.setFont(self.mono_font)
-            action.triggered.connect(self.handle_create_file_click)
-            # menu.addAction(action)
-            actions.append(action)
+                entries.append(None)
 
-            action = QAction('Add Existing Crypt File', self.app)
-            action.setFont(self.mono_font)
-            action.triggered.connect(self.handle_add_file_click)
-            # menu.addAction(action)
-            actions.append(action)
+            candidates = LuksTray.unlock_candidates(containers, busy)
+            if candidates:
+                entries.append(('unlock_all', f'Unlock All Known ({len(candidates)})',
+                                ('unlock_all',)))
+            entries.append(('create', 'Create New Crypt File', ('create',)))
+            entries.append(('add', 'Add Existing Crypt File', ('add',)))
+            entries.append(None)
 
-            # menu.addSeparator()
-            actions.append(None)
+            if status in ('clear_text', 'unlocked'):
+                verb = 'Set' if status == 'clear_text' else 'Update/Clear'
+                entries.append(('master', f'{verb} Master Password', ('master',)))
 
-            if self.history.status in ('clear_text', 'unlocked'):
-                verb = 'Set' if self.history.status == 'clear_text' else 'Update/Clear'
-                action = QAction(f'{verb} Master Password', self.app)
-                action.setFont(self.mono_font)
-                action.triggered.connect(self.prompt_master_password)
-                # menu.addAction(action)
-                actions.append(action)
+        entries.append(('exit', 'Exit', ('exit',)))
+        return icon_key, tuple(entries)
 
-        action = QAction("Exit", self.app)
-        action.setFont(self.mono_font)
-        action.triggered.connect(self.exit_app)
-        # menu.addAction(action)
-        actions.append(action)
-
-        return self.replace_menu_if_different(actions, icon_key)
-
-
-    def replace_menu_if_different(self, actions, icon_key):
-        """ TBD """
-        def replace_menu():
-            nonlocal actions
-            was_visible = self.menu and self.menu.isVisible()
-
-            # self.menu = menu
-            self.menu.clear()
-            for action in actions:
-                if action:
-                    self.menu.addAction(action)
-                else:
-                    self.menu.addSeparator()
-            self.actions = actions
+    def update_menu_items(self):
+        """Update context menu with LUKS partitions (if its view model
+        differs from the last one; otherwise, no Qt objects are touched).
+        Returns True if the menu changed."""
+        model = self.menu_view_model(self.containers, self.history.status,
+                    self.ini_tool.get_current_val('show_anomaly_alerts'),
+                    self.operations.busy_keys())
+        fingerprint = hash(model)
+        if fingerprint == self.menu_fingerprint and model == self.menu_model:
+            return False
+        self.menu_fingerprint, self.menu_model = fingerprint, model
+
+        icon_key, entries = model
+        keys = []
+        for entry in entries:
+            if entry is None:
+                keys.append(None)
+            else:
+                key, text, handler = entry
+                self.pool_action(key, text, handler)
+                keys.append(key)
+
+        with timings.timed('replace_menu_if_different'):
+            return self.replace_menu_if_different(keys, icon_key)
+
+    def pool_action(self, key, text, handler):
+        """ Get the pooled QAction for key, creating it on first use and
+            otherwise updating its text and handler in place. Each action
+            is connected once (to on_action()), so refreshes neither
+            create new QActions nor stack up connections.
+        """
+        action = self.action_pool.get(key, None)
+        if action is None:
+            action = QAction(text, self.app)
+            action.setFont(self.mono_font)
+            action.triggered.connect(lambda checked, k=key: self.on_action(k))
+            self.action_pool[key] = action
+        elif action.text() != text:
+            action.setText(text)
+            self.actions_retexted = True
+        self.action_handlers[key] = handler
+        return action
+
+    def on_action(self, key):
+        """ A pooled action was triggered; call its current handler """
+        handler = self.action_handlers.get(key, None)
+        if handler:
+            name, args = handler[0], handler[1:]
+            self.menu_handlers[name](*args)
+
+    def replace_menu_if_different(self, keys, icon_key):
+        """ Make the menu show the pooled actions for keys (None for a
+            separator); it is rebuilt only if the sequence of keys changed
+            (text changes were already applied in place). Actions no longer
+            in use are deleted. Returns True if anything visible changed.
+        """
+        changed, self.actions_retexted = self.actions_retexted, False
+        unused = set(self.action_pool) - set(keys)
+        for key in unused:
+            action = self.action_pool.pop(key)
+            del self.action_handlers[key]
+            self.menu.removeAction(action)
+            action.deleteLater()
 
+        if self.prev_icon_key != icon_key:
+            self.prev_icon_key = icon_key
             self.tray_icon.setIcon(self.icons[icon_key])
-            self.tray_icon.setContextMenu(self.menu)
-            self.tray_icon.show()
-
-            # Reopen menu if it was previously open
-            if was_visible:
-                # Show menu at cursor position
-                cursor_pos = QCursor.pos()
-                self.menu.popup(cursor_pos)
+            changed = True
 
-            return True
+        if keys == self.actions:
+            return changed
 
-        def get_action_text(action):
-            if action is None:
-                return '<None>'
-            if isinstance(action, QWidgetAction):
-                widget = action.defaultWidget()
-                if isinstance(widget, QLabel):
-                    return widget.text()
-                return '<widget>'
-            return action.text()
-
-        if not self.actions: # or menu.actions() != self.menu.actions():
-            return replace_menu()
-        if self.prev_icon_key != icon_key:
-            self.prev_icon_key = icon_key
-            return replace_menu()
+        was_visible = self.menu and self.menu.isVisible()
+        self.menu.clear() # the pooled actions survive (the app owns them)
+        for key in keys:
+            if key is None:
+                self.menu.addSeparator()
+            else:
+                self.menu.addAction(self.action_pool[key])
+        self.actions = keys
 
-        if len(actions) != len(self.actions):
-            return replace_menu()
+        self.tray_icon.setContextMenu(self.menu)
+        self.tray_icon.show()
 
-        for idx, action in enumerate(actions):
-            old_action = self.actions[idx]
-            if get_action_text(action) != get_action_text(old_action):
-                return replace_menu()
+        # Reopen menu if it was previously open
+        if was_visible:
+            # Show menu at cursor position
+            cursor_pos = QCursor.pos()
+            self.menu.popup(cursor_pos)
 
-        return False
+        return True
 
 
     def handle_device_click(self, uuid):
@@ -729,6 +1072,21 @@ class LuksTray():
             dialog = MountFileDialog(self.containers[uuid])
             dialog.exec()
 
+    @staticmethod
+    def handle_busy_click(uuid):
+        """ Clicking a container with an operation in flight does nothing """
+        prt(f'busy: {uuid} has an operation in flight')
+
+    def handle_unlock_all_click(self):
+        """ Mount every locked container with a saved password and mount
+            point (those of crypt files that are present) at once """
+        candidates = [container for container in self.unlock_candidates(
+                        self.containers, self.operations.busy_keys())
+                      if not container.back_file or os.path.isfile(container.back_file)]
+        if candidates:
+            dialog = UnlockAllDialog(candidates)
+            dialog.exec()
+
     def handle_add_file_click(self):
         """ TBD """
         dialog = MountFileDialog(None)
@@ -743,6 +1101,18 @@ class LuksTray():
     def exit_app(self):
         """Exit the application."""
         self.tray_icon.hide()
+        for key in self.operations.busy_keys():
+            self.operations.cancel(key) # each stops after its current step
+        self.operations.wait(30000)
+        self.history.flush()
+        helper.stop()
+        try:
+            with open(self.ini_tool.pid_path, 'r', encoding='utf-8') as f:
+                ours = f.read().strip() == str(os.getpid())
+            if ours: # else another instance took it over
+                os.unlink(self.ini_tool.pid_path)
+        except OSError:
+            pass
         sys.exit()
 
     def prompt_master_password(self):
@@ -756,13 +1126,26 @@ class LuksTray():
         mount_point = values['upon']
         if not hasattr(vital, 'when'):
             vital.when = 0
+        mount_opts = ','.join(MountOptions.split(values.get('mount_opts', vital.mount_opts)))
+        if mount_opts == self.ini_tool.get_current_val('options', 'mount'):
+            mount_opts = '' # i.e., follow the [mount] defaults
+        crypt_flags = CryptFlags.from_values(values, vital.crypt_flags)
         if (values['password'] != vital.password or mount_point != vital.upon
+                or mount_opts != vital.mount_opts or crypt_flags != vital.crypt_flags
                 or time.time() - 24*3600 >= vital.when):
             vital.password = values['password']
+            vital.mount_opts = mount_opts
+            vital.crypt_flags = crypt_flags
             self.history.put_vital(vital)
             if mount_point:
                 vital.upon = mount_point
 
+    def mount_options(self, vital):
+        """ The mount options of a container: its own, else the [mount] defaults """
+        if vital and vital.mount_opts:
+            return vital.mount_opts
+        return self.ini_tool.get_current_val('options', 'mount')
+
     @staticmethod
     def get_auto_mount_root():
         """ TBD """
@@ -789,8 +1172,7 @@ class LuksTray():
             if not os.path.isdir(auto_root):
                 assert False, f"auto_mount_folder ({auto_root!r}) exists but is not a directory"
         else:
-            # os.makedirs(auto_root)
-            run_cmd(['mkdir', auto_root])
+            os.makedirs(auto_root, exist_ok=True)
 
         for loop in range(30):
             full = petname.Generate(2, separator='_')   # e.g., 'stoic_turing'
@@ -808,7 +1190,8 @@ class LuksTray():
 
     @staticmethod
     def remove_if_auto(mount):
-        """Remove target_dir if it is empty and within parent_dir"""
+        """Remove target_dir if it is empty and within parent_dir
+        (it runs a command: call it off the GUI thread)"""
         parent_dir = LuksTray.get_auto_mount_root()
         target_dir = os.path.abspath(mount)
 
@@ -825,8 +1208,15 @@ class LuksTray():
 
     def remove_unused_automounts(self):
         """ A startup function (could be periodic) that cleans up the
-            auto mount folder
+            auto mount folder (on the operation pool, since the removals
+            run commands)
         """
+        self.operations.start('remove_unused_automounts', 'Remove unused automounts',
+                              lambda _: self._remove_unused_automounts())
+
+    @staticmethod
+    def _remove_unused_automounts():
+        """ (worker thread) see remove_unused_automounts() """
         parent_dir = LuksTray.get_auto_mount_root()
 
         try:
@@ -891,6 +1281,7 @@ class CommonDialog(QDialog):
         self.inputs = {}
         self.progress_label = None
         self.progress_bar = None
+        self.operation_key = None # of our operation in flight (see run_operation())
         self.get_real_user_home_directory() # populate home/vault dir
 
     def set_title(self, title):
@@ -974,11 +1365,45 @@ class CommonDialog(QDialog):
         label = QLabel(text)
         self.main_layout.addWidget(label)
 
+    def add_crypt_details(self, mapper):
+        """ Adds a line on the dm-crypt flags active on mapper, filled in
+            when they arrive from the pool (hidden if unknown) """
+        if not mapper:
+            return
+        label = QLabel('dm-crypt: ...')
+        self.main_layout.addWidget(label)
+        details = []
+        def on_done(_):
+            try:
+                if details and details[0]:
+                    label.setText(details[0])
+                else:
+                    label.hide()
+            except RuntimeError:
+                pass # the dialog is gone already
+        LuksTray.singleton.operations.start(f'crypt_details {mapper}', 'Get dm-crypt flags',
+                lambda _: details.append(LuksTray.crypt_details(mapper)), on_done=on_done)
+
+    def add_crypt_flags(self, crypt_flags, path=''):
+        """ Adds a row of checkboxes for the dm-crypt flags (checked per
+            crypt_flags) and, unless path has a LUKS1 header, one to store
+            them in the LUKS2 header """
+        names = list(CryptFlags.FLAGS)
+        self.add_input_field(names, [CryptFlags.FLAGS[name][2] for name in names],
+                             '', 48, field_type='checkbox')
+        for name in CryptFlags.split(crypt_flags):
+            self.inputs[name].setChecked(True)
+        info = header_cache.get(path) if path else None
+        if not info or info.version == 2:
+            self.add_input_field('crypt_persist', "Store Flags in LUKS2 Header",
+                                 '', 48, field_type='checkbox')
+
     def add_push_button(self, label, method, arg=None):
         """ TBD """
         button = QPushButton(label)
         button.clicked.connect(lambda: method(arg))
         self.button_layout.addWidget(button)
+        return button
 
     def add_input_field(self, keys, label_texts, placeholder_texts, char_width=5,
                        field_type='text', add_on=''):
@@ -1122,7 +1547,12 @@ class CommonDialog(QDialog):
             self.hide_password()
 
     def cancel(self, _=None):
-        """ null function"""
+        """ Cancel our operation in flight (it is rolled back after its
+            current step), else close the dialog """
+        if self.operation_key is not None:
+            LuksTray.singleton.operations.cancel(self.operation_key)
+            self.progress_label.setText('Cancelling (undoing the steps done)...')
+            return
         self.reject()
 
     def alert_errors(self, error_lines):
@@ -1143,33 +1573,76 @@ class CommonDialog(QDialog):
             self.activateWindow()
 
     def show_progress(self, message):
-        """Show progress indicator and disable buttons."""
+        """Show progress indicator and disable buttons (but Cancel)."""
         for button in self.findChildren(QPushButton):
-            button.setEnabled(False)
+            button.setEnabled(button.text() == 'Cancel')
 
         if not self.progress_label:
             self.progress_label = QLabel()
             self.progress_bar = QProgressBar()
-            self.progress_bar.setRange(0, 100)  # Indeterminate
-            self.progress_bar.setValue(10)
             self.main_layout.addWidget(self.progress_label)
             self.main_layout.addWidget(self.progress_bar)
 
+        self.progress_bar.setRange(0, 0)  # Indeterminate until the first step
         self.progress_label.setText(message)
         self.progress_label.show()
         self.progress_bar.show()
-        # Force UI update before starting potentially slow operation
-        QApplication.processEvents()
+
+    def set_progress(self, message, index, count, name):
+        """ Show that step index (of count) named name is starting """
+        self.progress_bar.setRange(0, count)
+        self.progress_bar.setValue(index)
+        self.progress_label.setText(f'{message} [{index + 1}/{count}: {name}]')
 
     def hide_progress(self):
         """Hide progress indicator and re-enable buttons."""
-        if hasattr(self, 'progress_label'):
+        if self.progress_label:
             self.progress_label.hide()
             self.progress_bar.hide()
 
         for button in self.findChildren(QPushButton):
             button.setEnabled(True)
 
+    def run_operation(self, key, message, work, on_done):
+        """ Run work(op) off the GUI thread (see Operations.py) showing
+            its progress; on_done(result) is then called on the GUI
+            thread. Returns False if key is busy with another operation.
+        """
+        self.show_progress(message)
+        def done(result):
+            self.operation_key = None
+            self.hide_progress()
+            on_done(result)
+        def progress(index, count, name):
+            self.set_progress(message, index, count, name)
+        if not LuksTray.singleton.operations.start(key, message.rstrip('.').lower(),
+                                                   work, progress, done):
+            self.hide_progress()
+            self.alert_errors([f'ERR: {key} has another operation in flight'])
+            return False
+        self.operation_key = key
+        return True
+
+    def done(self, r):
+        """ Closing with an operation in flight cancels it instead (the
+            dialog closes when the user closes it again) """
+        if self.operation_key is not None:
+            self.cancel()
+            return
+        super().done(r)
+
+    def file_mount_point(self, path, back_file):
+        """ The mount point of a crypt file given the "Mount At" path; the
+            vault folder itself means a folder in it named for the file """
+        if path != self.vault_dir:
+            return path
+        basename = os.path.basename(back_file)
+        for suffix in ('.luks', '.luks2', '.crypt'):
+            if basename.endswith(suffix):
+                if len(basename) > len(suffix):
+                    basename = basename[:-len(suffix)]
+        return os.path.join(self.vault_dir, basename)
+
     @staticmethod
     def check_upon(text, mount_points, is_device=False):
         """ Validate candidate mount point.
@@ -1211,51 +1684,70 @@ class CommonDialog(QDialog):
     ####################################################
     # LUKS Primitives
     ####################################################
-    def _unlock_luks(self, device_path, password, luks_device, readonly=False):
-        """Common LUKS unlock logic"""
+    def _unlock_luks(self, device_path, password, luks_device, readonly=False,
+                     crypt_flags='', persistent=False):
+        """Common LUKS unlock logic: the pipeline steps to open the device
+        with the dm-crypt flags (see CryptFlags.py), stored in the LUKS2
+        header too if persistent (but not when opening read-only)"""
         if hasattr(self, 'opened') and self.opened:
-            return None  # Already unlocked
+            return []  # Already unlocked
         args = ['cryptsetup', 'open', '--type', 'luks']
         if readonly:
             args.append('--readonly')
+        args += CryptFlags.open_args(crypt_flags, persistent and not readonly)
         args += ['--key-file', '-', device_path, luks_device]
-        return sudo_cmd(args, input_str=password)
-
-
-    def _mount_manual(self, tray, mapper_path, upon, do_bindfs=False, readonly=False):
-        """Manual mounting with bindfs"""
-        if readonly:
-            err = sudo_cmd(['mount', '-o', 'ro', mapper_path, upon])
+        return [make_step(args, input_str=password,
+                          undo=['cryptsetup', 'close', luks_device])]
+
+
+    def _mount_manual(self, tray, mapper_path, upon, do_bindfs=False, readonly=False,
+                      mount_opts=''):
+        """Manual mounting: the pipeline steps. With do_bindfs, the mount
+        is overmounted to be owned by the user: natively if native ops
+        are active (an idmapped bind; see Native.idmap_mount()) with bindfs
+        as the fallback, else with bindfs"""
+        options = MountOptions.merge(mount_opts, readonly)
+        if options:
+            steps = [make_step(['mount', '-o', options, mapper_path, upon],
+                               undo=['umount', upon])]
         else:
-            err = sudo_cmd(['mount', mapper_path, upon])
-        if do_bindfs and not err:
-            err = sudo_cmd(['bindfs', '-u', str(tray.uid), '-g', str(tray.gid),
-                          upon, upon])
-        return err
-
-    def _setup_loop_device(self, container):
-        """Set up loop device for file-based containers"""
-        if hasattr(self, 'opened') and self.opened:
-            return None, f'/dev/{container.name}'
-
-        # Use --show to get the loop device name
-        result = sudo_cmd(['losetup', '-f', '--show', container.back_file])
-        if result.startswith('FAIL:'):
-            return result, None
-
-        loop_device = result.strip()
-        # Update container.name to match the loop device (e.g., 'loop0')
-        container.name = os.path.basename(loop_device)
-
-        return None, loop_device
+            steps = [make_step(['mount', mapper_path, upon], undo=['umount', upon])]
+        if do_bindfs:
+            bindfs = make_step(['bindfs', '-u', str(tray.uid), '-g', str(tray.gid),
+                          upon, upon], undo=['umount', upon])
+            if LuksTray.native_active():
+                steps.append(make_step(['idmap', f'{tray.uid}:{tray.gid}', upon],
+                              undo=['umount', upon], fallback=bindfs))
+            else:
+                steps.append(bindfs)
+        return steps
+
+    def _setup_loop_device(self, tray, back_file, readonly=False):
+        """Set up loop device for file-based containers: returns (steps,
+        device path); the path is "{loop}" until the steps run. Per the
+        'loop_direct_io' option, the loop does direct I/O (so the file's
+        blocks are not cached twice: for the file and for the filesystem
+        on it) with a logical block size of the LUKS sector size; if the
+        backing filesystem refuses, a plain attach is the fallback."""
+        args = ['losetup', '-f', '--show'] + (['-r'] if readonly else [])
+        undo = ['losetup', '-d', '{loop}']
+        plain = make_step(args + [back_file], undo=undo, capture='loop')
+        if not tray.ini_tool.get_current_val('loop_direct_io'):
+            return [plain], '{loop}'
+        info = header_cache.get(back_file)
+        sector_size = info.sector_size if info else 512
+        return [make_step(args + ['--direct-io=on', '--sector-size', str(sector_size),
+                                  back_file], undo=undo, capture='loop', fallback=plain)], '{loop}'
 
     ####################################################
     # LUKS Generic Mounter
     ####################################################
     def mount_luks_container(self, tray, container, password, upon=None, luks_device=None,
-                            readonly=False, luks_file=None, size=None):
+                            readonly=False, luks_file=None, size=None, op=None,
+                            mount_opts='', crypt_flags='', persistent=False, tuning=None):
         """
         Unified function to mount any LUKS container (device or file).
+        Safe to run off the GUI thread (see run_operation()).
 
         Args:
             container: Container object
@@ -1264,6 +1756,11 @@ class CommonDialog(QDialog):
             luks_device: Device mapper name (for devices)
             luks_file: Path to LUKS file (for files)
             size: Size for new file creation
+            op: the Operation running this (for progress and cancel), if any
+            mount_opts: mount options (e.g., 'noatime,commit=60')
+            crypt_flags: dm-crypt flags (e.g., 'no_read_workqueue,allow_discards')
+            persistent: whether to store crypt_flags in the LUKS2 header
+            tuning: sector size, unlock time, etc. for a new file (see CryptCreate.py)
         """
         assert upon, "cannot specify empty mount point"
         try:
@@ -1290,14 +1787,24 @@ class CommonDialog(QDialog):
                         err = run_cmd(['touch', luks_file])
                     if not err:
                         err = sudo_cmd(['truncate', '-s', f'{size}M', luks_file])
+                    tuning = tuning if tuning else CryptCreate.settings(tray.ini_tool)
+                    cipher = tuning.cipher
+                    if not err and cipher == 'auto':
+                        if op:
+                            op.progress(0, 1, 'cryptsetup benchmark')
+                        cipher = CryptCreate.choose_cipher(CryptCreate.cached_benchmarks(
+                                tray.ini_tool.cipher_bench_path, op.cancel if op else None))
+                    if not err and op:
+                        op.progress(0, 1, 'cryptsetup luksFormat')
                     if not err:
                         # Execute the cryptsetup command directly
                         args = ['cryptsetup', 'luksFormat', '--type', 'luks2']
+                        args += CryptCreate.format_args(tuning, cipher)
                         args += ['--batch-mode', '--key-file', '-', luks_file]
-                        sub = subprocess.run(args, input=f'{password}',
-                             check=True, capture_output=True, text=True)
-                        if sub.returncode != 0:
-                            err = f'FAIL: {' '.join(args)}: {sub.stdout} {sub.stderr} [rc={sub.returncode}]'
+                        err = run_cmd(args, input_str=f'{password}',
+                                      cancel=op.cancel if op else None)
+                    if err:
+                        return err
                     needs_filesystem = True
             else:
                 # Handle device container setup
@@ -1305,27 +1812,34 @@ class CommonDialog(QDialog):
                 device_path = f'/dev/{container.name}'
                 needs_filesystem = False
 
-                # Setup loop device if needed
-                if hasattr(container, 'back_file') and container.back_file:
-                    err, device_path = self._setup_loop_device(container)
-                    if err:
-                        return err
+            # the rest is one transaction: if a step fails, the ones
+            # done are undone (e.g., the loop device detached)
+            steps = []
+            if is_file_container:
+                # attach its loop device here rather than leave it to cryptsetup
+                # (for direct I/O and the block size)
+                steps, device_path = self._setup_loop_device(tray, luks_file, readonly)
+            elif container.back_file:
+                steps, device_path = self._setup_loop_device(tray, container.back_file, readonly)
 
             # Manual mounting always: unlock with cryptsetup, then mount manually
-            err = self._unlock_luks(device_path, password, luks_device, readonly=readonly)
-            if err:
-                return err
+            steps += self._unlock_luks(device_path, password, luks_device, readonly=readonly,
+                                       crypt_flags=crypt_flags, persistent=persistent)
 
             mapper_path = f'/dev/mapper/{luks_device}'
 
             # Create filesystem if needed (for new files)
             if needs_filesystem:
-                err = sudo_cmd(['mkfs.ext4', mapper_path])
-                if err:
-                    return err
-
-            err = self._mount_manual(tray, mapper_path, upon,
-                    do_bindfs=bool(luks_file), readonly=readonly)
+                steps.append(make_step(CryptCreate.mkfs_args(tray.uid, tray.gid,
+                        int(size), tuning.sector_size) + [mapper_path]))
+
+            steps += self._mount_manual(tray, mapper_path, upon,
+                    do_bindfs=bool(luks_file), readonly=readonly, mount_opts=mount_opts)
+            err, captures = sudo_pipeline(steps, op.progress if op else None,
+                                          op.cancel if op else None)
+            if 'loop' in captures and not err and not is_file_container:
+                # Update container.name to match the loop device (e.g., 'loop0')
+                container.name = os.path.basename(captures['loop'])
             return err
 
         except Exception as e:
@@ -1363,14 +1877,14 @@ class MasterPasswordDialog(CommonDialog):
                     tray.history.master_password = ''
                     errs.append(f'failed to unlock {repr(tray.history.path)}')
             else:
-                err = tray.history.save(force=True)
+                err = tray.history.save(force=True, sync=True)
                 if err:
                     errs.append(err)
                 else:
                     tray.history.status = 'clear_text'
         elif tray.history.status in ('unlocked', 'clear_text'):
             tray.history.master_password = password
-            err = tray.history.save(force=True)
+            err = tray.history.save(force=True, sync=True)
             if err:
                 tray.history.master_password = ''
                 errs.append(err)
@@ -1398,6 +1912,7 @@ class MountDeviceDialog(CommonDialog):
             # self.setFixedSize(300, 200)
             self.add_line(f'{container.name}')
             self.add_line(f'Unmount {",".join(mounts)}?')
+            self.add_crypt_details(container.filesystems[0].name)
             self.add_push_button('OK', self.unmount_device, container.uuid)
             self.add_push_button('Cancel', self.cancel)
             self.main_layout.addLayout(self.button_layout)
@@ -1407,6 +1922,8 @@ class MountDeviceDialog(CommonDialog):
             # self.setFixedSize(300, 200)
             self.add_line(f'{container.name}')
             self.add_line(f'Close {",".join(mounts)}?')
+            if container.filesystems:
+                self.add_crypt_details(container.filesystems[0].name)
             self.add_push_button('OK', self.unmount_device, container.uuid)
             self.add_push_button('Cancel', self.cancel)
             self.main_layout.addLayout(self.button_layout)
@@ -1421,8 +1938,10 @@ class MountDeviceDialog(CommonDialog):
             if not vital.upon:
                 where = os.path.join(self.vault_dir, container.name)
             self.add_input_field('upon', "Mount At", where, 36, add_on='folder')
+            self.add_input_field('mount_opts', "Mount Options", tray.mount_options(vital), 36)
             self.add_input_field('readonly', "Read-only",
                                  '', 48, field_type='checkbox')
+            self.add_crypt_flags(vital.crypt_flags, f'/dev/{container.name}')
             if container.size_str:
                 self.add_line(f'Size: {container.size_str}')
             if container.label:
@@ -1464,8 +1983,12 @@ class MountDeviceDialog(CommonDialog):
                 err = self.check_upon(text, mount_points, is_device=True)
                 if err:
                     errs.append(err)
-            elif key == 'readonly':
-                values[key] = field.isChecked()
+            elif key == 'mount_opts':
+                err = MountOptions.validate(text, tray.history.get_vital(uuid).fstype)
+                if err:
+                    errs.append(err)
+            elif key == 'readonly' or isinstance(field, QCheckBox):
+                values[key] = field.isChecked() # incl. the dm-crypt flags
             else:
                 errs.append(f'ERR: unknown key({key})')
 
@@ -1475,30 +1998,32 @@ class MountDeviceDialog(CommonDialog):
             luks_device = container.filesystems[0].name
 
 
-        # Proceed with mounting if no errors
-        if len(errs) <= 1:
-            mount_point = values['upon']
+        if len(errs) > 1:
+            self.alert_errors(errs)
+            return
+
+        # Proceed with mounting (off the GUI thread)
+        mount_point = values['upon']
+        def work(op):
             if mount_point and not os.path.exists(mount_point):
                 # os.makedirs(mount_point, exist_ok=True)
                 sudo_cmd(['mkdir', '-p', mount_point])
+            return self.mount_luks_container(tray, container, values['password'],
+                    upon=mount_point, readonly=values['readonly'], luks_device=luks_device,
+                    op=op, mount_opts=values['mount_opts'],
+                    crypt_flags=CryptFlags.from_values(values),
+                    persistent=values.get('crypt_persist', False))
 
-            self.hide_password()
-            self.show_progress('Mount device...')
-            err = self.mount_luks_container(tray, container, values['password'],
-                    upon=mount_point, readonly=values['readonly'], luks_device=luks_device)
-            self.hide_progress()
-
+        def on_done(err):
             if err:
-                errs.append(err)
-
-        if len(errs) > 1:
-            self.alert_errors(errs)
-            return
-
-        tray.update_history(uuid, values)
+                self.alert_errors(errs + [err])
+                return
+            tray.update_history(uuid, values)
+            tray.update_menu()
+            self.accept()
 
-        tray.update_menu()
-        self.accept()
+        self.hide_password()
+        self.run_operation(uuid, 'Mount device...', work, on_done)
 
     def unmount_device(self, uuid):
         """Attempt to unmount the partition."""
@@ -1506,45 +2031,43 @@ class MountDeviceDialog(CommonDialog):
         errs, container = [], None
         tray = LuksTray.singleton
         container = tray.containers.get(uuid, None)
+        if not container:
+            return
         errs.append(f'{container.name}')
 
-        # Show progress - disable buttons and add progress indicator
-        self.show_progress("Unmount/Close device...")
-
         tray.update_mounts()
-        busy_warns = set()
+        busy_warns = {}
+        filesystem = container.filesystems[0] if container.filesystems else None
+        mounts = [mount for fs in container.filesystems for mount in fs.mounts
+                  if tray.is_mounted(mount)]
 
-        if container:
+        def work(_):
             unmounteds = []
-            filesystem = ''
-            for fs in container.filesystems:
-                if not filesystem:
-                    filesystem = fs
-                for mount in fs.mounts:
-                    ### self.kill_bindfs_on_mount(mount)
-                    if tray.is_mounted(mount):
-                        err = run_unmount(mount, busy_warns)
-                        if err:
-                            errs.append(err)
-                        else:
-                            unmounteds.append(mount)
+            for mount in mounts:
+                ### self.kill_bindfs_on_mount(mount)
+                err = run_unmount(mount, busy_warns)
+                if err:
+                    errs.append(err)
+                else:
+                    unmounteds.append(mount)
 
-            if len(errs) <= 1:
+            if len(errs) <= 1 and filesystem:
                 sudo_cmd(["cryptsetup", "close", filesystem.name], errs)
             if len(errs) <= 1:
                 for mount in unmounteds:
                     LuksTray.remove_if_auto(mount)
+            return errs[1:]
+
+        def on_done(failures):
+            if failures:
+                show_busy_warnings(busy_warns)
+                if not busy_warns:
+                    self.alert_errors(errs)
+                return # don't close dialog box
+            tray.update_menu()
+            self.accept()
 
-        # Hide progress indicator
-        self.hide_progress()
-
-        if len(errs) > 1:
-            if not busy_warns:
-                self.alert_errors(errs)
-            return # don't close dialog box
-
-        tray.update_menu()
-        self.accept()
+        self.run_operation(uuid, 'Unmount/Close device...', work, on_done)
 
 class MountFileDialog(CommonDialog):
     """ TBD """
@@ -1561,6 +2084,10 @@ class MountFileDialog(CommonDialog):
             else:
                 self.set_title('Close Crypt File [luks-tray]')
                 self.add_line(f'{container.back_file}')
+            details = tray.loop_details(container)
+            if details:
+                self.add_line(details)
+            self.add_crypt_details(container.name)
             self.add_push_button('OK', self.unmount_file, container.uuid)
             self.add_push_button('Cancel', self.cancel)
             self.main_layout.addLayout(self.button_layout)
@@ -1573,8 +2100,10 @@ class MountFileDialog(CommonDialog):
                                 24, add_on='password')
             where = vital.upon if vital.upon else self.vault_dir
             self.add_input_field('upon', "Mount At", where, 36, add_on='folder')
+            self.add_input_field('mount_opts', "Mount Options", tray.mount_options(vital), 36)
             self.add_input_field('readonly', "Read-only",
                                  '', 48, field_type='checkbox')
+            self.add_crypt_flags(vital.crypt_flags, container.back_file)
             if container.size_str:
                 self.add_line(f'Size: {container.size_str}')
             if container.uuid:
@@ -1593,8 +2122,10 @@ class MountFileDialog(CommonDialog):
             # where = LuksTray.generate_auto_mount_folder()
             # self.add_input_field('upon', "Mount At", where, 36, add_on='folder')
             self.add_input_field('upon', "Mount At", self.vault_dir, 36, add_on='folder')
+            self.add_input_field('mount_opts', "Mount Options", tray.mount_options(None), 36)
             self.add_input_field('readonly', "Read-only",
                                  '', 48, field_type='checkbox')
+            self.add_crypt_flags('')
 
             self.add_push_button('OK', self.mount_file, None)
             self.add_push_button('Cancel', self.cancel)
@@ -1606,11 +2137,17 @@ class MountFileDialog(CommonDialog):
             self.add_input_field('password', "Enter Password", '',
                                 24, add_on='password')
             self.add_input_field('size_str', "Size (MiB)", '32', 8)
+            tuning = CryptCreate.settings(tray.ini_tool)
+            self.add_input_field(['sector_size', 'unlock_ms'], ["Sector Size", "Unlock Time (ms)"],
+                                 [str(tuning.sector_size), str(tuning.unlock_ms)], 6)
+            self.add_input_field('cipher', "Cipher", tuning.cipher, 30)
             self.add_input_field('back_file', "Crypt File", self.dot_vault_dir, 48, add_on='new_file')
             self.add_input_field('overwrite_ok', "Enable Overwrite of Existing File",
                                  '', 48, field_type='checkbox')
             # where = LuksTray.generate_auto_mount_folder()
             self.add_input_field('upon', "Mount At", self.vault_dir, 36, add_on='folder')
+            self.add_input_field('mount_opts', "Mount Options", tray.mount_options(None), 36)
+            self.add_crypt_flags('')
 
             self.add_push_button('OK', self.mount_file, None)
             self.add_push_button('Cancel', self.cancel)
@@ -1625,40 +2162,45 @@ class MountFileDialog(CommonDialog):
         errs, container = [], None
         tray = LuksTray.singleton
         container = tray.containers.get(uuid, None)
-        self.show_progress('Unmount/Close crypt file...')
-        busy_warns = set()
-        if container:
-            if container.mounts:
+        if not container:
+            return
+        busy_warns = {}
+
+        def work(_):
+            for mount in container.mounts:
                 for _ in range(2):
-                    # it may take two dismounts, one for the regular mount, and
-                    # one for the bindfs mount
-                    tray.update_mounts()
-                    for mount in container.mounts:
-                        if tray.is_mounted(mount):
-                            err = run_unmount(mount, busy_warns)
-                            if err:
-                                errs.append(err)
-                            else:
-                                LuksTray.remove_if_auto(mount)
-
-                    if busy_warns:
+                    # it may take two dismounts, one for the idmapped (or bindfs) mount,
+                    # and one for the regular mount (beneath it)
+                    if not os.path.ismount(mount):
                         break
+                    err = run_unmount(mount, busy_warns)
+                    if err:
+                        errs.append(err)
+                        break
+                if not os.path.ismount(mount):
+                    LuksTray.remove_if_auto(mount)
+                if busy_warns:
+                    break
 
             if not errs:
                 sudo_cmd(["cryptsetup", "close", container.name], errs=errs)
-                    # If this is a file container with a loop device, detach it
-            if not errs and container.back_file:
-                ignores = []
-                sudo_cmd(["losetup", "-d", f"/dev/{container.name}"], errs=ignores)
-
-        self.hide_progress()
+            # If this is a file container with a loop device, detach it
+            loop = getattr(container.parent, 'name', container.parent) or ''
+            if not errs and container.back_file and loop.startswith('loop'):
+                ignores = [] # e.g., cryptsetup's own loop (autoclear) is gone already
+                sudo_cmd(["losetup", "-d", f"/dev/{loop}"], errs=ignores)
+            return errs
+
+        def on_done(failures):
+            tray.update_menu()
+            if failures:
+                show_busy_warnings(busy_warns)
+                if not busy_warns:
+                    self.alert_errors(errs)
+            else:
+                self.accept()
 
-        tray.update_menu()
-        if errs:
-            if not busy_warns:
-                self.alert_errors(errs)
-        else:
-            self.accept()
+        self.run_operation(uuid, 'Unmount/Close crypt file...', work, on_done)
 
     def mount_file(self, uuid):
         """ TBD """
@@ -1701,9 +2243,10 @@ class MountFileDialog(CommonDialog):
                 dirname = os.path.dirname(path)
                 if not os.path.isdir(dirname):
                     if os.path.basename(dirname) == self.dot_vault_dir:
-                        err = run_cmd(['mkdir', '-p', dirname])
-                        if err:
-                            errs.append(err)
+                        try:
+                            os.makedirs(dirname, exist_ok=True)
+                        except OSError as e:
+                            errs.append(f'ERR: cannot create {dirname}: {e}')
                 if not os.path.isdir(os.path.dirname(dirname)):
                     errs.append(f'ERR: Crypt File {path} must be in an existing directory')
 
@@ -1711,13 +2254,7 @@ class MountFileDialog(CommonDialog):
                 path = os.path.abspath(text)
                 if 'back_file' in values or container.back_file:
                     back_file = container.back_file if container.back_file else values['back_file']
-                    if path == self.vault_dir:
-                        basename = os.path.basename(back_file)
-                        for suffix in ('.luks', '.luks2', '.crypt'):
-                            if basename.endswith(suffix):
-                                if len(basename) > len(suffix):
-                                    basename = basename[:-len(suffix)]
-                        path = os.path.join(self.vault_dir, basename)
+                    path = self.file_mount_point(path, back_file)
 
                 mount_point = path
                 err = self.check_upon(path, mount_points)
@@ -1726,6 +2263,14 @@ class MountFileDialog(CommonDialog):
 
             elif key == 'readonly':
                 pass
+            elif key == 'mount_opts':
+                # a new crypt file gets ext4; else, what it had when last opened
+                fstype = 'ext4' if 'size_str' in self.inputs else ''
+                if not fstype and uuid:
+                    fstype = tray.history.get_vital(uuid).fstype
+                err = MountOptions.validate(text, fstype)
+                if err:
+                    errs.append(err)
             elif key == 'size_str':
                 try:
                     size_str = values.get('size_str', None)
@@ -1734,11 +2279,26 @@ class MountFileDialog(CommonDialog):
                         errs.append(f'at least 32 expected ... invalid size ({megs})')
                 except Exception:
                     errs.append(f'"int" expected ... invalid size ({size_str})')
+            elif key in ('sector_size', 'unlock_ms', 'cipher'):
+                pass # checked together below
 
 
             else:
                 errs.append(f'ERR: unknown key({key})')
 
+        tuning = None
+        if 'cipher' in values:
+            tuning = CryptCreate.settings(tray.ini_tool)
+            tuning.cipher = values['cipher'] or 'auto'
+            try:
+                tuning.sector_size = int(values['sector_size'])
+                tuning.unlock_ms = int(values['unlock_ms'])
+                err = CryptCreate.validate(tuning)
+            except ValueError:
+                err = 'ERR: sector size and unlock time must be numbers'
+            if err:
+                errs.append(err)
+
         if len(errs) <= 1:
             if container.back_file:
                 back_file = container.back_file
@@ -1750,30 +2310,214 @@ class MountFileDialog(CommonDialog):
                 if os.path.exists(back_file) and not overwrite_ok:
                     errs.append(f'cannot overwrite {back_file!r} w/o checking allowed')
 
-        if len(errs) <= 1:
-            self.show_progress('Mount file...')
+        if len(errs) > 1:
+            self.alert_errors(errs)
+            # self.accept()
+            return
+
+        def work(op):
+            err = None
             if mount_point and not os.path.exists(mount_point):
                 # os.makedirs(mount_point, exist_ok=True)
                 err = run_cmd(['mkdir', '-p', mount_point])
             if not err:
                 err = self.mount_luks_container(tray, container, values['password'],
-                        mount_point, readonly=values['readonly'],
-                        luks_file=back_file, size=values.get('size_str', None))
-                self.hide_progress()
+                        mount_point, readonly=values.get('readonly', False),
+                        luks_file=back_file, size=values.get('size_str', None), op=op,
+                        mount_opts=values.get('mount_opts', ''),
+                        crypt_flags=CryptFlags.from_values(values),
+                        persistent=values.get('crypt_persist', False), tuning=tuning)
+            return err
 
+        def on_done(err):
             if err:
-                errs.append(err)
-        if len(errs) > 1:
-            self.alert_errors(errs)
-            # self.accept()
+                self.alert_errors(errs + [err])
+                return
+            # update history with new values if mount worked
+            tray.update_history(uuid, values)
+            tray.update_menu()
+            self.accept()
+
+        self.run_operation(uuid if uuid else back_file, 'Mount file...', work, on_done)
+
+
+class UnlockAllDialog(CommonDialog):
+    """ Mounts several containers at once with their saved passwords and
+        mount points; shows their aggregate progress and then a line of
+        result per container """
+    def __init__(self, containers):
+        super().__init__()
+        tray = LuksTray.singleton
+        self.set_title('Unlock All Known [luks-tray]')
+        self.get_real_user_home_directory()
+        self.rows, self.jobs = {}, []
+        self.fractions, self.errs, self.durations = {}, {}, {}
+        self.in_flight = set()
+        self.pool, self.size = None, 1
+        mount_points, chosen = tray.update_mounts(), set()
+        for container in containers:
+            name = container.back_file if container.back_file else container.name
+            vital, upon = container.vital, container.vital.upon
+            if container.back_file:
+                upon = self.file_mount_point(os.path.abspath(upon), container.back_file)
+            err = self.check_upon(upon, mount_points, is_device=not container.back_file)
+            if not err and upon in chosen:
+                err = f'ERR: mount point ({upon}) is also that of another container'
+            row = QLabel(f'   {name} → {upon}')
+            self.main_layout.addWidget(row)
+            self.rows[container.uuid] = row
+            if err:
+                row.setText(f'–  {name}: skipped: {err}')
+                continue
+            chosen.add(upon)
+            self.jobs.append(SimpleNamespace(key=container.uuid, name=name, upon=upon,
+                                container=container, vital=vital))
+        self.add_push_button('OK', self.start_all)
+        self.close_button = self.add_push_button('Cancel', self.cancel)
+        self.main_layout.addLayout(self.button_layout)
+        self.setLayout(self.main_layout)
+
+    def start_all(self, _=None):
+        """ Start the unlocks on a pool sized for the cores and memory """
+        tray = LuksTray.singleton
+        if not self.jobs:
+            self.accept()
             return
+        paths = [job.container.back_file if job.container.back_file
+                 else f'/dev/{job.container.name}' for job in self.jobs]
+        headers = header_cache.get_many(paths)
+        self.size = unlock_pool_size([headers.get(path, None) for path in paths])
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(self.size)
+        self.show_progress('Unlocking...')
+        self.progress_bar.setRange(0, 1000)
+        for job in self.jobs:
+            if tray.operations.start(job.key, 'unlock', partial(self.unlock, job),
+                    partial(self.on_progress, job), partial(self.on_done, job),
+                    pool=self.pool):
+                self.in_flight.add(job.key)
+                self.fractions[job.key] = 0.0
+            else:
+                self.rows[job.key].setText(f'–  {job.name}: skipped: operation in flight')
+        self.update_summary()
 
-        # update history with new values if mount worked
-        tray.update_history(uuid, values)
+    def unlock(self, job, op):
+        """ (worker) mount one container; returns the error, if any """
+        start = time.perf_counter()
+        try:
+            if not os.path.exists(job.upon):
+                if job.container.back_file:
+                    err = run_cmd(['mkdir', '-p', job.upon])
+                else:
+                    err = sudo_cmd(['mkdir', '-p', job.upon])
+                if err:
+                    return err
+            luks_device = ''
+            if len(job.container.filesystems) == 1:
+                luks_device = job.container.filesystems[0].name
+            return self.mount_luks_container(LuksTray.singleton, job.container,
+                    job.vital.password, upon=job.upon, luks_device=luks_device,
+                    luks_file=job.container.back_file if job.container.back_file else None,
+                    op=op, mount_opts=LuksTray.singleton.mount_options(job.vital),
+                    crypt_flags=job.vital.crypt_flags)
+        finally:
+            self.durations[job.key] = time.perf_counter() - start
+
+    def on_progress(self, job, index, count, name):
+        """ A step of one unlock is starting """
+        self.fractions[job.key] = index / max(count, 1)
+        self.rows[job.key].setText(f'…  {job.name} → {job.upon}: {name}')
+        self.update_summary()
+
+    def on_done(self, job, err):
+        """ One unlock is done """
+        tray = LuksTray.singleton
+        self.in_flight.discard(job.key)
+        self.fractions[job.key] = 1.0
+        self.errs[job.key] = err
+        secs = self.durations.get(job.key, 0)
+        if err:
+            self.rows[job.key].setText(f'✗  {job.name}: {err.strip().splitlines()[0][:80]}')
+            self.rows[job.key].setToolTip(err)
+        else:
+            self.rows[job.key].setText(f'✓  {job.name} → {job.upon} ({secs:.1f}s)')
+            tray.update_history(job.key, {'password': job.vital.password, 'upon': job.vital.upon})
+        self.update_summary()
+        if not self.in_flight:
+            self.hide_progress()
+            for button in self.findChildren(QPushButton):
+                button.setEnabled(button is self.close_button)
+            self.close_button.setText('Close')
+            tray.update_menu()
+
+    def update_summary(self):
+        """ Show the aggregate progress """
+        total = max(len(self.fractions), 1)
+        failed = sum(1 for err in self.errs.values() if err)
+        self.progress_bar.setValue(int(sum(self.fractions.values()) / total * 1000))
+        self.progress_label.setText(f'Unlocked {len(self.errs) - failed} of {len(self.fractions)}'
+                + (f' ({failed} failed)' if failed else '')
+                + (f'; {len(self.in_flight)} in progress, {self.size} at a time'
+                   if self.in_flight else ''))
 
-        tray.update_menu()
-        self.accept()
+    def cancel(self, _=None):
+        """ Cancel the unlocks in flight (each is rolled back after its
+            current step), else close the dialog """
+        if self.in_flight:
+            for key in self.in_flight:
+                LuksTray.singleton.operations.cancel(key)
+            self.progress_label.setText('Cancelling (undoing the steps done)...')
+            return
+        self.reject()
 
+    def done(self, r):
+        """ Closing with unlocks in flight cancels them instead """
+        if self.in_flight:
+            self.cancel()
+            return
+        super().done(r)
+
+
+def show_stats(ini_tool, wait_secs=5):
+    """ Ask the running instance to dump its timings and print them.
+        Returns the exit code.
+    """
+    try:
+        with open(ini_tool.pid_path, 'r', encoding='utf-8') as f:
+            pid = int(f.read().strip())
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            argv = f.read().decode(errors='replace').split('\0')
+        # the pid may have been reused, and SIGUSR1 would kill most programs
+        if ('luks-tray' not in [os.path.basename(arg) for arg in argv[:2]]
+                and argv[1:3] != ['-m', 'luks_tray.main']):
+            raise ProcessLookupError
+    except (OSError, ValueError):
+        print('luks-tray does not appear to be running')
+        return 1
+    def get_mtime():
+        try:
+            return os.path.getmtime(ini_tool.stats_path)
+        except OSError:
+            return None
+    before = get_mtime()
+    try:
+        os.kill(pid, signal.SIGUSR1)
+    except OSError as e:
+        print(f'cannot signal luks-tray (pid={pid}): {e}')
+        return 1
+    deadline, report = time.monotonic() + wait_secs, None
+    while time.monotonic() < deadline:
+        if get_mtime() != before:
+            with open(ini_tool.stats_path, 'r', encoding='utf-8') as f:
+                report = f.read()
+            if STATS_PENDING not in report:
+                break
+        time.sleep(0.1)
+    if report is not None:
+        print(report.replace(STATS_PENDING, '(helper timings: no answer)'), end='')
+        return 0
+    print(f'no response from luks-tray (pid={pid})')
+    return 1
 
 def rerun_module_as_root(module_name):
     """ rerun using the module name """
@@ -1799,6 +2543,12 @@ def main():
             help='exec ${EDITOR:-vim} on config.ini file')
     parser.add_argument('--check-deps', action='store_true',
             help='check that necessary system programs are installed')
+    parser.add_argument('--stats', action='store_true',
+            help='print the timing stats of the running instance')
+    parser.add_argument('--bench-scan', type=int, metavar='COUNT', default=0,
+            help='time COUNT device scans with lsblk vs sysfs and exit')
+    parser.add_argument('--calibrate-kdf', type=int, metavar='MS', default=0,
+            help='suggest master-password KDF settings for ~MS unlocks and exit')
     opts = parser.parse_args()
 
     if opts.edit_config:
@@ -1810,9 +2560,22 @@ def main():
         sys.exit(1) # just in case ;-)
 
     if opts.check_deps:
-        _, missing, _ = LuksTray.check_dependencies(verbose=True)
+        # no helper here, so only as root are the commands done natively
+        _, missing, _ = LuksTray.check_dependencies(verbose=True,
+                native=os.geteuid() == 0 and Native.available())
         sys.exit(1 if missing else 0) # just in case ;-)
 
+    if opts.stats:
+        sys.exit(show_stats(IniTool(paths_only=True)))
+
+    if opts.bench_scan:
+        bench_scan(opts.bench_scan)
+        sys.exit(0)
+
+    if opts.calibrate_kdf:
+        calibrate_kdf(opts.calibrate_kdf)
+        sys.exit(0)
+
     if opts.follow_log:
         ini_tool = IniTool(paths_only=True)
         args = ['tail', '-n50', '-F', ini_tool.log_path]